@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for xpathextractor.
+
+Usage: python benchmark_xpathextractor.py [BENCHMARK_NAME ...]
+
+With no arguments, runs every benchmark. Each benchmark prints its wall time
+and its peak Python memory allocation (as measured by tracemalloc).
+Benchmarks of parse trees, which lxml allocates outside of Python, print peak
+resident set size instead.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from xpathextractor import render, render_batches
+
+
+class Settings:
+    MAX_BYTES_PER_COLUMN_NAME: int = 100
+
+
+def _measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}: {elapsed:.3f}s, peak memory {peak / 1024 / 1024:.1f} MiB")
+
+
+def _table_page(i: int) -> str:
+    # Every page has a different set of columns, so the output table is the
+    # union of all of them. That's the worst case for concatenation.
+    headers = ["id", f"col{i % 50}", f"col{(i + 7) % 50}", "value"]
+    rows = "".join(
+        "<tr>" + "".join(f"<td>{i}-{r}-{c}</td>" for c in range(4)) + "</tr>"
+        for r in range(20)
+    )
+    return (
+        "<html><body><table><thead><tr>"
+        + "".join(f"<th>{h}</th>" for h in headers)
+        + "</tr></thead><tbody>"
+        + rows
+        + "</tbody></table></body></html>"
+    )
+
+
+def benchmark_table_differing_columns(n_pages=200):
+    table = pd.DataFrame({"html": [_table_page(i) for i in range(n_pages)]})
+    params = {"method": "table", "tablenum": 1, "colselectors": []}
+    _measure(
+        f"table_differing_columns[{n_pages} pages]",
+        lambda: render(table, params, settings=Settings()),
+    )
+
+
+def benchmark_xpath_fragments(n_rows=5000):
+    table = pd.DataFrame(
+        {
+            "html": [
+                f'<div class="card"><h1>Product {i}</h1>'
+                f'<a href="/p/{i}">Buy</a><span class="price">{i}.99</span></div>'
+                for i in range(n_rows)
+            ]
+        }
+    )
+    params = {
+        "method": "xpath",
+        "tablenum": 1,
+        "recordxpath": "",
+        "colselectors": [
+            {"colxpath": "//h1", "colname": "Title"},
+            {"colxpath": "//div[@class='card']//a/@href", "colname": "Link"},
+            {"colxpath": "//span[@class='price']", "colname": "Price"},
+        ],
+    }
+    _measure(
+        f"xpath_fragments[{n_rows} rows]",
+        lambda: render(table, params, settings=Settings()),
+    )
+
+
+def _large_page(i: int) -> str:
+    # ~100kb: lots of markup (a big tree) for little extracted text
+    cards = "".join(
+        f'<div class="card"><h2><a href="/p/{i}/{j}">Product {j}</a></h2>'
+        f'<p class="desc">{"Lorem ipsum dolor sit amet. " * 4}</p>'
+        f'<ul>{"<li><span>spec</span></li>" * 8}</ul></div>'
+        for j in range(200)
+    )
+    return f"<html><body><main>{cards}</main></body></html>"
+
+
+def benchmark_xpath_columns(n_pages=30):
+    """
+    Many columns on big pages: one XSLT pass vs one XPath call per column.
+    """
+    import xpathextractor
+
+    table = pd.DataFrame({"html": [_large_page(i) for i in range(n_pages)]})
+    params = {
+        "method": "xpath",
+        "tablenum": 1,
+        "recordxpath": "",
+        "colselectors": [
+            {"colxpath": "//h2/a", "colname": "Title"},
+            {"colxpath": "//h2/a/@href", "colname": "Link"},
+            {"colxpath": "//p[@class='desc']", "colname": "Description"},
+            {"colxpath": "//ul", "colname": "Specs"},
+            {"colxpath": "//main/div/h2", "colname": "Heading"},
+        ],
+    }
+    _measure(
+        f"xpath_columns[{n_pages} pages, XSLT]",
+        lambda: render(table, params, settings=Settings()),
+    )
+    for_selectors = xpathextractor.ColumnStylesheet.for_selectors
+    xpathextractor.ColumnStylesheet.for_selectors = lambda columns: None
+    try:
+        _measure(
+            f"xpath_columns[{n_pages} pages, XPath]",
+            lambda: render(table, params, settings=Settings()),
+        )
+    finally:
+        xpathextractor.ColumnStylesheet.for_selectors = for_selectors
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_large_pages_rss(n_pages=1000, batch_size=10000):
+    """
+    Stream links from many large pages; peak RSS should stay flat.
+
+    We print peak RSS after each quarter of the pages. If parse trees
+    outlived their rows (e.g., because extracted strings referenced them),
+    it would grow with the number of pages.
+    """
+    page = _large_page(0)
+    table = pd.DataFrame({"html": [page] * n_pages})
+    params = {
+        "method": "xpath",
+        "tablenum": 1,
+        "recordxpath": "",
+        "colselectors": [
+            {"colxpath": "//h2/a/@href", "colname": "Link"},
+            {"colxpath": "//h2/a/text()", "colname": "Title"},
+        ],
+    }
+    checkpoints = [n_pages * quarter // 4 for quarter in range(1, 5)]
+    start = time.perf_counter()
+    n_rows = 0
+    for batch, _ in render_batches(
+        table, params, settings=Settings(), batch_size=batch_size
+    ):
+        n_rows += len(batch)  # and discard the batch
+        while checkpoints and n_rows >= checkpoints[0] * 200:
+            print(
+                f"large_pages_rss[{n_pages} pages]: {checkpoints.pop(0)} pages done, "
+                f"peak RSS {_peak_rss_mib():.1f} MiB"
+            )
+    elapsed = time.perf_counter() - start
+    print(f"large_pages_rss[{n_pages} pages]: {elapsed:.3f}s")
+
+
+def _text_page(i: int) -> str:
+    # ~200kb: lots of text (a big str) for a small tree
+    return (
+        f"<html><body><h1>Page {i}</h1>"
+        f"<pre>{f'lorem ipsum dolor sit amet {i} ' * 7000}</pre></body></html>"
+    )
+
+
+def benchmark_arrow_file_rss(n_pages=500):
+    """
+    Render an Arrow file via pandas and via render_arrow_file(); print peak RSS.
+
+    Each run is a fresh interpreter, so peak RSS is that run's own. Reading
+    the file into pandas turns every page into a Python str first;
+    render_arrow_file() parses views of the memory-mapped file instead.
+    """
+    import pyarrow
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "input.arrow")
+        # Distinct pages, so Python can't share one str
+        table = pyarrow.table({"html": [_text_page(i) for i in range(n_pages)]})
+        with pyarrow.OSFile(path, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=50)
+        size_mib = os.path.getsize(path) / 1024 / 1024
+        del table
+
+        for name, render_call in [
+            (
+                "pandas",
+                "render(pyarrow.ipc.open_file(path).read_pandas(), params, "
+                "settings=Settings())",
+            ),
+            (
+                "render_arrow_file",
+                "render_arrow_file(path, params, settings=Settings())",
+            ),
+        ]:
+            code = (
+                "import sys, time, pyarrow\n"
+                "from benchmark_xpathextractor import Settings\n"
+                "from xpathextractor import render, render_arrow_file\n"
+                "path = sys.argv[1]\n"
+                "params = {'method': 'xpath', 'tablenum': 1, 'recordxpath': '', "
+                "'colselectors': [{'colxpath': '//h1', 'colname': 'Heading'}]}\n"
+                "start = time.perf_counter()\n"
+                f"result, _ = {render_call}\n"
+                # VmHWM, unlike ru_maxrss, isn't inherited from our process
+                "hwm = [l for l in open('/proc/self/status') if 'VmHWM' in l]\n"
+                "print(time.perf_counter() - start, len(result), "
+                "int(hwm[0].split()[1]) / 1024)\n"
+            )
+            elapsed, n_rows, peak_rss = subprocess.run(
+                [sys.executable, "-c", code, path],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout.split()
+            print(
+                f"arrow_file_rss[{n_pages} pages, {size_mib:.0f} MiB, {name}]: "
+                f"{float(elapsed):.3f}s, {n_rows} rows, "
+                f"peak RSS {float(peak_rss):.1f} MiB"
+            )
+
+
+def benchmark_import_time(n_runs=10):
+    """
+    Import xpathextractor in fresh interpreters; print the fastest time.
+
+    Workbench launches a fresh interpreter per render, so this is part of
+    every render's latency.
+    """
+    code = (
+        "import sys, time; start = time.perf_counter(); import xpathextractor; "
+        "print(time.perf_counter() - start, 'pandas' in sys.modules, "
+        "'html5lib' in sys.modules)"
+    )
+    times = []
+    for _ in range(n_runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+    print(
+        f"import_time[{n_runs} runs]: {min(times):.3f}s "
+        f"(loaded pandas: {output[1]}, html5lib: {output[2]})"
+    )
+
+
+def benchmark_server_small_renders(n_jobs=500, n_cold_runs=5):
+    """
+    Render a tiny table in fresh interpreters, then via a warm serve().
+    """
+    from xpathextractor import RenderClient
+
+    table = pd.DataFrame({"html": ['<div class="card"><h1>Product</h1></div>']})
+    params = {
+        "method": "xpath",
+        "tablenum": 1,
+        "recordxpath": "",
+        "colselectors": [{"colxpath": "//h1", "colname": "Title"}],
+    }
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    code = (
+        "import pandas as pd; from xpathextractor import render\n"
+        "class Settings: MAX_BYTES_PER_COLUMN_NAME = 100\n"
+        f"render(pd.DataFrame({table.to_dict('list')!r}), {params!r},"
+        " settings=Settings())\n"
+    )
+    start = time.perf_counter()
+    for _ in range(n_cold_runs):
+        subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True)
+    cold = (time.perf_counter() - start) / n_cold_runs
+    print(f"server_small_renders[fresh interpreter]: {cold * 1000:.1f}ms/render")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "server.sock")
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys, xpathextractor\n"
+                "class Settings: MAX_BYTES_PER_COLUMN_NAME = 100\n"
+                "xpathextractor.serve(sys.argv[1], settings=Settings())\n",
+                path,
+            ],
+            cwd=cwd,
+        )
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.1)
+            client = RenderClient(path)
+            start = time.perf_counter()
+            for _ in range(n_jobs):
+                client.render(table, params)
+            warm = (time.perf_counter() - start) / n_jobs
+        finally:
+            server.terminate()
+            server.wait()
+    print(f"server_small_renders[{n_jobs} jobs, server]: {warm * 1000:.1f}ms/render")
+
+
+BENCHMARKS = {
+    "table_differing_columns": benchmark_table_differing_columns,
+    "xpath_fragments": benchmark_xpath_fragments,
+    "large_pages_rss": benchmark_large_pages_rss,
+    "import_time": benchmark_import_time,
+    "arrow_file_rss": benchmark_arrow_file_rss,
+    "xpath_columns": benchmark_xpath_columns,
+    "server_small_renders": benchmark_server_small_renders,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        BENCHMARKS[name]()
@@ -1,9 +1,60 @@
 #!/usr/bin/env python3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os.path
+import pickle
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+from unittest.mock import patch
 import warnings
+import zlib
 import pandas as pd
 from pandas.testing import assert_frame_equal
-from xpathextractor import parse_document, select, xpath, render, migrate_params
+from lxml import etree
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None  # optional: render_arrow_file() and serve() need it
+import xpathextractor
+from xpathextractor import (
+    ColumnStylesheet,
+    ColumnUnionAccumulator,
+    DocumentTooLargeError,
+    ElementIndex,
+    ExtractionStats,
+    RenderClient,
+    RenderServerError,
+    ResultCache,
+    ShardResult,
+    extract_dataframe_by_zip,
+    extract_dataframe_by_zip_batch,
+    is_batchable_xpath,
+    parse_document,
+    parse_documents,
+    select,
+    SimpleSelector,
+    xpath,
+    render,
+    render_arrow_file,
+    render_async,
+    render_batches,
+    render_preview,
+    required_tag_names,
+    searches_whole_page,
+    TagPrefilter,
+    TableSummary,
+    table_inventory,
+    merge_shards,
+    migrate_params,
+    render_shard,
+)
 from cjwmodule.testing.i18n import cjwmodule_i18n_message, i18n_message
 
 
@@ -57,9 +108,7 @@ class Xml1(unittest.TestCase):
 
 
 class Html1(unittest.TestCase):
-    def setUp(self):
-        self.tree = parse_document(
-            """<!DOCTYPE html><html>
+    html = """<!DOCTYPE html><html>
               <head>
                 <meta charset="utf-16be">
                 <title>Hello, world!</title>
@@ -77,9 +126,10 @@ class Html1(unittest.TestCase):
                   <path d="M0 0L2 2"/>
                 </svg>
               </body>
-            </html>""",
-            True,
-        )
+            </html>"""
+
+    def setUp(self):
+        self.tree = parse_document(self.html, True)
 
     def select(self, selector):
         return select(self.tree, xpath(selector))
@@ -98,6 +148,13 @@ class Html1(unittest.TestCase):
         # Parse invalid HTML by adding missing elements
         self.assertEqual(self.select("//tr"), ["Single-cell table"])
 
+    def test_results_do_not_reference_tree(self):
+        # "Smart strings" reference their parent element, and so they would
+        # keep the whole tree alive as long as the output table
+        for selector in ["//a/@href", "//p/text()", "string(//title)"]:
+            for value in self.select(selector):
+                self.assertIs(type(value), str)
+
     def test_clean_insignificant_whitespace(self):
         tree = parse_document(
             '<html><body><p>\n  hi <b class="X"> !</b>\n</p></body></html>', True
@@ -106,6 +163,68 @@ class Html1(unittest.TestCase):
         self.assertEqual(result, ["hi  !"])
 
 
+class Html1Bytes(Html1):
+    # Same tests as Html1, parsing UTF-8 bytes. (The <meta charset="utf-16be">
+    # must be read as UTF-8, as per the HTML spec.)
+    def setUp(self):
+        self.tree = parse_document(self.html.encode("utf-8"), True)
+
+
+class Html1MemoryView(Html1):
+    def setUp(self):
+        self.tree = parse_document(memoryview(self.html.encode("utf-8")), True)
+
+
+class BytesInputTest(unittest.TestCase):
+    def test_default_utf8(self):
+        tree = parse_document("<p>café</p>".encode("utf-8"), True)
+        self.assertEqual(select(tree, xpath("//p")), ["café"])
+
+    def test_meta_charset(self):
+        tree = parse_document(
+            '<meta charset="iso-8859-1"><p>café</p>'.encode("latin-1"), True
+        )
+        self.assertEqual(select(tree, xpath("//p")), ["café"])
+
+    def test_explicit_encoding_overrides_meta(self):
+        tree = parse_document(
+            '<meta charset="utf-8"><p>café</p>'.encode("latin-1"),
+            True,
+            encoding="windows-1252",
+        )
+        self.assertEqual(select(tree, xpath("//p")), ["café"])
+
+    def test_fragment_root_like_str(self):
+        for html in ["<p>a</p>", "<p>a</p><p>b</p>", "hi", "<html><p>a</p></html>"]:
+            expected = parse_document(html, True)
+            result = parse_document(memoryview(html.encode("utf-8")), True)
+            self.assertEqual(
+                etree.tostring(result.getroottree()),
+                etree.tostring(expected.getroottree()),
+            )
+            self.assertEqual(result.tag, expected.tag)
+
+    def test_xml(self):
+        data = '<a><b foo="é">x</b></a>'.encode("utf-8")
+        tree = parse_document(memoryview(data), False)
+        self.assertEqual(select(tree, xpath("//b/@foo")), ["é"])
+
+    def test_xml_declared_encoding(self):
+        data = '<?xml version="1.0" encoding="iso-8859-1"?><a>é</a>'.encode("latin-1")
+        tree = parse_document(data, False)
+        self.assertEqual(select(tree, xpath("/a")), ["é"])
+
+    def test_render_bytes(self):
+        table = pd.DataFrame({"html": ["<h1>café</h1>".encode("utf-8"), None]})
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//h1", "colname": "Title"}],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(out, pd.DataFrame({"Title": ["café"]}))
+        self.assertEqual(errors, [])
+
+
 # class HtmlTest(unittest.TestCase):
 #     def test_no_warning_coercing_non_xml_name(self):
 #         # Turn warning into error (just for this test -- the test runner resets
@@ -115,7 +234,7 @@ class Html1(unittest.TestCase):
 
 # Parameter helper dictionary, ensures that a complete set of parameters is passed,
 # while making it easy to set just the parameters we want to non-defaults
-defParams = {"method": "xpath", "tablenum": 0, "colselectors": []}
+defParams = {"method": "xpath", "tablenum": 0, "recordxpath": "", "colselectors": []}
 
 
 class XpathExtractorTest(unittest.TestCase):
@@ -210,6 +329,50 @@ class XpathExtractorTest(unittest.TestCase):
             errors, [i18n_message("warning.extractedDifferentLengths", {"row": 2})]
         )
 
+    def test_no_pandas_deprecation_warnings(self):
+        # e.g., Series.iteritems(), which pandas 2 removes
+        table = pd.DataFrame({"html": ["<p>a</p>"], "url": ["http://a"]})
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", FutureWarning)
+            result, errors = render(table, params, settings=Settings())
+        assert_frame_equal(result, pd.DataFrame({"P": ["a"]}))
+
+    def test_scalar_results_are_str(self):
+        table = pd.DataFrame({"html": ["<p>a</p><p>b</p>", None, "<p>c</p>"]})
+        params = {
+            **defParams,
+            "colselectors": [
+                {"colxpath": "count(//p)", "colname": "N"},
+                {"colxpath": "boolean(//p)", "colname": "HasP"},
+                {"colxpath": "//p", "colname": "P"},
+            ],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame(
+                {
+                    "N": ["2.0", None, "1.0"],
+                    "HasP": ["True", None, "True"],
+                    "P": ["a", "b", "c"],
+                }
+            ),
+        )
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.extractedDifferentLengths",
+                    {"row": 1},
+                )
+            ],
+        )
+        df, should_warn = extract_dataframe_by_zip(
+            "<p>a</p>", {"N": xpath("count(//p)"), "P": xpath("//p")}
+        )
+        assert_frame_equal(df, pd.DataFrame({"N": ["1.0"], "P": ["a"]}))
+
     def test_bad_html(self):
         params = {
             **defParams,
@@ -381,8 +544,441 @@ class XpathExtractorTest(unittest.TestCase):
         self.assertEqual(result, ["hi  !"])
 
 
+class ZipBatchTest(unittest.TestCase):
+    fragments = [
+        '<div class="card"><h1>A</h1><a href="/a">a</a><p>a1</p><p>a2</p></div>',
+        "<p>unclosed <b>bold",
+        '<div class="card"><h1>B</h1></div> tail <div class="card"><h1>C</h1></div>',
+        "",
+        "<table><td>cell</td></table>",
+        '<svg xmlns="http://www.w3.org/2000/svg"><path d="M0 0"/></svg>',
+        '<div class="card"><a href="/d" title="t">d</a><p>\n  d1 <i> !</i></p></div>',
+    ]
+
+    def test_is_batchable_xpath(self):
+        for s in [
+            "//h1",
+            "//div[@class='card']//a/@href",
+            "//p/text()",
+            "//p//text()",
+            "//svg:path/@d",
+            '//a[@href][contains(@title, "t")]',
+            "//table/tr/td",
+        ]:
+            self.assertTrue(is_batchable_xpath(s), s)
+        for s in [
+            "/html/body/p",
+            "h1",
+            "//*",
+            "//p[1]",
+            "//p/..",
+            "//p/following::a",
+            "count(//p)",
+            "(//p)[1]",
+            "//a | //p",
+            "//p[count(//a) > 1]",
+        ]:
+            self.assertFalse(is_batchable_xpath(s), s)
+
+    def test_results_are_plain_str(self):
+        # Smart strings would reference (and keep alive) their documents
+        selectors = {"Href": xpath("//a/@href"), "Text": xpath("//p/text()")}
+        result, _ = extract_dataframe_by_zip_batch(self.fragments, selectors)
+        for value in result["Href"].tolist() + result["Text"].tolist():
+            if value is not None:
+                self.assertIs(type(value), str)
+
+    def test_batch_equals_per_row(self):
+        for selectors in [
+            {"H1": "//h1", "P": "//p"},
+            {"Href": "//div[@class='card']//a/@href", "Text": "//p/text()"},
+            {"Cell": "//tr", "Path": "//svg:path/@d"},
+            {"B": "//b", "Tail": "//div[@class='card']/text()"},
+        ]:
+            columns = {name: xpath(s) for name, s in selectors.items()}
+            expected_tables = []
+            expected_warn = None
+            for position, html in enumerate(self.fragments):
+                one_table, warn = extract_dataframe_by_zip(html, columns)
+                expected_tables.append(one_table)
+                if warn and expected_warn is None:
+                    expected_warn = position
+            result, warn_position = extract_dataframe_by_zip_batch(
+                self.fragments, columns
+            )
+            assert_frame_equal(
+                result, pd.concat(expected_tables, ignore_index=True).astype(object)
+            )
+            self.assertEqual(warn_position, expected_warn)
+
+    def test_render_batches_equal_render_rows(self):
+        big_html = "<p>big</p>" + "<br>" * xpathextractor.BATCH_MAX_DOCUMENT_LENGTH
+        table = pd.DataFrame(
+            {"html": self.fragments + [None, big_html] + list(reversed(self.fragments))}
+        )
+        params = {
+            **defParams,
+            "colselectors": [
+                {"colxpath": "//h1", "colname": "Title"},
+                {"colxpath": "//p", "colname": "Description"},
+            ],
+        }
+        with patch.object(xpathextractor, "BATCH_SIZE", 3):
+            batched_out, batched_errors = render(table, params, settings=Settings())
+        with patch.object(xpathextractor, "BATCH_MAX_DOCUMENT_LENGTH", 0):
+            expected_out, expected_errors = render(table, params, settings=Settings())
+        assert_frame_equal(batched_out, expected_out)
+        self.assertEqual(batched_errors, expected_errors)
+        self.assertEqual(
+            batched_errors,
+            [i18n_message("warning.extractedDifferentLengths", {"row": 1})],
+        )
+
+    def test_render_compiles_batch_selectors_once(self):
+        table = pd.DataFrame({"html": self.fragments * 3})
+        params = {
+            **defParams,
+            "colselectors": [
+                {"colxpath": "//h1", "colname": "Title"},
+                {"colxpath": "//p", "colname": "Description"},
+            ],
+        }
+        with patch.object(xpathextractor, "BATCH_SIZE", 3), patch.object(
+            xpathextractor, "_batch_xpath", wraps=xpathextractor._batch_xpath
+        ) as batch_xpath:
+            render(table, params, settings=Settings())
+        self.assertEqual(batch_xpath.call_count, 2)  # not 2 per batch
+
+    def test_batch_eval_error(self):
+        table = pd.DataFrame({"html": ["<p>foo</p>", "<p>bar</p>"]})
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//badns:a", "colname": "Title"}],
+        }
+        out, errors = render(table, params, settings=Settings())
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "ColumnExtractionError.message",
+                    {"column_name": "Title", "error": "Undefined namespace prefix"},
+                )
+            ],
+        )
+
+
+defPerDocumentParams = {**defParams, "method": "xpath_per_document"}
+
+
+class XpathPerDocumentExtractorTest(unittest.TestCase):
+    def test_first_match_per_document(self):
+        table = pd.DataFrame(
+            {
+                "html": [
+                    "<h1>A</h1><p>a1</p><p>a2</p>",
+                    "<p>b1</p>",
+                    None,
+                    "<h1>C</h1><h1>D</h1>",
+                ]
+            }
+        )
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [
+                {"colxpath": "//h1", "colname": "Title"},
+                {"colxpath": "//p/text()", "colname": "Description"},
+            ],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame(
+                {
+                    "Title": ["A", None, None, "C"],
+                    "Description": ["a1", "b1", None, None],
+                }
+            ),
+        )
+        self.assertEqual(errors, [])
+
+    def test_preserve_url(self):
+        table = pd.DataFrame(
+            {
+                "url": ["http://a.com", "http://b.com"],
+                "html": ["<title>A</title>", "<title>B</title>"],
+            }
+        )
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [{"colxpath": "//title", "colname": "Title"}],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame(
+                {"url": ["http://a.com", "http://b.com"], "Title": ["A", "B"]}
+            ),
+        )
+        self.assertEqual(errors, [])
+
+    def test_scalar_results_are_typed(self):
+        table = pd.DataFrame({"html": ["<p>a</p><p>b</p>", "<div></div>"]})
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [
+                {"colxpath": "count(//p)", "colname": "N"},
+                {"colxpath": "boolean(//p)", "colname": "HasP"},
+                {"colxpath": "string(//p)", "colname": "P"},
+            ],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame({"N": [2.0, 0.0], "HasP": ["True", "False"], "P": ["a", ""]}),
+        )
+        self.assertEqual(errors, [])
+
+    def test_url_colname_conflict(self):
+        table = pd.DataFrame({"url": ["http://a.com"], "html": ["<a>x</a>"]})
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [{"colxpath": "//a", "colname": "url"}],
+        }
+        out, errors = render(table, params, settings=Settings())
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [i18n_message("badParam.colname.duplicate", {"column_name": "url"})],
+        )
+
+    def test_valid_xpath_eval_error(self):
+        table = pd.DataFrame({"html": ["<p>foo</p>"]})
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [{"colxpath": "//badns:a", "colname": "Title"}],
+        }
+        out, errors = render(table, params, settings=Settings())
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "ColumnExtractionError.message",
+                    {"column_name": "Title", "error": "Undefined namespace prefix"},
+                )
+            ],
+        )
+
+    def test_empty_input_table(self):
+        params = {
+            **defPerDocumentParams,
+            "colselectors": [{"colxpath": "//h1", "colname": "Title"}],
+        }
+        out, errors = render(pd.DataFrame({"html": []}), params, settings=Settings())
+        assert_frame_equal(out, pd.DataFrame({"Title": []}, dtype=str))
+        self.assertEqual(errors, [])
+
+
+defRecordsParams = {**defParams, "method": "xpath_records", "recordxpath": "//li"}
+
+
+class XpathRecordsExtractorTest(unittest.TestCase):
+    def test_missing_field_is_null_in_its_own_row(self):
+        # The "zip" algorithm would misalign Description here
+        table = pd.DataFrame(
+            {
+                "html": [
+                    """
+                    <ul>
+                        <li><h1>A title</h1><p>A description</p></li>
+                        <li><h1>B title</h1></li>
+                        <li><h1>C title</h1><p>C description</p><p>C2</p></li>
+                    </ul>
+                    """,
+                    None,
+                    "<ul><li><p>D description</p></li></ul>",
+                ]
+            }
+        )
+        params = {
+            **defRecordsParams,
+            "colselectors": [
+                {"colxpath": ".//h1", "colname": "Title"},
+                {"colxpath": "p", "colname": "Description"},
+            ],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame(
+                {
+                    "Title": ["A title", "B title", "C title", None],
+                    "Description": [
+                        "A description",
+                        None,
+                        "C description",
+                        "D description",
+                    ],
+                }
+            ),
+        )
+        self.assertEqual(errors, [])
+
+    def test_url_and_attributes(self):
+        table = pd.DataFrame(
+            {
+                "url": ["http://a.com", "http://b.com"],
+                "html": [
+                    '<li><a href="/1">1</a></li><li><a href="/2">2</a></li>',
+                    '<li><a href="/3">3</a></li>',
+                ],
+            }
+        )
+        params = {
+            **defRecordsParams,
+            "colselectors": [
+                {"colxpath": "a/@href", "colname": "Link"},
+                {"colxpath": "count(.//a)", "colname": "N"},
+            ],
+        }
+        out, errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            out,
+            pd.DataFrame(
+                {
+                    "url": ["http://a.com", "http://a.com", "http://b.com"],
+                    "Link": ["/1", "/2", "/3"],
+                    "N": [1.0, 1.0, 1.0],
+                }
+            ),
+        )
+        self.assertEqual(errors, [])
+
+    def test_no_records(self):
+        params = {
+            **defRecordsParams,
+            "colselectors": [{"colxpath": "h1", "colname": "Title"}],
+        }
+        out, errors = render(
+            pd.DataFrame({"html": ["<p>x</p>"]}), params, settings=Settings()
+        )
+        assert_frame_equal(out, pd.DataFrame({"Title": []}, dtype=str))
+        self.assertEqual(errors, [])
+
+    def test_missing_recordxpath(self):
+        params = {
+            **defRecordsParams,
+            "recordxpath": "",
+            "colselectors": [{"colxpath": "h1", "colname": "Title"}],
+        }
+        out, errors = render(
+            pd.DataFrame({"html": ["<p>x</p>"]}), params, settings=Settings()
+        )
+        self.assertIsNone(out)
+        self.assertEqual(errors, [i18n_message("badParam.recordxpath.missing")])
+
+    def test_absolute_column_selector(self):
+        for colxpath in [
+            "//h1",
+            "/html/body//a",
+            " (//a)[1]",
+            "string(//h1)",
+            "count(//a)",
+            ".//a | //h1",
+            "concat(., //h1)",
+        ]:
+            params = {
+                **defRecordsParams,
+                "colselectors": [
+                    {"colxpath": "a", "colname": "A"},
+                    {"colxpath": colxpath, "colname": "Title"},
+                ],
+            }
+            out, errors = render(
+                pd.DataFrame({"html": ["<h1>x</h1><li><a>y</a></li>"]}),
+                params,
+                settings=Settings(),
+            )
+            self.assertIsNone(out)
+            self.assertEqual(
+                errors,
+                [i18n_message("badParam.colxpath.absolute", {"xpath": colxpath})],
+            )
+
+    def test_searches_whole_page(self):
+        for s in ["//h1", "/", "(//a)[1]", ". = /", "a and //b", ". * //a", "- /a"]:
+            self.assertTrue(searches_whole_page(s), s)
+        for s in [
+            ".//a",
+            "a/b",
+            "(./a)//b",
+            "a[count(//li) > 1]",
+            "a/and",
+            ".//*/a",
+            "$x/a",
+            "..//a",
+            "(a)[1]/b",
+            "normalize-space(.)",
+        ]:
+            self.assertFalse(searches_whole_page(s), s)
+
+    def test_relative_column_selector_with_absolute_predicate(self):
+        params = {
+            **defRecordsParams,
+            "colselectors": [{"colxpath": "a[count(//li) > 1]", "colname": "A"}],
+        }
+        out, errors = render(
+            pd.DataFrame({"html": ["<li><a>1</a></li><li><a>2</a></li>"]}),
+            params,
+            settings=Settings(),
+        )
+        assert_frame_equal(out, pd.DataFrame({"A": ["1", "2"]}))
+        self.assertEqual(errors, [])
+
+    def test_invalid_recordxpath(self):
+        params = {
+            **defRecordsParams,
+            "recordxpath": "totes not an xpath",
+            "colselectors": [{"colxpath": "h1", "colname": "Title"}],
+        }
+        out, errors = render(
+            pd.DataFrame({"html": ["<p>x</p>"]}), params, settings=Settings()
+        )
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "badParam.recordxpath.invalid", {"error": "Invalid expression"}
+                )
+            ],
+        )
+
+    def test_recordxpath_selects_scalar(self):
+        params = {
+            **defRecordsParams,
+            "recordxpath": "count(//li)",
+            "colselectors": [{"colxpath": "h1", "colname": "Title"}],
+        }
+        out, errors = render(
+            pd.DataFrame({"html": ["<li>x</li>"]}), params, settings=Settings()
+        )
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "error.recordxpath.eval",
+                    {"error": "Expression does not select elements"},
+                )
+            ],
+        )
+
+
 defTableParams = {**defParams, "method": "table", "tablenum": 1}
 
+
 # Optional URL column, to test error messages when we do and don't have url
 def make_html_input(html, url=None):
     if not url:
@@ -691,13 +1287,1789 @@ class TableExtractorTest(unittest.TestCase):
         self.assertEqual(errors, [])
 
 
-class MigrationTest(unittest.TestCase):
-    def test_migrate_v0(self):
-        v0_params = {"colselectors": [{"colxpath": "foo", "colname": "bar"}]}
-        v1_params = {"method": "xpath", **v0_params, "tablenum": 1}
+class TableInventoryTest(unittest.TestCase):
+    def setUp(self):
+        xpathextractor._table_inventories.clear()
+
+    def test_summaries(self):
+        html = """
+        <table>
+            <thead><tr><th>A</th><th colspan="2">B  C</th></tr></thead>
+            <tbody><tr><td>1</td><td>2</td><td>3</td></tr></tbody>
+        </table>
+        <table><tr><td>x</td><td><table><tr><td>nested</td></tr></table></td></tr></table>
+        <table><tr><td>\n</td></tr></table>
+        <table><tr><td><!-- comment --></td></tr></table>
+        <table><tr><td>x</td><td><table><tr><td>nested</td></tr></table></td></tr></table>
+        """
+        self.assertEqual(
+            table_inventory(html),
+            [
+                TableSummary(1, 3, ["A", "B C"]),
+                TableSummary(1, 2, []),
+                TableSummary(1, 1, []),
+            ],
+        )
 
-        new_params = migrate_params(v0_params)
-        self.assertEqual(new_params, v1_params)
+    def test_same_number_of_tables_as_pandas(self):
+        for html, exact in [
+            ("<p>no tables</p>", True),
+            ("<table></table>", True),
+            ("<table> </table>", False),
+            ("<table><tr><td> </td></tr></table>", False),
+            ("<table><tr><td> </td><td> </td></tr></table>", False),
+            ("<table><tr><td>\n</td><td>\n</td></tr></table>", True),
+            ("<table><tr><td><!--c--></td></tr></table>", True),
+            ("<table><!--c--><tr><td>x</td></tr></table>", True),
+            ("<table><caption>c</caption><tr><td>x</td></tr></table>", True),
+            ("<table><tr><td>x</td></tr><table><tr><td>y</td></tr></table>", True),
+            (
+                "<table><tr><td><table><tr><td>a</td></tr></table></td></tr></table>",
+                True,
+            ),
+            (
+                "<table><tr><td>x</td></tr></table><table><tr><td>x</td></tr></table>",
+                True,
+            ),
+            (
+                "<table class=a id=b><tr><td>x</td></tr></table>"
+                "<table id=b class=a><tr><td>x</td></tr></table>",
+                True,
+            ),
+            (
+                '<table class="a b"><tr><td>x</td></tr></table>'
+                '<table class="a  b"><tr><td>x</td></tr></table>',
+                False,
+            ),
+            ("<svg><table><tr><td>x</td></tr></table></svg>", True),
+            ("<table>foster-parented</table><table><td>x</td></table>", True),
+            (TableExtractorTest.a_table_html, True),
+        ]:
+            xpathextractor.pd.io.html._importers()
+            tables, _ = xpathextractor.read_tables(html, "row")
+            summaries, is_exact = xpathextractor.summarize_tables(
+                parse_document(html, True)
+            )
+            self.assertEqual(is_exact, exact, html)
+            if exact:
+                self.assertEqual(len(summaries), len(tables or []), html)
+            else:
+                self.assertGreaterEqual(len(summaries), len(tables or []), html)
+
+    def test_inexact_inventory_does_not_shortcut(self):
+        html = "<table><tr><td> </td><td> </td></tr></table>"
+        table_inventory(html)
+        result, _ = render(make_html_input(html), defTableParams, settings=Settings())
+        self.assertEqual(result.shape, (1, 2))
+
+    def test_tablenum_too_big_uses_inventory(self):
+        table = make_html_input(TableExtractorTest.a_table_html, "http://a")
+        params = {**defTableParams, "tablenum": 3}
+        expected = render(table, params, settings=Settings())
+        xpathextractor._table_inventories.clear()
+
+        table_inventory(table["html"][0])
+        with patch.object(pd.io.html, "_parse") as parse:
+            result = render(table, params, settings=Settings())
+            parse.assert_not_called()
+        self.assertEqual(result, expected)
+        self.assertEqual(
+            result[1],
+            [
+                i18n_message(
+                    "badParam.tableNum.tooBig", {"n_tables": 1, "rowname": "http://a"}
+                )
+            ],
+        )
+
+    def test_tablenum_too_big_with_reordered_attributes(self):
+        html = (
+            "<table class=a id=b><tr><td>x</td></tr></table>"
+            "<table id=b class=a><tr><td>x</td></tr></table>"
+        )
+        params = {**defTableParams, "tablenum": 3}
+        expected = render(make_html_input(html), params, settings=Settings())
+        xpathextractor._table_inventories.clear()
+        table_inventory(html)
+        result = render(make_html_input(html), params, settings=Settings())
+        self.assertEqual(result, expected)
+        self.assertEqual(
+            result[1],
+            [
+                i18n_message(
+                    "badParam.tableNum.tooBig",
+                    {"n_tables": 1, "rowname": "input html row 1"},
+                )
+            ],
+        )
+
+    def test_render_fills_inventory(self):
+        table = make_html_input(TableExtractorTest.a_table_html)
+        render(table, defTableParams, settings=Settings())
+        with patch.object(xpathextractor, "parse_document") as parse_document:
+            summaries = table_inventory(table["html"][0])
+            parse_document.assert_not_called()
+        self.assertEqual(summaries, [TableSummary(2, 2, ["B", "A"])])
+        with patch.object(pd.io.html, "_parse") as parse:
+            render(table, {**defTableParams, "tablenum": 2}, settings=Settings())
+            parse.assert_not_called()
+
+    def test_no_tables(self):
+        table = make_html_input("<table></table>")
+        expected = render(table, defTableParams, settings=Settings())
+        with patch.object(pd.io.html, "_parse") as parse:
+            result = render(table, defTableParams, settings=Settings())
+            parse.assert_not_called()
+        self.assertEqual(result[1], expected[1])
+
+
+class AllTablesTest(unittest.TestCase):
+    two_tables_html = """
+    <table>
+        <thead><tr><th>B</th><th>A</th></tr></thead>
+        <tbody><tr><td>1</td><td>2</td></tr></tbody>
+    </table>
+    <p>Between</p>
+    <table>
+        <tr><th>table</th><th>A</th></tr>
+        <tr><td>x</td><td>3</td></tr>
+        <tr><td>y</td><td>4</td></tr>
+    </table>
+    """
+    params = {**defParams, "method": "all_tables"}
+
+    def test_long_format(self):
+        table = pd.DataFrame(
+            {
+                "html": [
+                    self.two_tables_html,
+                    "<p>None</p>",
+                    TableExtractorTest.b_table_html,
+                ]
+            }
+        )
+        result, errors = render(table, self.params, settings=Settings())
+        assert_frame_equal(
+            result,
+            pd.DataFrame(
+                {
+                    "row": [1, 1, 1, 3, 3],
+                    "table": [1, 2, 2, 1, 1],
+                    "B": [1, None, None, None, None],
+                    "A": [2, 3, 4, 4, 5],
+                    "table 2": [None, "x", "y", None, None],
+                    "C": [None, None, None, 5, 6],
+                }
+            ),
+        )
+        self.assertEqual(
+            errors,
+            [
+                cjwmodule_i18n_message(
+                    "util.colnames.warnings.numbered",
+                    {"n_columns": 1, "first_colname": "table 2"},
+                )
+            ],
+        )
+
+    def test_url(self):
+        table = pd.DataFrame(
+            {
+                "url": ["http://a", "http://b"],
+                "html": ["<h1>No tables</h1>", self.two_tables_html],
+            }
+        )
+        result, errors = render(table, self.params, settings=Settings())
+        self.assertEqual(result["url"].tolist(), ["http://b"] * 3)
+        self.assertEqual(result["table"].tolist(), [1, 2, 2])
+        self.assertEqual(
+            errors, [i18n_message("error.noTable", {"rowname": "http://a"})]
+        )
+
+    def test_same_as_table_method(self):
+        table = pd.DataFrame({"html": [self.two_tables_html] * 2})
+        result, _ = render(table, self.params, settings=Settings())
+        for tablenum in [1, 2]:
+            expected, _ = render(
+                table, {**defTableParams, "tablenum": tablenum}, settings=Settings()
+            )
+            part = result[result["table"] == tablenum].reset_index(drop=True)
+            part = part.drop(columns=["row", "table"]).dropna(axis=1, how="all")
+            expected.columns = ["table 2" if c == "table" else c for c in expected]
+            assert_frame_equal(part, expected[part.columns], check_dtype=False)
+
+    def test_parse_each_document_once(self):
+        table = pd.DataFrame({"html": [self.two_tables_html] * 3})
+        with patch.object(pd.io.html, "_parse", wraps=pd.io.html._parse) as parse:
+            render(table, self.params, settings=Settings())
+        self.assertEqual(parse.call_count, 3)
+
+
+class RenderBatchesTest(unittest.TestCase):
+    def test_batches_concat_to_render_output(self):
+        table = pd.DataFrame(
+            {
+                "html": [
+                    "<h1>A</h1><p>a1</p><p>a2</p><p>a3</p>",
+                    None,
+                    "<h1>B</h1><p>b1</p>",
+                    "<h1>C</h1><h1>D</h1><p>c1</p><p>d1</p>",
+                ]
+            }
+        )
+        params = {
+            **defParams,
+            "colselectors": [
+                {"colxpath": "//h1", "colname": "Title"},
+                {"colxpath": "//p", "colname": "Description"},
+            ],
+        }
+        batches = list(render_batches(table, params, settings=Settings(), batch_size=2))
+        for batch, _ in batches:
+            self.assertLessEqual(len(batch), 2)
+            self.assertEqual(list(batch.columns), ["Title", "Description"])
+        expected_out, expected_errors = render(table, params, settings=Settings())
+        assert_frame_equal(
+            pd.concat([batch for batch, _ in batches], ignore_index=True),
+            expected_out,
+        )
+        self.assertEqual(
+            [warning for _, warnings in batches for warning in warnings],
+            expected_errors,
+        )
+        # The warning comes with the first document's rows, as soon as it happens
+        self.assertEqual(
+            batches[0][1],
+            [i18n_message("warning.extractedDifferentLengths", {"row": 1})],
+        )
+
+    def test_table_batches_are_text(self):
+        table = pd.DataFrame(
+            {
+                "html": [
+                    "<table><tr><th>A</th></tr><tr><td>1</td></tr></table>",
+                    "<p>no table</p>",
+                    "<table><tr><th>B</th></tr><tr><td>2</td></tr></table>",
+                ]
+            }
+        )
+        params = {**defParams, "method": "table", "tablenum": 1}
+        batches = list(render_batches(table, params, settings=Settings(), batch_size=1))
+        self.assertEqual(
+            [warnings for _, warnings in batches],
+            [[], [i18n_message("error.noTable", {"rowname": "input html row 2"})], []],
+        )
+        assert_frame_equal(batches[0][0], pd.DataFrame({"A": ["1"]}))
+        assert_frame_equal(batches[1][0], pd.DataFrame({"A": []}, dtype=str))
+        assert_frame_equal(batches[2][0], pd.DataFrame({"A": [None], "B": ["2"]}))
+
+    def test_empty_input_yields_empty_table(self):
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//h1", "colname": "Title"}],
+        }
+        batches = list(
+            render_batches(pd.DataFrame({"html": []}), params, settings=Settings())
+        )
+        self.assertEqual(len(batches), 1)
+        assert_frame_equal(batches[0][0], pd.DataFrame({"Title": []}, dtype=str))
+        self.assertEqual(batches[0][1], [])
+
+    def test_error(self):
+        table = pd.DataFrame({"html": ["<p>foo</p>"]})
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//badns:a", "colname": "Title"}],
+        }
+        self.assertEqual(
+            list(render_batches(table, params, settings=Settings())),
+            [
+                (
+                    None,
+                    [
+                        i18n_message(
+                            "ColumnExtractionError.message",
+                            {
+                                "column_name": "Title",
+                                "error": "Undefined namespace prefix",
+                            },
+                        )
+                    ],
+                )
+            ],
+        )
+
+
+class RenderAsyncTest(unittest.TestCase):
+    table = pd.DataFrame(
+        {
+            "url": ["http://a.com", "http://b.com", "http://c.com"],
+            "html": [
+                "<table><tr><th>A</th></tr><tr><td>1</td></tr></table>",
+                "<p>no table</p>",
+                "<table><tr><th>A</th></tr><tr><td>2</td></tr></table>",
+            ],
+        }
+    )
+    params = {**defParams, "method": "table", "tablenum": 1}
+
+    def test_same_as_render(self):
+        with ThreadPoolExecutor(2) as executor:
+            result = asyncio.run(
+                render_async(
+                    self.table, self.params, settings=Settings(), executor=executor
+                )
+            )
+        expected = render(self.table, self.params, settings=Settings())
+        assert_frame_equal(result[0], expected[0])
+        self.assertEqual(result[1], expected[1])
+        assert_frame_equal(result[0], pd.DataFrame({"A": [1, 2]}))
+
+    def test_param_error(self):
+        params = {**self.params, "tablenum": 0}
+        result = asyncio.run(render_async(self.table, params, settings=Settings()))
+        self.assertEqual(result, (None, [i18n_message("badParam.tablenum.negative")]))
+
+    def test_cancel_between_documents(self):
+        class CancellingExecutor(ThreadPoolExecutor):
+            # Cancel the render task as soon as it submits its first step
+            def submit(self, *args, **kwargs):
+                self.n_submits += 1
+                self.loop.call_soon_threadsafe(self.task.cancel)
+                return super().submit(*args, **kwargs)
+
+        async def go(executor):
+            executor.loop = asyncio.get_running_loop()
+            executor.task = asyncio.create_task(
+                render_async(
+                    self.table,
+                    self.params,
+                    settings=Settings(),
+                    executor=executor,
+                    documents_per_step=1,
+                )
+            )
+            await executor.task
+
+        with CancellingExecutor(1) as executor:
+            executor.n_submits = 0
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(go(executor))
+        self.assertEqual(executor.n_submits, 1)
+
+    def test_cancel_within_step(self):
+        table = pd.concat([self.table] * 10, ignore_index=True)
+        extract = xpathextractor.Extractor.extract
+        n_extracted = []
+
+        def extract_then_cancel(extractor, documents, **kwargs):
+            for rows in extract(extractor, documents, **kwargs):
+                n_extracted.append(1)
+                if len(n_extracted) == 1:
+                    loop.call_soon_threadsafe(task.cancel)
+                    time.sleep(0.2)  # let render_async() see the cancel
+                yield rows
+
+        async def go():
+            nonlocal loop, task
+            loop = asyncio.get_running_loop()
+            task = asyncio.create_task(
+                render_async(table, self.params, settings=Settings())
+            )
+            await task
+
+        loop = task = None
+        with patch.object(xpathextractor.Extractor, "extract", extract_then_cancel):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(go())
+        self.assertLess(len(n_extracted), 3)  # not all 30 documents
+
+    def test_documents_per_step(self):
+        for kwargs, expected_steps in [
+            ({}, [2, 1]),
+            ({"documents_per_step": 1}, [1, 1, 1]),
+        ]:
+            steps = []
+
+            def record_step(extractor, documents, cache, stats, cancelled):
+                steps.append(len(documents))
+                return list(extractor.extract(documents))
+
+            with patch.object(xpathextractor, "BATCH_SIZE", 2), patch.object(
+                xpathextractor, "_extract_list", record_step
+            ):
+                result, _ = asyncio.run(
+                    render_async(self.table, self.params, settings=Settings(), **kwargs)
+                )
+            self.assertEqual(steps, expected_steps)
+            assert_frame_equal(result, pd.DataFrame({"A": [1, 2]}))
+
+
+class ThreadPoolTest(unittest.TestCase):
+    table = pd.DataFrame(
+        {
+            "url": ["http://a.com", "http://b.com", "http://c.com", "http://d.com"],
+            "html": [
+                "<ul><li><a href='/a'>A</a></li><li>B</li></ul>",
+                None,
+                "<p>nothing</p>" + "<!-- big -->" * 1000,
+                "<ul><li><a href='/c'>C</a></li></ul>",
+            ],
+        }
+    )
+
+    def test_same_as_render(self):
+        for params in [
+            {**defParams, "colselectors": [{"colxpath": "//li", "colname": "A"}]},
+            {
+                **defParams,
+                "method": "xpath_per_document",
+                "colselectors": [{"colxpath": "//a/@href", "colname": "A"}],
+            },
+            {
+                **defParams,
+                "method": "xpath_records",
+                "recordxpath": "//li",
+                "colselectors": [{"colxpath": "a", "colname": "A"}],
+            },
+            {**defParams, "method": "table", "tablenum": 1},
+        ]:
+            expected = render(self.table, params, settings=Settings())
+            # Tiny chunks, so every document runs in its own task
+            with patch.object(xpathextractor, "BATCH_SIZE", 1):
+                with ThreadPoolExecutor(3) as executor:
+                    result = render(
+                        self.table, params, settings=Settings(), executor=executor
+                    )
+            if expected[0] is None:
+                self.assertIsNone(result[0])
+            else:
+                assert_frame_equal(result[0], expected[0])
+            self.assertEqual(result[1], expected[1])
+
+    def test_error(self):
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//li[foo:bar()]", "colname": "A"}],
+        }
+        with ThreadPoolExecutor(2) as executor:
+            result = render(self.table, params, settings=Settings(), executor=executor)
+        expected = render(self.table, params, settings=Settings())
+        self.assertIsNone(result[0])
+        self.assertEqual(result[1], expected[1])
+
+    def test_threads_compile_own_selectors(self):
+        extractor, _ = xpathextractor._make_extractor(
+            self.table,
+            {
+                **defParams,
+                "method": "xpath_records",
+                "recordxpath": "//li",
+                "colselectors": [{"colxpath": "a", "colname": "A"}],
+            },
+            settings=Settings(),
+        )
+        with ThreadPoolExecutor(1) as executor:
+            copy = executor.submit(extractor._for_this_thread).result()
+            self.assertIs(executor.submit(extractor._for_this_thread).result(), copy)
+        self.assertIsNot(copy, extractor)
+        self.assertIsNot(copy.record_selector, extractor.record_selector)
+        self.assertEqual(copy.record_selector.path, "//li")
+        self.assertIsNot(copy.columns_to_parse["A"], extractor.columns_to_parse["A"])
+
+    def test_parse_documents_xml(self):
+        texts = ["<a><b>%d</b></a>" % i for i in range(10)]
+        with ThreadPoolExecutor(3) as executor:
+            trees = parse_documents(texts, False, executor=executor)
+        self.assertEqual(
+            [tree.findtext("b") for tree in trees], [str(i) for i in range(10)]
+        )
+
+
+class RenderPreviewTest(unittest.TestCase):
+    table = pd.DataFrame(
+        {
+            "html": [
+                "<h1>A</h1><h1>B</h1>",
+                None,
+                "<h1>C</h1>",
+                "<h1>D</h1><h1>E</h1><h1>F</h1>",
+                "<h1>G</h1>",
+                None,
+            ]
+        }
+    )
+    params = {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "H1"}]}
+
+    def test_max_documents(self):
+        out, errors = render_preview(
+            self.table, self.params, settings=Settings(), max_documents=2
+        )
+        assert_frame_equal(out, pd.DataFrame({"H1": ["A", "B", "C"]}))
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "preview.partial",
+                    {
+                        "n_rows": 3,
+                        "n_documents": 2,
+                        "n_total_documents": 4,
+                        "n_estimated_rows": 6,
+                    },
+                )
+            ],
+        )
+
+    def test_max_seconds(self):
+        out, errors = render_preview(
+            self.table,
+            self.params,
+            settings=Settings(),
+            max_documents=None,
+            max_seconds=0,
+        )
+        assert_frame_equal(out, pd.DataFrame({"H1": []}, dtype=str))
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "preview.partial",
+                    {
+                        "n_rows": 0,
+                        "n_documents": 0,
+                        "n_total_documents": 4,
+                        "n_estimated_rows": 0,
+                    },
+                )
+            ],
+        )
+
+    def test_max_seconds_with_slow_documents(self):
+        table = pd.DataFrame({"html": ["<h1>%d</h1>" % i for i in range(100)]})
+        extract_documents = xpathextractor.XPathZipExtractor.extract_documents
+
+        def slow_extract_documents(self, htmls):
+            time.sleep(0.02 * len(htmls))
+            return extract_documents(self, htmls)
+
+        with patch.object(
+            xpathextractor.XPathZipExtractor,
+            "extract_documents",
+            slow_extract_documents,
+        ):
+            start = time.monotonic()
+            out, errors = render_preview(
+                table,
+                self.params,
+                settings=Settings(),
+                max_documents=None,
+                max_seconds=0.2,
+            )
+            elapsed = time.monotonic() - start
+        # We may start one document just before the deadline
+        self.assertLess(elapsed, 0.2 + 0.02 + 0.15)
+        self.assertLess(len(out), 100)
+        self.assertEqual(errors[0].id, "preview.partial")
+
+    def test_all_documents_is_not_preview(self):
+        out, errors = render_preview(
+            self.table, self.params, settings=Settings(), max_documents=4
+        )
+        expected_out, expected_errors = render(
+            self.table, self.params, settings=Settings()
+        )
+        assert_frame_equal(out, expected_out)
+        self.assertEqual(errors, expected_errors)
+
+    def test_preview_keeps_warnings(self):
+        table = pd.DataFrame(
+            {"html": ["<table><tr><th>A</th></tr><tr><td>1</td></tr></table>"] * 3}
+        )
+        params = {**defParams, "method": "table", "tablenum": 2}
+        out, errors = render_preview(
+            table, params, settings=Settings(), max_documents=1
+        )
+        self.assertIsNone(out)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "preview.partial",
+                    {
+                        "n_rows": 0,
+                        "n_documents": 1,
+                        "n_total_documents": 3,
+                        "n_estimated_rows": 0,
+                    },
+                ),
+                i18n_message(
+                    "badParam.tableNum.tooBig",
+                    {"n_tables": 1, "rowname": "input html row 1"},
+                ),
+            ],
+        )
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tempdir.name, "cache.sqlite3"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tempdir.cleanup()
+
+    def assertRenderMatchesUncached(self, table, params):
+        expected = render(table, params, settings=Settings())
+        for _ in range(2):  # first miss, then hit
+            result, errors = render(
+                table, params, settings=Settings(), cache=self.cache
+            )
+            if expected[0] is None:
+                self.assertIsNone(result)
+            else:
+                assert_frame_equal(result, expected[0])
+            self.assertEqual(errors, expected[1])
+
+    def test_xpath(self):
+        self.assertRenderMatchesUncached(
+            pd.DataFrame({"html": ["<p>a</p><h1>x</h1>", None, "<p>b</p><p>c</p>"]}),
+            {
+                **defParams,
+                "colselectors": [
+                    {"colxpath": "//p", "colname": "P"},
+                    {"colxpath": "//h1", "colname": "H1"},
+                ],
+            },
+        )
+
+    def test_xpath_per_document_with_url(self):
+        self.assertRenderMatchesUncached(
+            pd.DataFrame(
+                {
+                    "url": ["https://a", "https://b", "https://c"],
+                    "html": ["<p>a</p>", None, "<p>a</p><a href='x'>y</a>"],
+                }
+            ),
+            {
+                **defParams,
+                "method": "xpath_per_document",
+                "colselectors": [
+                    {"colxpath": "//p", "colname": "P"},
+                    {"colxpath": "count(//a)", "colname": "n"},
+                ],
+            },
+        )
+
+    def test_warnings_name_row_of_each_render(self):
+        table_html = "<table><tr><th>A</th></tr><tr><td>1</td></tr></table>"
+        params = {**defParams, "method": "table", "tablenum": 2}
+        render(
+            pd.DataFrame({"html": [table_html]}),
+            params,
+            settings=Settings(),
+            cache=self.cache,
+        )
+        result, errors = render(
+            pd.DataFrame({"html": [None, table_html]}),
+            params,
+            settings=Settings(),
+            cache=self.cache,
+        )
+        self.assertIsNone(result)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "badParam.tableNum.tooBig",
+                    {"n_tables": 1, "rowname": "input html row 2"},
+                )
+            ],
+        )
+
+    def test_hit_skips_parse(self):
+        table = pd.DataFrame({"html": ["<p>a</p>", "<p>b</p>"]})
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+        render(table, params, settings=Settings(), cache=self.cache)
+        with patch.object(xpathextractor, "parse_document") as parse_document:
+            result, errors = render(
+                table, params, settings=Settings(), cache=self.cache
+            )
+        parse_document.assert_not_called()
+        assert_frame_equal(result, pd.DataFrame({"P": ["a", "b"]}))
+
+    def test_key_depends_on_params(self):
+        table = pd.DataFrame({"html": ["<p>a</p><h1>b</h1>"]})
+        render(
+            table,
+            {**defParams, "colselectors": [{"colxpath": "//p", "colname": "A"}]},
+            settings=Settings(),
+            cache=self.cache,
+        )
+        result, errors = render(
+            table,
+            {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "A"}]},
+            settings=Settings(),
+            cache=self.cache,
+        )
+        assert_frame_equal(result, pd.DataFrame({"A": ["b"]}))
+
+    def test_evict_least_recently_used(self):
+        rows = xpathextractor.ExtractedRows({"A": ["x"]}, 1)
+        entry_size = 1 + len(xpathextractor._encode_rows(rows))  # 1-byte keys
+        cache = ResultCache(self.cache.path, max_bytes=2 * entry_size)
+        try:
+            cache.put(b"1", rows)
+            cache.put(b"2", rows)
+            cache.get(b"1")
+            cache.put(b"3", rows)
+            self.assertIsNotNone(cache.get(b"1"))
+            self.assertIsNone(cache.get(b"2"))
+            self.assertIsNotNone(cache.get(b"3"))
+        finally:
+            cache.close()
+
+    def test_shared_between_instances(self):
+        rows = xpathextractor.ExtractedRows(
+            {"A": ["x", None]}, 2, [i18n_message("a.b", {"row": 1})]
+        )
+        self.cache.put(b"key", rows)
+        other = ResultCache(self.cache.path)
+        try:
+            result = other.get(b"key")
+        finally:
+            other.close()
+        self.assertEqual(result.columns, {"A": ["x", None]})
+        self.assertEqual(result.n_rows, 2)
+        self.assertEqual(result.warnings, [i18n_message("a.b", {"row": 1})])
+
+
+class TagPrefilterTest(unittest.TestCase):
+    def test_required_tag_names(self):
+        for s, expected in [
+            ("//table//td", {"table", "td"}),
+            ("//div[@class='x']/a/@href", {"a"}),
+            ("/html/body/p", {"p"}),
+            ("h1", {"h1"}),
+            ("//p/text()", {"p"}),
+            ("//svg:path/@d", {"path"}),
+            ("//p[count(//a) > 1]", {"p"}),
+            ("//a/ancestor::div", {"a"}),
+            ("//a/following-sibling::span[1]", {"a"}),
+            # Anything else might match any document
+            ("count(//a)", set()),
+            ("string(//title)", set()),
+            ("//a | //p", set()),
+            ("(//p)[1]", set()),
+            ("//p and //a", set()),
+            ("//*", set()),
+            ("//body", set()),  # html5lib adds <body>
+            ("//div", set()),  # ... and fragments' <div> or <span> wrapper
+            ("//span/b", {"b"}),
+        ]:
+            self.assertEqual(required_tag_names(s), expected, s)
+
+    def test_may_match(self):
+        prefilter = TagPrefilter.for_selectors(["//table//td", "//h1"])
+        self.assertTrue(prefilter.may_match("<h1>x</h1>"))
+        self.assertTrue(prefilter.may_match("<TABLE><Td>x</table>"))
+        self.assertTrue(prefilter.may_match(b"<table><td\n>x</table>"))
+        self.assertFalse(prefilter.may_match("<table><tdx>x</tdx></table>"))
+        self.assertFalse(prefilter.may_match("<td>x</td>"))
+        self.assertFalse(prefilter.may_match("<p>h1, table, td</p>"))
+        # We don't read ASCII-incompatible bytes
+        self.assertTrue(prefilter.may_match("<p>x</p>".encode("utf-16")))
+
+    def test_may_match_implied_tags(self):
+        self.assertTrue(TagPrefilter.for_selectors(["//tbody/tr"]).may_match("<td>"))
+        self.assertTrue(TagPrefilter.for_selectors(["//p"]).may_match("</p>"))
+        self.assertTrue(TagPrefilter.for_selectors(["//img"]).may_match("<image>"))
+
+    def test_fragment_wrappers(self):
+        # A fragment's elements come back in a <div> or <span>, even if the
+        # source has neither
+        table = pd.DataFrame(
+            {"html": ["<p>a</p><p>b</p>", "hi <b>x</b>", "<div>z</div>"]}
+        )
+        for xpath, expected in [("//div", ["ab", "z"]), ("//span", ["hi x"])]:
+            params = {
+                **defParams,
+                "colselectors": [{"colxpath": xpath, "colname": "A"}],
+            }
+            result, errors = render(table, params, settings=Settings())
+            assert_frame_equal(result, pd.DataFrame({"A": expected}))
+
+    def test_never_skip_if_any_selector_might_match_anything(self):
+        self.assertIsNone(TagPrefilter.for_selectors(["//h1", "count(//a)"]))
+
+    def test_render_same_as_without_prefilter(self):
+        table = pd.DataFrame(
+            {
+                "url": ["https://a", "https://b", "https://c", "https://d"],
+                "html": [
+                    "<h1>Captcha</h1>",
+                    '<table><td><a href="/x">x</a></td></table>',
+                    None,
+                    "<p>Moved",
+                ],
+            }
+        )
+        for params in [
+            {**defParams, "colselectors": [{"colxpath": "//td/a", "colname": "A"}]},
+            {
+                **defParams,
+                "method": "xpath_per_document",
+                "colselectors": [{"colxpath": "//td/a/@href", "colname": "A"}],
+            },
+            {
+                **defParams,
+                "method": "xpath_records",
+                "recordxpath": "//td",
+                "colselectors": [{"colxpath": "a", "colname": "A"}],
+            },
+            defTableParams,
+        ]:
+            stats = ExtractionStats()
+            result, errors = render(table, params, settings=Settings(), stats=stats)
+            self.assertEqual(stats.n_documents, 3)
+            self.assertEqual(stats.n_skipped_documents, 2)
+            with patch.object(TagPrefilter, "may_match", return_value=True):
+                expected = render(table, params, settings=Settings())
+            assert_frame_equal(result, expected[0])
+            self.assertEqual(errors, expected[1])
+
+
+class ElementIndexTest(unittest.TestCase):
+    HTML = """<!DOCTYPE html><title>T</title>
+<h1 id="top">Heading</h1>
+<div class="card" id="c1"><a href="/1">One</a><p><a href="/2">Two</a></p></div>
+<div class="card wide"><a href="/3">Three</a></div>
+<div><div class="card"><div><a href="/4">Four</a></div></div></div>
+<div class='card'><span><a>No href</a><a href="">Empty</a></span></div>
+<!-- <div class="card"><a href="/comment">x</a></div> -->
+<table><tr><td id="price">$1</td></tr></table>
+<p id="price">dupe<b>bold</b></p>
+<svg><a href="/svg">svg link</a><title>svg title</title></svg>
+<b><p>adopted<i>formatting</b> element</i></p>
+"""
+
+    def test_parse(self):
+        for s, steps, attribute in [
+            ("//h1", [("h1", None, None)], None),
+            ("//*[@id='price']", [("*", "id", "price")], None),
+            ('//div[@class="card"]', [("div", "class", "card")], None),
+            (
+                "//div[@class='card']//a/@href",
+                [("div", "class", "card"), ("a", None, None)],
+                "href",
+            ),
+            ("//*/@data-x", [("*", None, None)], "data-x"),
+        ]:
+            selector = SimpleSelector.parse(s)
+            self.assertEqual(
+                (selector.steps, selector.attribute), (steps, attribute), s
+            )
+
+    def test_is_slow_in_xpath(self):
+        for s, expected in [
+            ("//h1", False),
+            ("//h1/@class", False),
+            ("//*", True),
+            ("//*[@id='price']", True),
+            ("//p[@class='x']", True),
+            ("//div//a", True),
+        ]:
+            self.assertEqual(SimpleSelector.parse(s).is_slow_in_xpath, expected, s)
+
+    def test_parse_not_simple(self):
+        for s in [
+            "h1",
+            "/html/body",
+            "//div/a",
+            "//a/text()",
+            "//a[1]",
+            "//a[@href='x']",
+            "//a[@id='x'][@class='y']",
+            "//svg:a",
+            "//a | //b",
+            "count(//a)",
+            "(//a)[1]",
+            "//a/@href/..",
+            "//a/@*",
+            "//@href",
+        ]:
+            self.assertIsNone(SimpleSelector.parse(s), s)
+
+    def test_same_as_xpath(self):
+        for is_html in [True, False]:
+            html = (
+                self.HTML if is_html else "<r><div class='card'><a href='x'/></div></r>"
+            )
+            tree = parse_document(html, is_html)
+            index = ElementIndex(tree)
+            for s in [
+                "//h1",
+                "//*[@id='price']",
+                "//*[@id='missing']",
+                "//div[@class='card']//a/@href",
+                "//div[@class='card']//a",
+                "//div//p//a",
+                "//div//div",
+                "//*//*",
+                "//p//*[@id='price']",
+                "//p//b",
+                "//a/@href",
+                "//title",
+                "//*",
+                "//*/@class",
+                "//td[@id='price']",
+                "//nonexistent//a",
+            ]:
+                self.assertEqual(
+                    index.select(SimpleSelector.parse(s)), xpath(s)(tree), s
+                )
+
+    def test_zip_same_as_xpath(self):
+        colselectors = [
+            {"colxpath": "//h1", "colname": "A"},
+            {"colxpath": "//*[@id='price']", "colname": "B"},
+            {"colxpath": "//div[@class='card']//a/@href", "colname": "C"},
+            {"colxpath": "//div[@class='card']//a", "colname": "D"},
+            {"colxpath": "//svg//title", "colname": "E"},
+        ]
+        table = pd.DataFrame({"html": [self.HTML * 20, "<h1>x</h1>" * 3000]})
+        params = {**defParams, "colselectors": colselectors}
+        result = render(table, params, settings=Settings())
+        with patch.object(SimpleSelector, "parse", return_value=None):
+            expected = render(table, params, settings=Settings())
+        assert_frame_equal(result[0], expected[0])
+        self.assertEqual(result[1], expected[1])
+        self.assertEqual(result[0]["D"][1], "Two")
+
+
+class ColumnStylesheetTest(unittest.TestCase):
+    HTMLS = [
+        "<p>a <b> b</b></p><p>a  <b>b</b>\n</p>",
+        "<pre>  a\n  b <b> c  d </b></pre> tail  x",
+        "<div><script> var  x = 1;\n</script><style> p  { }</style>  y  </div>",
+        "<p>&nbsp; nb\xa0sp \xa0</p><p>form\x0cfeed</p>",
+        "<p><!-- c --> x <?pi y?></p>",
+        "<svg><title>  t  t </title><style> s  s </style></svg>",
+        "<textarea>  a  b </textarea><p>  </p><p></p>",
+        "<table><td> a </td><td>\n</td></table><ul><li>1<li> 2 </ul>",
+        "<h1 id='x' class=\"a&quot;b\">T</h1><a href='/x?a=1&amp;b=2'>l</a>",
+        "just text",
+    ]
+    SELECTORS = [
+        "//p",
+        "//p/text()",
+        "//*",
+        "//@*",
+        "//comment()",
+        "//body",
+        "p",
+        ".",
+        "//pre//b",
+        "//svg:title",
+        "//td",
+        "//text()",
+        "//h1[@class='a\"b']",
+        "//a[contains(@href, '&')]/@href",
+        "//*[position() < 3]",
+        "/",
+        "/ | //p",
+        "//p/ancestor-or-self::node()",
+    ]
+
+    def test_same_as_select(self):
+        stylesheet = ColumnStylesheet.for_selectors(
+            {s: xpath(s) for s in self.SELECTORS}
+        )
+        self.assertEqual(stylesheet.names, self.SELECTORS)
+        for html in self.HTMLS:
+            for is_html in [True, False]:
+                if not is_html:
+                    # (select() can't stringify XML processing instructions)
+                    html = "<r>%s</r>" % html.replace("&nbsp;", "").replace(
+                        "<?pi y?>", ""
+                    )
+                    try:
+                        etree.fromstring(html)
+                    except etree.XMLSyntaxError:
+                        continue
+                tree = parse_document(html, is_html)
+                self.assertEqual(
+                    stylesheet.select(tree),
+                    {s: select(tree, xpath(s)) for s in self.SELECTORS},
+                    html,
+                )
+
+    def test_skip_selectors_that_do_not_return_node_sets(self):
+        stylesheet = ColumnStylesheet.for_selectors(
+            {
+                "A": xpath("count(//p)"),
+                "B": xpath("//p"),
+                "C": xpath("boolean(//p)"),
+                "D": xpath("string(//p)"),
+                "E": xpath("//p/namespace::*"),
+            }
+        )
+        self.assertEqual(stylesheet.names, ["B"])
+        self.assertIsNone(ColumnStylesheet.for_selectors({"A": xpath("count(//p)")}))
+
+    def test_separator_in_document(self):
+        stylesheet = ColumnStylesheet.for_selectors({"A": xpath("//p")})
+        tree = parse_document("<p>a\ufdd0b</p>", True)
+        self.assertIsNone(stylesheet.select(tree))
+        # select_columns() falls back to select()
+        table = pd.DataFrame({"html": ["<p>a\ufdd0b</p><p>c</p>"]})
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "A"}]}
+        result, errors = render(table, params, settings=Settings())
+        assert_frame_equal(result, pd.DataFrame({"A": ["a\ufdd0b", "c"]}))
+
+    def test_no_document_function(self):
+        # Plain XPath has no document(); XSLT must not add one
+        self.assertIsNone(
+            ColumnStylesheet.for_selectors({"A": xpath("document('/etc/passwd')")})
+        )
+
+    def test_skip_xslt_only_functions(self):
+        selectors = [
+            "//p[generate-id(.) != '']",
+            "//p[current()]",
+            "//p[key('k', 'v')]",
+            "//p[format-number(1, '0') = '1']",
+            "//p[system-property('xsl:version')]",
+            "//p[function-available('count')]",
+            "//p[element-available('xsl:if')]",
+            "//p[unparsed-entity-uri('x') = '']",
+            "//p[document('/etc/passwd')]",
+        ]
+        for s in selectors:
+            self.assertIsNone(ColumnStylesheet.for_selectors({"A": xpath(s)}), s)
+            # ... so render() fails as select() does
+            table = pd.DataFrame({"html": ["<p>x</p>"]})
+            params = {**defParams, "colselectors": [{"colxpath": s, "colname": "A"}]}
+            result, errors = render(table, params, settings=Settings())
+            self.assertIsNone(result, s)
+            self.assertEqual(
+                errors,
+                [
+                    i18n_message(
+                        "ColumnExtractionError.message",
+                        {"column_name": "A", "error": "Unregistered function"},
+                    )
+                ],
+                s,
+            )
+        # Elements named like those functions are fine
+        self.assertEqual(
+            ColumnStylesheet.for_selectors({"A": xpath("//key | //current")}).names,
+            ["A"],
+        )
+
+    def test_render_same_as_xpath(self):
+        colselectors = [
+            {"colxpath": "//p", "colname": "A"},
+            {"colxpath": "count(//p)", "colname": "B"},
+            {"colxpath": "//pre", "colname": "C"},
+            {"colxpath": "//@href", "colname": "D"},
+        ]
+        table = pd.DataFrame(
+            {
+                "html": [
+                    "<p> a\n b </p><pre> x\n y </pre><a href='/1'>1</a>" * 50,
+                    "<p>one</p>",
+                    None,
+                    "<p>" + "x " * 10000 + "</p>",
+                ]
+            }
+        )
+        params = {**defParams, "colselectors": colselectors}
+        with ThreadPoolExecutor(2) as executor:
+            result = render(table, params, settings=Settings(), executor=executor)
+        with patch.object(ColumnStylesheet, "for_selectors", return_value=None):
+            expected = render(table, params, settings=Settings())
+        assert_frame_equal(result[0], expected[0])
+        self.assertEqual(result[1], expected[1])
+
+
+class DocumentLimitsTest(unittest.TestCase):
+    class LimitSettings(Settings):
+        MAX_BYTES_PER_HTML_DOCUMENT: int = 100
+        MAX_NODES_PER_HTML_DOCUMENT: int = 6
+
+    def test_parse_document_max_nodes(self):
+        html = "<p>a</p><!-- c --><p>b</p><p>c</p>"
+        for text in [html, html.encode("utf-8")]:
+            with self.assertRaises(DocumentTooLargeError) as cm:
+                parse_document(text, True, max_nodes=6)
+            # html, head, body, p, comment, p
+            self.assertEqual(
+                etree.tostring(cm.exception.tree),
+                b"<html><head/><body><p>a</p><!-- c --><p>b</p></body></html>",
+            )
+
+    def test_parse_document_max_nodes_resets_between_documents(self):
+        # We reuse each thread's parser: its node count must start at 0
+        html = "<p>a</p><p>b</p><p>c</p>"
+        with self.assertRaises(DocumentTooLargeError) as cm:
+            parse_document(html, True, max_nodes=5)
+        for _ in range(3):
+            self.assertEqual(
+                etree.tostring(parse_document(html, True, max_nodes=6)),
+                etree.tostring(parse_document(html, True)),
+            )
+        # ... and the truncated tree is still intact
+        self.assertEqual(
+            etree.tostring(cm.exception.tree),
+            b"<html><head/><body><p>a</p><p>b</p></body></html>",
+        )
+
+    def test_parse_document_max_nodes_releases_document(self):
+        # ... and it mustn't keep the last document (or its tree) alive
+        for max_nodes in [100, 4]:
+            data = bytearray(b"<p>secret</p><p>page</p>")
+            try:
+                tree = parse_document(memoryview(data), True, max_nodes=max_nodes)
+            except DocumentTooLargeError as err:
+                tree = err.tree
+            data.extend(b"<p>more</p>")  # BufferError if still exported
+            parser = xpathextractor._counting_html_parser(1)
+            self.assertIsNone(parser.tokenizer)
+            self.assertEqual(parser.tree.openElements, [])
+            self.assertIsNone(parser.tree.document._elementTree)
+            self.assertEqual(etree.tostring(tree).count(b"secret"), 1)
+
+    def test_parse_document_under_max_nodes(self):
+        html = "<p>a</p><table><td>b</td></table>"
+        self.assertEqual(
+            etree.tostring(parse_document(html, True, max_nodes=9)),
+            etree.tostring(parse_document(html, True)),
+        )
+
+    def test_skip_document_over_max_bytes(self):
+        table = pd.DataFrame(
+            {
+                "url": ["https://a", "https://b"],
+                "html": ["<p>a</p>", "<p>b</p>" + " " * 100],
+            }
+        )
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+        result, errors = render(table, params, settings=self.LimitSettings())
+        assert_frame_equal(result, pd.DataFrame({"P": ["a"]}))
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTooLarge",
+                    {"rowname": "https://b", "max_bytes": 100},
+                )
+            ],
+        )
+
+    def test_max_bytes_counts_utf8_bytes_of_str(self):
+        # 50 characters, 106 bytes
+        table = pd.DataFrame(
+            {"html": ["<p>a</p>", "<p>" + "é" * 30 + "</p>" + "€" * 13]}
+        )
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+        result, errors = render(table, params, settings=self.LimitSettings())
+        assert_frame_equal(result, pd.DataFrame({"P": ["a"]}))
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTooLarge",
+                    {"rowname": "input html row 2", "max_bytes": 100},
+                )
+            ],
+        )
+
+    def test_skip_table_document_over_max_bytes(self):
+        table = pd.DataFrame({"html": ["<table><tr><td>1</td></tr></table>" * 4]})
+        result, errors = render(table, defTableParams, settings=self.LimitSettings())
+        self.assertIsNone(result)
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTooLarge",
+                    {"rowname": "input html row 1", "max_bytes": 100},
+                )
+            ],
+        )
+
+    def test_truncate_document_over_max_nodes(self):
+        table = pd.DataFrame({"html": ["<p>a</p>", "<p>b</p><p>c</p><p>d</p><p>e</p>"]})
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+        result, errors = render(table, params, settings=self.LimitSettings())
+        assert_frame_equal(result, pd.DataFrame({"P": ["a", "b", "c", "d"]}))
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTruncated",
+                    {"rowname": "input html row 2", "max_nodes": 6},
+                )
+            ],
+        )
+
+    def test_truncate_batched_document(self):
+        # html5lib clones these formatting elements into each <p>: the
+        # document has more nodes than characters
+        formatting = "<b><i><u><s><em><strong><big><small><tt><code><font><nobr>"
+        short_but_big = "<div>" + formatting + "</div>" + "<p>x</p>" * 450
+        self.assertLessEqual(
+            len(short_but_big), xpathextractor.BATCH_MAX_DOCUMENT_LENGTH
+        )
+        table = pd.DataFrame({"html": ["<p>a</p>", short_but_big, "<p>b</p>"]})
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+
+        class BatchLimitSettings(Settings):
+            MAX_NODES_PER_HTML_DOCUMENT = xpathextractor.BATCH_MAX_DOCUMENT_LENGTH
+
+        result, errors = render(table, params, settings=BatchLimitSettings())
+        with patch.object(xpathextractor, "BATCH_MAX_DOCUMENT_LENGTH", 0):
+            expected = render(table, params, settings=BatchLimitSettings())
+        assert_frame_equal(result, expected[0])
+        self.assertEqual(errors, expected[1])
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTruncated",
+                    {
+                        "rowname": "input html row 2",
+                        "max_nodes": xpathextractor.BATCH_MAX_DOCUMENT_LENGTH,
+                    },
+                )
+            ],
+        )
+
+    def test_truncate_per_document(self):
+        table = pd.DataFrame({"html": ["<i>a</i><i>b</i><i>c</i><i>d</i><b>x</b>"]})
+        params = {
+            **defParams,
+            "method": "xpath_per_document",
+            "colselectors": [
+                {"colxpath": "//i", "colname": "I"},
+                {"colxpath": "//b", "colname": "B"},
+            ],
+        }
+        result, errors = render(table, params, settings=self.LimitSettings())
+        assert_frame_equal(
+            result, pd.DataFrame({"I": ["a"], "B": [None]}, dtype=object)
+        )
+        self.assertEqual(
+            errors,
+            [
+                i18n_message(
+                    "warning.documentTruncated",
+                    {"rowname": "input html row 1", "max_nodes": 6},
+                )
+            ],
+        )
+
+
+class ExtractorTest(unittest.TestCase):
+    def test_missing_override_fails_at_construction(self):
+        class NoExtractDocument(xpathextractor.Extractor):
+            cache_fingerprint = "x"
+
+        with self.assertRaises(TypeError):
+            NoExtractDocument(False)
+
+    def test_keeps_null_documents_requires_null_document(self):
+        class NoNullDocument(xpathextractor.Extractor):
+            keeps_null_documents = True
+            cache_fingerprint = "x"
+
+            def extract_document(self, html):
+                return xpathextractor.ExtractedRows({}, 0)
+
+        with self.assertRaisesRegex(TypeError, "null_document"):
+            NoNullDocument(False)
+
+    def test_batch_size(self):
+        extractor, _ = xpathextractor._make_extractor(
+            RenderPreviewTest.table, RenderPreviewTest.params, settings=Settings()
+        )
+        documents = list(xpathextractor._iter_documents(RenderPreviewTest.table))
+        extract_documents = extractor.extract_documents
+        for batch_size, expected_sizes in [(500, [4]), (3, [3, 1]), (1, [1] * 4)]:
+            sizes = []
+
+            def record_size(htmls):
+                sizes.append(len(htmls))
+                return extract_documents(htmls)
+
+            with patch.object(extractor, "extract_documents", record_size):
+                rows = list(extractor.extract(documents, batch_size=batch_size))
+            self.assertEqual(sizes, expected_sizes)
+            self.assertEqual([r.n_rows for r in rows], [2, 1, 3, 1])
+
+    def test_batch_size_defaults_to_current_batch_size(self):
+        extractor, _ = xpathextractor._make_extractor(
+            RenderPreviewTest.table, RenderPreviewTest.params, settings=Settings()
+        )
+        documents = list(xpathextractor._iter_documents(RenderPreviewTest.table))
+        extract_documents = extractor.extract_documents
+        sizes = []
+
+        def record_size(htmls):
+            sizes.append(len(htmls))
+            return extract_documents(htmls)
+
+        with patch.object(xpathextractor, "BATCH_SIZE", 3), patch.object(
+            extractor, "extract_documents", record_size
+        ):
+            list(extractor.extract(documents))
+        self.assertEqual(sizes, [3, 1])
+
+
+class ColumnUnionAccumulatorTest(unittest.TestCase):
+    def test_union_in_first_seen_order(self):
+        accumulator = ColumnUnionAccumulator()
+        accumulator.append_frame(pd.DataFrame({"B": ["1", "2"], "A": ["2", "3"]}))
+        accumulator.append_frame(pd.DataFrame({"C": ["x"], "A": ["4"]}))
+        accumulator.append_frame(pd.DataFrame({"B": ["5"]}))
+        self.assertEqual(len(accumulator), 4)
+        self.assertEqual(accumulator.column_names, ["B", "A", "C"])
+        assert_frame_equal(
+            accumulator.to_frame(),
+            pd.DataFrame(
+                {
+                    "B": ["1", "2", None, "5"],
+                    "A": ["2", "3", "4", None],
+                    "C": [None, None, "x", None],
+                }
+            ),
+        )
+
+    def test_empty_frame_adds_columns(self):
+        accumulator = ColumnUnionAccumulator()
+        accumulator.append_frame(pd.DataFrame({"A": []}, dtype=str))
+        assert_frame_equal(accumulator.to_frame(), pd.DataFrame({"A": []}, dtype=str))
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class RenderArrowFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "input.arrow")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, table: pd.DataFrame, batch_size=2, schema=None):
+        arrow_table = pyarrow.Table.from_pandas(
+            table, schema=schema, preserve_index=False
+        )
+        with pyarrow.OSFile(self.path, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table, max_chunksize=batch_size)
+
+    def test_same_as_render(self):
+        table = pd.DataFrame(
+            {
+                "url": ["http://a", "http://b", "http://c", "http://d", "http://e"],
+                "html": [
+                    "<h1>café</h1><table><tr><th>A</th></tr><tr><td>1</td></tr></table>",
+                    None,
+                    "<p>no heading</p>",
+                    "<h1>x</h1><h1>y</h1>" + "<p>long</p>" * 1000,
+                    "",
+                ],
+            }
+        )
+        self.write(table)
+        for params in [
+            {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "H"}]},
+            {
+                **defParams,
+                "method": "xpath_per_document",
+                "colselectors": [{"colxpath": "//h1", "colname": "H"}],
+            },
+            defTableParams,
+            {**defParams, "method": "all_tables"},
+        ]:
+            result = render_arrow_file(self.path, params, settings=Settings())
+            expected = render(table, params, settings=Settings())
+            assert_frame_equal(result[0], expected[0])
+            self.assertEqual(result[1], expected[1])
+
+    def test_no_url_column(self):
+        table = pd.DataFrame({"html": ["<h1>a</h1>", "<p>b</p>", "<h1>c</h1>"]})
+        self.write(table)
+        params = {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "H"}]}
+        result, errors = render_arrow_file(self.path, params, settings=Settings())
+        assert_frame_equal(result, pd.DataFrame({"H": ["a", "c"]}))
+        self.assertEqual(errors, [])
+
+    def test_string_is_utf8_whatever_meta_says(self):
+        html = '<meta charset="iso-8859-1"><h1>café</h1>'
+        self.write(pd.DataFrame({"html": [html] * 3}))
+        params = {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "H"}]}
+        result, _ = render_arrow_file(self.path, params, settings=Settings())
+        self.assertEqual(result["H"].tolist(), ["café"] * 3)
+
+    def test_binary_detects_charset(self):
+        html = '<meta charset="iso-8859-1"><h1>café</h1>'.encode("latin-1")
+        self.write(
+            pd.DataFrame({"html": [html]}),
+            schema=pyarrow.schema([("html", pyarrow.binary())]),
+        )
+        params = {**defParams, "colselectors": [{"colxpath": "//h1", "colname": "H"}]}
+        result, _ = render_arrow_file(self.path, params, settings=Settings())
+        self.assertEqual(result["H"].tolist(), ["café"])
+
+    def test_views_are_zero_copy(self):
+        array = pyarrow.array(["ab", None, "", "cdé"]).slice(1)
+        views = list(xpathextractor._arrow_views(array))
+        self.assertEqual(
+            [None if view is None else bytes(view) for view in views],
+            [None, b"", "cdé".encode("utf-8")],
+        )
+        # "cdé" starts after "ab" in the array's data buffer
+        data = array.buffers()[2]
+        self.assertEqual(pyarrow.py_buffer(views[2]).address, data.address + 2)
+
+    def test_no_html_column(self):
+        self.write(pd.DataFrame({"A": ["x"]}))
+        result, errors = render_arrow_file(self.path, defParams, settings=Settings())
+        self.assertIsNone(result)
+        self.assertEqual(errors[0]["message"], i18n_message("error.noHtml.error"))
+
+
+class ShardTest(unittest.TestCase):
+    table = pd.DataFrame(
+        {
+            "url": ["http://%d" % i for i in range(7)],
+            "html": [
+                "<h1>a</h1><p>p</p><table><tr><th>A</th></tr><tr><td>1</td></tr></table>",
+                None,
+                "<p>no heading</p>",
+                "<h1>b</h1><h1>c</h1><p>d</p>",
+                "<table><tr><th>B</th></tr><tr><td>x</td></tr></table>",
+                "<h1>e</h1><p>f</p><p>g</p>",
+                "<h1>9</h1><table><tr><td>2</td></tr></table>",
+            ],
+        },
+        index=[10, 11, 12, 13, 14, 15, 16],  # warnings name rows by label
+    )
+    params_list = [
+        {
+            **defParams,
+            "colselectors": [
+                {"colxpath": "//h1", "colname": "H"},
+                {"colxpath": "//p", "colname": "P"},
+            ],
+        },
+        {
+            **defParams,
+            "method": "xpath_per_document",
+            "colselectors": [{"colxpath": "//h1", "colname": "H"}],
+        },
+        defTableParams,
+        {**defParams, "method": "all_tables"},
+        defParams,  # no selectors: output is the input
+        {**defParams, "colselectors": [{"colxpath": "//[", "colname": "H"}]},
+    ]
+
+    def render_in_shards(self, table, params, bounds):
+        shards = [
+            render_shard(table, params, settings=Settings(), start=start, stop=stop)
+            for start, stop in zip(bounds, bounds[1:])
+        ]
+        # Order doesn't matter; and shards survive serialization
+        shards = [ShardResult.from_bytes(shard.to_bytes()) for shard in shards]
+        return merge_shards(reversed(shards), settings=Settings())
+
+    def assertSameResult(self, result, expected):
+        if expected[0] is None:
+            self.assertIsNone(result[0])
+        else:
+            assert_frame_equal(result[0], expected[0])
+        self.assertEqual(result[1], expected[1])
+
+    def test_same_as_render(self):
+        for params in self.params_list:
+            expected = render(self.table, params, settings=Settings())
+            for bounds in [[0, 7], [0, 3, 7], [0, 1, 2, 3, 4, 5, 6, 7], [0, 0, 5, 7]]:
+                with self.subTest(params=params, bounds=bounds):
+                    result = self.render_in_shards(self.table, params, bounds)
+                    self.assertSameResult(result, expected)
+
+    def test_first_warning_row(self):
+        params = self.params_list[0]
+        shard = render_shard(self.table, params, settings=Settings(), start=1, stop=7)
+        self.assertEqual(shard.first_warning_row, 2)  # row 1 is null
+        self.assertEqual(
+            shard.warnings,
+            [i18n_message("warning.extractedDifferentLengths", {"row": 13})],
+        )
+        shard = render_shard(self.table, params, settings=Settings(), start=0, stop=2)
+        self.assertIsNone(shard.first_warning_row)
+
+    def test_error_in_later_shard(self):
+        table = pd.DataFrame({"html": [None, None, "<p>x</p>"]})
+        params = {
+            **defParams,
+            "colselectors": [{"colxpath": "//p[f()]", "colname": "P"}],
+        }
+        expected = render(table, params, settings=Settings())
+        self.assertIsNone(expected[0])
+        self.assertSameResult(self.render_in_shards(table, params, [0, 2, 3]), expected)
+
+    def test_shards_must_cover_all_rows(self):
+        params = self.params_list[0]
+
+        def shard(start, stop, params=params):
+            return render_shard(
+                self.table, params, settings=Settings(), start=start, stop=stop
+            )
+
+        for shards in [
+            [],
+            [shard(0, 3), shard(4, 7)],
+            [shard(0, 4), shard(3, 7)],
+            [shard(0, 6)],
+            [shard(0, 3), shard(3, 7, params=defParams)],
+        ]:
+            with self.assertRaises(ValueError):
+                merge_shards(shards, settings=Settings())
+
+    def test_from_bytes_rejects_other_formats(self):
+        shard = render_shard(
+            self.table, self.params_list[0], settings=Settings(), start=0, stop=7
+        )
+        values = json.loads(zlib.decompress(shard.to_bytes()))
+        for data in [
+            b"",
+            b"not a shard",
+            # what version 1 wrote
+            pickle.dumps([1, [getattr(shard, name) for name in shard.__slots__]]),
+            zlib.compress(json.dumps({**values, "version": 1}).encode("utf-8")),
+            zlib.compress(json.dumps([values]).encode("utf-8")),
+        ]:
+            with self.assertRaises(ValueError):
+                ShardResult.from_bytes(data)
+
+    def test_separate_processes(self):
+        params = self.params_list[0]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_path = os.path.join(tempdir, "input.pickle")
+            self.table.to_pickle(input_path)
+            code = (
+                "import sys, pandas as pd, json\n"
+                "from xpathextractor import render_shard\n"
+                "from test_xpathextractor import Settings\n"
+                "input_path, params, start, stop, output_path = sys.argv[1:]\n"
+                "shard = render_shard(pd.read_pickle(input_path), json.loads(params), "
+                "settings=Settings(), start=int(start), stop=int(stop))\n"
+                "open(output_path, 'wb').write(shard.to_bytes())\n"
+            )
+            processes = []
+            for i, (start, stop) in enumerate([(0, 2), (2, 5), (5, 7)]):
+                output_path = os.path.join(tempdir, "shard%d" % i)
+                processes.append(
+                    (
+                        output_path,
+                        subprocess.Popen(
+                            [
+                                sys.executable,
+                                "-c",
+                                code,
+                                input_path,
+                                json.dumps(params),
+                                str(start),
+                                str(stop),
+                                output_path,
+                            ],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                        ),
+                    )
+                )
+            shards = []
+            for output_path, process in processes:
+                self.assertEqual(process.wait(), 0)
+                with open(output_path, "rb") as f:
+                    shards.append(ShardResult.from_bytes(f.read()))
+        self.assertSameResult(
+            merge_shards(shards, settings=Settings()),
+            render(self.table, params, settings=Settings()),
+        )
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class ServerTest(unittest.TestCase):
+    table = ShardTest.table
+    params_list = [
+        *ShardTest.params_list,
+        {**defTableParams, "tablenum": 3},  # error
+        defParams,  # no colselectors: return input
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tempdir.name, "server.sock")
+        code = (
+            "import sys\n"
+            "from xpathextractor import serve\n"
+            "from test_xpathextractor import Settings\n"
+            "serve(sys.argv[1], settings=Settings(), n_workers=2,"
+            " max_jobs_per_worker=3, max_request_bytes=100000, request_timeout=2)\n"
+        )
+        cls.server = subprocess.Popen(
+            [sys.executable, "-c", code, cls.path],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        for _ in range(600):  # path appears when the server is warm
+            if os.path.exists(cls.path) or cls.server.poll() is not None:
+                break
+            time.sleep(0.1)
+        cls.client = RenderClient(cls.path, timeout=60)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        path_exists = os.path.exists(cls.path)
+        cls.tempdir.cleanup()
+        assert not path_exists, "server must delete its socket when it stops"
+
+    def test_same_as_render(self):
+        for params in self.params_list:
+            with self.subTest(params=params):
+                result = self.client.render(self.table, params)
+                expected = render(self.table, params, settings=Settings())
+                if expected[0] is None:
+                    self.assertIsNone(result[0])
+                else:
+                    assert_frame_equal(result[0], expected[0])
+                self.assertEqual(result[1], expected[1])
+
+    def test_no_html_column(self):
+        result = self.client.render(pd.DataFrame({"x": [1]}), defParams)
+        expected = render(pd.DataFrame({"x": [1]}), defParams, settings=Settings())
+        self.assertEqual(result, expected)
+
+    def test_concurrent_jobs(self):
+        # More jobs than workers, and more than max_jobs_per_worker each
+        params = {**defParams, "colselectors": [{"colxpath": "//p", "colname": "P"}]}
+
+        def job(i):
+            table = pd.DataFrame({"html": ["<p>%d</p><p>x</p>" % i]})
+            return self.client.render(table, params)
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(job, range(30)))
+        for i, (result, warnings) in enumerate(results):
+            assert_frame_equal(result, pd.DataFrame({"P": [str(i), "x"]}))
+            self.assertEqual(warnings, [])
+
+    def test_request_too_large(self):
+        table = pd.DataFrame({"html": ["<p>x</p>" * 20000]})
+        with self.assertRaisesRegex(RenderServerError, "limit is 100000"):
+            self.client.render(table, defParams)
+        # The server is still up
+        self.assertEqual(self.client.render(self.table, defParams)[1], [])
+
+    def test_idle_clients_do_not_stall_workers(self):
+        # As many silent clients as workers
+        idlers = [socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) for _ in range(2)]
+        try:
+            for idler in idlers:
+                idler.connect(self.path)
+            time.sleep(0.2)  # let the workers accept them
+            client = RenderClient(self.path, timeout=10)
+            self.assertEqual(client.render(self.table, defParams)[1], [])
+            for idler in idlers:
+                self.assertEqual(idler.recv(1), b"")  # the worker hung up
+        finally:
+            for idler in idlers:
+                idler.close()
+
+    def test_bad_params(self):
+        with self.assertRaisesRegex(RenderServerError, "KeyError"):
+            self.client.render(self.table, {"colselectors": []})
+        self.assertEqual(self.client.render(self.table, defParams)[1], [])
+
+    @unittest.skipUnless(os.path.exists("/proc/self/stat"), "needs /proc")
+    def test_stop_signal_while_forking_kills_new_worker(self):
+        # SIGTERM the server right after it forks, before it records the
+        # worker's pid
+        code = (
+            "import os, signal, sys\n"
+            "from xpathextractor import serve\n"
+            "from test_xpathextractor import Settings\n"
+            "fork = os.fork\n"
+            "def fork_then_stop():\n"
+            "    pid = fork()\n"
+            "    if pid != 0:\n"
+            "        open(sys.argv[2], 'w').write(str(pid))\n"
+            "        os.kill(os.getpid(), signal.SIGTERM)\n"
+            "    return pid\n"
+            "os.fork = fork_then_stop\n"
+            "serve(sys.argv[1], settings=Settings(), n_workers=1)\n"
+        )
+        with tempfile.TemporaryDirectory() as tempdir:
+            pid_path = os.path.join(tempdir, "worker.pid")
+            subprocess.run(
+                [sys.executable, "-c", code, tempdir + "/server.sock", pid_path],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                check=True,
+                timeout=60,
+            )
+            with open(pid_path) as f:
+                worker_pid = int(f.read())
+        try:
+            with open("/proc/%d/stat" % worker_pid) as f:
+                state = f.read().rsplit(")", 1)[1].split()[0]
+        except FileNotFoundError:
+            state = None  # the server killed and reaped it
+        if state not in (None, "Z", "X"):
+            os.kill(worker_pid, signal.SIGKILL)
+            self.fail("worker %d outlived its server" % worker_pid)
+
+
+class ImportTest(unittest.TestCase):
+    def test_import_is_lazy(self):
+        # -I: ignore PYTHONPATH and site customizations that may import pandas
+        code = (
+            "import sys; sys.path.insert(0, %r); import xpathextractor; "
+            "print(sorted({'pandas', 'html5lib', 'sqlite3', 'asyncio'} & "
+            "set(sys.modules)))" % os.path.dirname(os.path.abspath(__file__))
+        )
+        output = subprocess.run(
+            [sys.executable, "-I", "-c", code],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        self.assertEqual(output, "[]\n")
+
+
+class MigrationTest(unittest.TestCase):
+    def test_migrate_v0(self):
+        v0_params = {"colselectors": [{"colxpath": "foo", "colname": "bar"}]}
+        v1_params = {"method": "xpath", **v0_params, "tablenum": 1}
+        v2_params = {**v1_params, "recordxpath": ""}
+
+        new_params = migrate_params(v0_params)
+        self.assertEqual(new_params, v2_params)
+
+    def test_migrate_v1(self):
+        v1_params = {
+            "method": "table",
+            "tablenum": 2,
+            "colselectors": [{"colxpath": "foo", "colname": "bar"}],
+        }
+        new_params = migrate_params(v1_params)
+        self.assertEqual(new_params, {**v1_params, "recordxpath": ""})
 
 
 if __name__ == "__main__":
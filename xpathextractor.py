@@ -1,21 +1,62 @@
 #!/usr/bin/env python3
 
-from typing import Dict, List, Tuple
+from __future__ import annotations  # so pd.DataFrame annotations don't import
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
+import abc
+import collections
+import copy
+import functools
+import io
+import importlib
+import hashlib
+import itertools
+import json
+import os
+import struct
+import threading
+import time
+import zlib
 import warnings
-import html5lib
-from html5lib.constants import DataLossWarning
-import html5lib.filters.whitespace
 from lxml import etree
-from lxml.html import html5parser
-import pandas as pd
 import re
 from cjwmodule import i18n
-from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
+
+
+class _LazyModule:
+    """
+    A module we import the first time someone reads one of its attributes.
+
+    pandas and html5lib take most of our import time, and each render only
+    needs some of them. (A fresh interpreter per render pays for every
+    import.)
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+html5lib = _LazyModule("html5lib")
+html5parser = _LazyModule("lxml.html.html5parser")
+pd = _LazyModule("pandas")
+pa = _LazyModule("pyarrow")  # optional: render_arrow_file() and serve() need it
 
 # ---- Xpath ----
 
+
+class ExtractionError(Exception):
+    """
+    A problem that stops extraction. Subclasses define `i18n_message`.
+    """
+
+
 # Custom exception class used to pass a problem with a particular column
-class ColumnExtractionError(Exception):
+class ColumnExtractionError(ExtractionError):
     def __init__(self, column_name, error):
         self.column_name = column_name
         self.error = error
@@ -32,9 +73,16 @@ class ColumnExtractionError(Exception):
 # GLOBALLY ignore the warnings that (hopefully) only this module will emit. The
 # warnings all have to do with "invalid" HTML, but that HTML is often good
 # enough for our users so it isn't worth dumping anything to stderr.
-warnings.filterwarnings(
-    "ignore", category=DataLossWarning, module=r"html5lib\._ihatexml"
-)
+#
+# (We match by module, not by category=DataLossWarning: importing that class
+# would import html5lib. html5lib._ihatexml only emits DataLossWarning.)
+warnings.filterwarnings("ignore", module=r"html5lib\._ihatexml")
+
+
+# Namespace prefixes selectors may use
+_NAMESPACES = {
+    "svg": "http://www.w3.org/2000/svg",
+}
 
 
 def xpath(s: str) -> etree.XPath:
@@ -51,39 +99,281 @@ def xpath(s: str) -> etree.XPath:
     """
     return etree.XPath(
         s,
-        smart_strings=True,  # so result strings don't ref XML doc
-        namespaces={
-            "svg": "http://www.w3.org/2000/svg",
-        },
+        # Return plain str, not "smart strings": those reference their parent
+        # element, so each would keep its whole document tree alive
+        smart_strings=False,
+        namespaces=_NAMESPACES,
     )
 
 
-def parse_document(text: str, is_html: bool) -> etree._Element:
+class _MemoryViewReader(io.RawIOBase):
+    """
+    A read-only file over a memoryview, so html5lib can read it in chunks.
+
+    io.BytesIO(view) would copy the whole buffer.
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._position : self._position + len(buffer)]
+        n = len(chunk)
+        buffer[:n] = chunk
+        self._position += n
+        return n
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, min(offset, len(self._view)))
+        return self._position
+
+    def close(self) -> None:
+        # Stop exporting the caller's buffer, even if html5lib leaves a
+        # reference cycle to us
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class DocumentTooLargeError(Exception):
+    """
+    parse_document() stopped building a tree, because it had `max_nodes`.
+
+    `tree` is the tree it built so far.
+    """
+
+    def __init__(self, tree: etree._Element, max_nodes: int):
+        super().__init__("Document has more than %d nodes" % max_nodes)
+        self.tree = tree
+        self.max_nodes = max_nodes
+
+
+class _NodeLimitReached(Exception):
+    pass
+
+
+# Defined on first use, because importing html5lib's tree builders is slow
+@functools.lru_cache(maxsize=None)
+def _counting_tree_builder_class():
+    from html5lib.treebuilders import etree_lxml
+
+    class CountingTreeBuilder(etree_lxml.TreeBuilder):
+        """
+        An html5lib tree builder that stops after building `max_nodes` nodes.
+
+        Elements that html5lib invents (e.g., <tbody>) and comments count.
+        """
+
+        def __init__(self, namespaceHTMLElements):
+            super().__init__(namespaceHTMLElements)
+            self.max_nodes = None  # set before each parse
+            self.n_nodes = 0
+            builder = self
+
+            def count():
+                builder.n_nodes += 1
+                if builder.n_nodes > builder.max_nodes:
+                    raise _NodeLimitReached
+
+            class Element(self.elementClass):
+                def __init__(self, name, namespace):
+                    count()
+                    super().__init__(name, namespace)
+
+            class Comment(self.commentClass):
+                def __init__(self, data):
+                    count()
+                    super().__init__(data)
+
+            self.elementClass = Element
+            self.commentClass = Comment
+
+        def reset(self):
+            super().reset()  # html5lib calls this before each parse
+            self.n_nodes = 0
+
+    return CountingTreeBuilder
+
+
+_counting_parsers = threading.local()  # .parser: this thread's parser
+
+
+def _counting_html_parser(max_nodes: int):
+    """
+    Return this thread's html5lib parser that stops after `max_nodes` nodes.
+
+    Building a parser -- and its tree builder's Element classes -- takes
+    longer than parsing a small document, so each thread reuses one.
+    (html5lib resets a parser's state at the start of each parse, and
+    _html_fromstring() drops it at the end.)
+    """
+    try:
+        parser = _counting_parsers.parser
+    except AttributeError:
+        parser = _counting_parsers.parser = html5lib.HTMLParser(
+            tree=_counting_tree_builder_class(), namespaceHTMLElements=False
+        )
+    parser.tree.max_nodes = max_nodes
+    return parser
+
+
+def _html_fromstring(data: Union[str, bytes, memoryview], parser, encoding, max_nodes):
+    """
+    Like html5parser.fromstring(), with more options.
+
+    html5parser.fromstring() only accepts str and bytes, and it lets
+    html5lib guess the charset with chardet. We want memoryview input and a
+    deterministic charset: `encoding` if set; otherwise a BOM or
+    `<meta charset>`; otherwise UTF-8.
+
+    If `max_nodes` is set, stop parsing after building that many nodes and
+    raise DocumentTooLargeError.
+    """
+    if isinstance(data, str):
+        stream = data
+        options = {}
+        start = data[:50]
+    else:
+        options = {"useChardet": False, "default_encoding": "utf-8"}
+        if encoding is not None:
+            options["transport_encoding"] = encoding
+        if isinstance(data, bytes):
+            stream = data  # html5lib wraps it in BytesIO, which doesn't copy
+        else:
+            stream = _MemoryViewReader(memoryview(data))
+        start = bytes(memoryview(data).cast("B")[:50]).decode("ascii", "replace")
+
+    try:
+        document = parser.parse(stream, **options).getroot()
+    except _NodeLimitReached:
+        # The root <html> is the first node, so it exists
+        raise DocumentTooLargeError(
+            parser.tree.getDocument().getroot(), max_nodes
+        ) from None
+    finally:
+        # A reused parser mustn't keep this tree, or `data`, alive
+        parser.tree.reset()
+        parser.tokenizer = None
+        parser.errors = []
+        if isinstance(stream, _MemoryViewReader):
+            stream.close()
+
+    # The rest is html5parser.fromstring()'s logic: return the document if
+    # the input looks like one; otherwise return the element(s) that came
+    # from the input.
+    start = start.lstrip().lower()
+    if start.startswith("<html") or start.startswith("<!doctype"):
+        return document
+    head = html5parser._find_tag(document, "head")
+    if len(head):
+        return document
+    body = html5parser._find_tag(document, "body")
+    if (
+        len(body) == 1
+        and (not body.text or not body.text.strip())
+        and (not body[-1].tail or not body[-1].tail.strip())
+    ):
+        return body[0]
+    if html5parser._contains_block_level_tag(body):
+        body.tag = "div"
+    else:
+        body.tag = "span"
+    return body
+
+
+def parse_document(
+    text: Union[str, bytes, memoryview],
+    is_html: bool,
+    encoding: Optional[str] = None,
+    *,
+    max_nodes: Optional[int] = None,
+) -> etree._Element:
     """Build a etree root node from `text`.
 
+    `text` may be str, or it may be bytes/memoryview. Parsing bytes avoids a
+    decode (and, for XML, a re-encode) of the whole document. For bytes,
+    `encoding` is the charset; if it is None, we detect it: HTML obeys a BOM
+    or `<meta charset>` and falls back to UTF-8; XML obeys a BOM or XML
+    declaration and falls back to UTF-8.
+
+    For HTML, `max_nodes` (if set, at least 1) limits the tree's size: after
+    building that many elements and comments, we stop and raise
+    DocumentTooLargeError, whose `tree` is what we built so far.
+
     Throws TODO what errors?
     """
     if is_html:
-        parser = html5parser.HTMLParser(namespaceHTMLElements=False)
-        document = html5parser.fromstring(text, parser=parser)
-        return document
+        if max_nodes is None:
+            parser = html5parser.HTMLParser(namespaceHTMLElements=False)
+            if isinstance(text, str):
+                return html5parser.fromstring(text, parser=parser)
+        else:
+            parser = _counting_html_parser(max_nodes)
+        return _html_fromstring(text, parser, encoding, max_nodes)
     else:
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+            encoding = "utf-8"
         parser = etree.XMLParser(
-            encoding="utf-8",
+            encoding=encoding,
             # Disable as much as we can, for security
             load_dtd=False,
             collect_ids=False,
             resolve_entities=False,
         )
-        return etree.fromstring(text.encode("utf-8"), parser)
+        return etree.fromstring(text, parser)
 
 
-# `etree` second argument is as suggested at
-# https://github.com/html5lib/html5lib-python/issues/338#issuecomment-298789202
-#
-# Solves walking over comments (bug #166144899)
-TreeWalker = html5lib.getTreeWalker("etree", etree)
-WhitespaceFilter = html5lib.filters.whitespace.Filter
+def parse_documents(
+    texts: List[Union[str, bytes, memoryview]],
+    is_html: bool,
+    encoding: Optional[str] = None,
+    *,
+    executor=None,
+) -> List[etree._Element]:
+    """
+    Call parse_document() on each of `texts`; return the trees in order.
+
+    If `executor` is a thread pool (concurrent.futures.ThreadPoolExecutor),
+    parse on it. libxml2 parses XML without holding the GIL, so XML parses
+    in parallel. (html5lib is pure Python, so HTML barely speeds up.) Each
+    call builds its own parser: lxml parsers aren't thread-safe.
+    """
+    if executor is None:
+        return [parse_document(text, is_html, encoding) for text in texts]
+    return list(
+        executor.map(lambda text: parse_document(text, is_html, encoding), texts)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _html5lib_tree_walker():
+    """
+    Return (TreeWalker, WhitespaceFilter), importing html5lib's modules.
+    """
+    import html5lib.filters.whitespace
+
+    # `etree` second argument is as suggested at
+    # https://github.com/html5lib/html5lib-python/issues/338#issuecomment-298789202
+    #
+    # Solves walking over comments (bug #166144899)
+    TreeWalker = html5lib.getTreeWalker("etree", etree)
+    WhitespaceFilter = html5lib.filters.whitespace.Filter
+    return TreeWalker, WhitespaceFilter
 
 
 def _item_to_string(item) -> str:
@@ -105,6 +395,7 @@ def _item_to_string(item) -> str:
         #
         # Finally, we strip the output. That's what IMPORTXML() does, and the
         # user probably wants it.
+        TreeWalker, WhitespaceFilter = _html5lib_tree_walker()
         texts = [
             token["data"]
             for token in WhitespaceFilter(TreeWalker(item))
@@ -137,6 +428,121 @@ def select(tree: etree._Element, selector: etree.XPath) -> List[str]:
         return [result]
 
 
+class FirstMatchSelector:
+    """
+    An XPath selector that only wants its first result.
+
+    For node-set expressions (e.g., `//h1`), we evaluate `(EXPR)[1]`, which
+    lets libxml2 stop scanning at the first match. Scalar expressions (e.g.,
+    `count(//h1)`) can't be filtered that way: we evaluate them as-is.
+    XPath 1.0 result types are static, so we learn which kind of expression
+    this is on first evaluation and remember it.
+    """
+
+    __slots__ = ("full", "first", "returns_node_set")
+
+    def __init__(self, s: str):
+        self.full = xpath(s)
+        self.first = xpath("(" + s + ")[1]")
+        self.returns_node_set = None  # unknown until we evaluate
+
+    @property
+    def path(self) -> str:
+        return self.full.path
+
+
+def select_first(tree: etree._Element, selector: FirstMatchSelector):
+    """
+    Run an xpath expression on `tree` and return its first result.
+
+    Return None if there is no match; a str for nodes, strings and booleans;
+    a float for numbers (e.g., `count(//a)`).
+
+    Raise XPathEvalError on error.
+    """
+    if selector.returns_node_set is not False:
+        try:
+            result = selector.first(tree)
+        except etree.XPathEvalError:
+            if selector.returns_node_set:
+                raise  # a real error
+            # `(EXPR)[1]` is invalid because EXPR isn't a node-set
+            result = None
+        else:
+            if isinstance(result, list):
+                selector.returns_node_set = True
+                return _item_to_string(result[0]) if result else None
+        selector.returns_node_set = False
+
+    result = selector.full(tree)
+    if isinstance(result, bool):
+        # Workbench does not support bool
+        return str(result)
+    elif isinstance(result, float):
+        return result
+    else:
+        return str(result)
+
+
+def select_columns(
+    tree: etree._Element,
+    columns_to_parse: Dict[str, etree.XPath],
+    simple_selectors: Optional[Dict[str, SimpleSelector]] = None,
+    stylesheet: Optional["ColumnStylesheet"] = None,
+) -> Dict[str, List[str]]:
+    """
+    Call select() with each selector; return {name: list of str}.
+
+    The lists may have different lengths. See _zip_pad().
+
+    If `simple_selectors` is set, answer those columns from an ElementIndex
+    of `tree` instead of evaluating their XPath. If `stylesheet` is set,
+    answer its columns by running it (if it can answer them for `tree`).
+
+    Raise ColumnExtractionError on error.
+    """
+    simple_selectors = simple_selectors or {}
+    index = ElementIndex(tree) if simple_selectors else None
+    transformed = (stylesheet.select(tree) if stylesheet is not None else None) or {}
+    values = {}
+    for name, selector in columns_to_parse.items():
+        if name in transformed:
+            values[name] = transformed[name]
+            continue
+        if name in simple_selectors:
+            values[name] = [
+                _item_to_string(item) for item in index.select(simple_selectors[name])
+            ]
+            continue
+        try:
+            # str(): `count(//a)` gives a float
+            values[name] = [str(value) for value in select(tree, selector)]
+        except etree.XPathEvalError as err:
+            raise ColumnExtractionError(name, str(err))
+    return values
+
+
+def _zip_pad(values: Dict[str, list]) -> Tuple[Dict[str, list], int, bool]:
+    """
+    Pad columns with None, the way pd.DataFrame() pads Series.
+
+    Return (columns, n_rows, should_warn); should_warn is True when the
+    columns had different lengths.
+    """
+    lengths = [len(column) for column in values.values()]
+    n_rows = max(lengths)
+    return (
+        {
+            name: column
+            if len(column) == n_rows
+            else column + [None] * (n_rows - len(column))
+            for name, column in values.items()
+        },
+        n_rows,
+        min(lengths) < n_rows,
+    )
+
+
 def extract_dataframe_by_zip(
     html: str, columns_to_parse: Dict[str, etree.XPath]
 ) -> Tuple[pd.DataFrame, bool]:
@@ -149,40 +555,798 @@ def extract_dataframe_by_zip(
     different lengths.
     """
     tree = parse_document(html, True)  # is_html=true
+    columns, _, should_warn = _zip_pad(select_columns(tree, columns_to_parse))
+    return pd.DataFrame(columns, dtype=object), should_warn
 
-    # data: {name: Series of text values per selector}, in order.
-    # The series may be of different length.
-    data = {}
-    for name, selector in columns_to_parse.items():
+
+# Element index: most selectors users write are simple -- `//h1`,
+# `//*[@id='price']`, `//div[@class='card']//a/@href`. libxml2 answers `//h1`
+# quickly, but it evaluates attribute predicates and `//a//b` steps slowly
+# (several ms each on an 80kb page). When a document has selectors like that,
+# we walk its tree once to index elements by tag, id and class, and answer
+# every simple selector from the index.
+#
+# html5lib moves elements around as it parses (adoption agency, foster
+# parenting), so we build the index from the finished tree, not during parse.
+_SIMPLE_STEP = re.compile(
+    r"""//(?P<tag>[A-Za-z_][-\w.]*|\*)
+    (?:\[\s*@(?P<attribute>id|class)\s*=\s*(?:'(?P<value1>[^']*)'|"(?P<value2>[^"]*)")\s*\])?
+    """,
+    re.VERBOSE,
+)
+_SIMPLE_ATTRIBUTE = re.compile(r"/@(?P<name>[A-Za-z_][-\w.]*)$")
+
+
+class SimpleSelector:
+    """
+    A selector ElementIndex can answer: `//STEP//STEP.../@attr`.
+
+    Each STEP is a tag name or `*`, optionally with an `[@id='x']` or
+    `[@class='x']` predicate. The trailing `/@attr` is optional.
+    """
+
+    __slots__ = ("steps", "attribute")
+
+    def __init__(
+        self, steps: List[Tuple[str, Optional[str], Optional[str]]], attribute
+    ):
+        self.steps = steps  # [(tag or "*", "id"/"class"/None, value or None)]
+        self.attribute = attribute  # str, or None to select elements
+
+    @property
+    def is_slow_in_xpath(self) -> bool:
+        """
+        True if libxml2 would take much longer than an ElementIndex lookup.
+        """
+        if len(self.steps) > 1:
+            return True  # `//a//b`
+        tag, attribute, _ = self.steps[0]
+        return tag == "*" or attribute is not None  # not just `//h1`
+
+    @classmethod
+    def parse(cls, s: str) -> Optional["SimpleSelector"]:
+        """
+        Return a SimpleSelector for XPath `s`, or None if `s` isn't simple.
+        """
+        steps = []
+        pos = 0
+        while True:
+            match = _SIMPLE_STEP.match(s, pos)
+            if match is None:
+                return None
+            value = match.group("value1")
+            if value is None:
+                value = match.group("value2")
+            steps.append((match.group("tag"), match.group("attribute"), value))
+            pos = match.end()
+            if pos == len(s):
+                return cls(steps, None)
+            match = _SIMPLE_ATTRIBUTE.match(s, pos)
+            if match is not None:
+                return cls(steps, match.group("name"))
+
+
+class ElementIndex:
+    """
+    The elements of a document, by tag and by id and class attribute.
+
+    Every list is in document order.
+    """
+
+    __slots__ = ("elements", "by_tag", "by_attribute")
+
+    def __init__(self, tree: etree._Element):
+        # Index the whole document: from any element, `//` means the root
+        self.elements = []
+        self.by_tag = {}
+        self.by_attribute = {}  # {("id", value): [element], ("class", value): ...}
+        for element in tree.getroottree().getroot().iter(etree.Element):
+            self.elements.append(element)
+            self.by_tag.setdefault(element.tag, []).append(element)
+            # One items() call is much faster than two get() calls
+            for name, value in element.items():
+                if name == "id" or name == "class":
+                    self.by_attribute.setdefault((name, value), []).append(element)
+
+    def _step(self, tag, attribute, value) -> list:
+        if attribute is not None:
+            elements = self.by_attribute.get((attribute, value), [])
+            if tag == "*":
+                return elements
+            return [element for element in elements if element.tag == tag]
+        elif tag == "*":
+            return self.elements
+        else:
+            return self.by_tag.get(tag, [])
+
+    @staticmethod
+    def _descendant_step(ancestors, tag, attribute, value) -> list:
+        # Concatenating each ancestor's descendants gives document order: an
+        # ancestor is either inside an earlier one (so its descendants were
+        # seen already) or after that earlier one's entire subtree.
+        seen = set()
+        result = []
+        for ancestor in ancestors:
+            for element in ancestor.iter(etree.Element if tag == "*" else tag):
+                if element in seen or element is ancestor:
+                    continue
+                seen.add(element)
+                if attribute is None or element.get(attribute) == value:
+                    result.append(element)
+        return result
+
+    def select(self, selector: SimpleSelector) -> list:
+        """
+        Return what `selector` would: elements, or attribute-value strings.
+        """
+        elements = self._step(*selector.steps[0])
+        for step in selector.steps[1:]:
+            if not elements:
+                break
+            elements = self._descendant_step(elements, *step)
+        if selector.attribute is None:
+            return elements
+        values = (element.get(selector.attribute) for element in elements)
+        return [value for value in values if value is not None]
+
+
+# XSLT engine: select() evaluates each selector from Python, then walks each
+# selected element from Python to build its string. ColumnStylesheet compiles
+# every selector into one XSLT stylesheet instead: libxslt evaluates them all
+# and writes every value -- whitespace rules included -- in C, in one pass.
+# Python only splits the output into columns.
+#
+# Output, per column: the number of values, then each value, each followed by
+# _XSLT_SEPARATOR. Each value starts with "e" (an element: Python strips it)
+# or "s" (a string: attribute or text, kept as-is).
+_XSLT_SEPARATOR = "\ufdd0"  # a noncharacter: valid in XML, absent from pages
+_XSLT_WHITESPACE = " &#9;&#10;&#13;"  # what normalize-space() collapses
+# XSLT adds these functions to XPath. select() raises "Unregistered function"
+# for them, so the stylesheet mustn't evaluate them.
+_XSLT_ONLY_FUNCTIONS = {
+    "current",
+    "document",
+    "element-available",
+    "format-number",
+    "function-available",
+    "generate-id",
+    "key",
+    "system-property",
+    "unparsed-entity-uri",
+}
+
+_COLUMN_STYLESHEET = """<xsl:stylesheet version="1.0"
+  xmlns:xsl="http://www.w3.org/1999/XSL/Transform"{namespaces}>
+<xsl:output method="text" encoding="UTF-8"/>
+<!-- the element select() would be called with -->
+<xsl:param name="context" select="/.."/>
+
+<xsl:template match="/">
+  <xsl:for-each select="$context">{columns}</xsl:for-each>
+</xsl:template>
+
+<xsl:template match="*" mode="item">
+  <xsl:text>e</xsl:text>
+  <xsl:apply-templates mode="text">
+    <xsl:with-param name="preserve" select="{preserve}"/>
+  </xsl:apply-templates>
+</xsl:template>
+<xsl:template match="comment()|processing-instruction()" mode="item">
+  <xsl:text>e</xsl:text>
+</xsl:template>
+<xsl:template match="@*|text()" mode="item">
+  <xsl:text>s</xsl:text><xsl:value-of select="."/>
+</xsl:template>
+
+<!-- _item_to_string(): html5lib's WhitespaceFilter collapses each run of
+  whitespace in each text node to one space, except within
+  spacePreserveElements -->
+<xsl:template match="*" mode="text">
+  <xsl:param name="preserve"/>
+  <xsl:apply-templates mode="text">
+    <xsl:with-param name="preserve" select="$preserve or {preserve}"/>
+  </xsl:apply-templates>
+</xsl:template>
+<xsl:template match="comment()|processing-instruction()" mode="text"/>
+<xsl:template match="text()" mode="text">
+  <xsl:param name="preserve"/>
+  <xsl:variable name="normalized" select="normalize-space(.)"/>
+  <xsl:choose>
+    <xsl:when test="$preserve"><xsl:value-of select="."/></xsl:when>
+    <xsl:when test="$normalized = ''"><xsl:text> </xsl:text></xsl:when>
+    <xsl:otherwise>
+      <xsl:if test="translate(substring(., 1, 1), '{whitespace}', '') = ''">
+        <xsl:text> </xsl:text>
+      </xsl:if>
+      <xsl:value-of select="$normalized"/>
+      <xsl:if test="translate(substring(., string-length(.)), '{whitespace}', '') = ''">
+        <xsl:text> </xsl:text>
+      </xsl:if>
+    </xsl:otherwise>
+  </xsl:choose>
+</xsl:template>
+</xsl:stylesheet>"""
+
+# lxml's XPath leaves the root node (e.g., of `/`) out of results: so do we.
+_COLUMN_TEMPLATE = """
+<xsl:variable name="column{i}" select="({path})[count(. | /) != 1]"/>
+<xsl:value-of select="count($column{i})"/><xsl:text>{separator}</xsl:text>
+<xsl:for-each select="$column{i}">
+  <xsl:apply-templates select="." mode="item"/><xsl:text>{separator}</xsl:text>
+</xsl:for-each>"""
+
+
+def _xml_attribute(s: str) -> str:
+    return (
+        s.replace("&", "&amp;")
+        .replace('"', "&quot;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+    )
+
+
+def _returns_node_set(selector: etree.XPath) -> bool:
+    """
+    True if `selector` returns a node-set (which XSLT can iterate).
+
+    XPath 1.0 result types are static, so a tiny document tells us.
+    """
+    try:
+        return isinstance(selector(etree.fromstring("<html/>")), list)
+    except etree.XPathError:
+        return False
+
+
+def _calls_xslt_only_function(path: str) -> bool:
+    """
+    True if XPath `path` may call a function that only XSLT defines.
+
+    We can't tell by evaluating `path`: a predicate's function calls only run
+    if the predicate has nodes to test.
+    """
+    tokens = _tokenize_xpath(path)
+    if tokens is None:
+        return True  # we can't tell
+    return any(
+        kind == "name"
+        and value in _XSLT_ONLY_FUNCTIONS
+        and next_token == ("punct", "(")
+        for (kind, value), next_token in zip(tokens, tokens[1:])
+    )
+
+
+def _context_path(element: etree._Element) -> str:
+    """
+    Return an XPath expression that selects `element` in its document.
+
+    ElementTree.getpath() would write namespace prefixes the stylesheet
+    doesn't declare; `*[n]` steps need none.
+    """
+    steps = []
+    while element is not None:
+        position = 1
+        for sibling in element.itersiblings(preceding=True):
+            if isinstance(sibling.tag, str):
+                position += 1
+        steps.append("*[%d]" % position)
+        element = element.getparent()
+    return "/" + "/".join(reversed(steps))
+
+
+class ColumnStylesheet:
+    """
+    One XSLT stylesheet that computes several columns' select() results.
+    """
+
+    __slots__ = ("names", "source", "transform")
+
+    def __init__(self, names: List[str], source: bytes):
+        self.names = names  # columns this computes, in output order
+        self.source = source
+        self.transform = etree.XSLT(
+            etree.fromstring(source),
+            # document() and friends would let a selector read files
+            access_control=etree.XSLTAccessControl.DENY_ALL,
+        )
+
+    @classmethod
+    def for_selectors(
+        cls, columns_to_parse: Dict[str, etree.XPath]
+    ) -> Optional["ColumnStylesheet"]:
+        """
+        Compile the node-set selectors of `columns_to_parse`, or return None.
+
+        Other selectors (e.g., `count(//a)`), and any libxslt can't compile,
+        are for the caller to evaluate with select().
+        """
+        _, WhitespaceFilter = _html5lib_tree_walker()
+        preserve = "contains('|%s|', concat('|', local-name(), '|'))" % "|".join(
+            sorted(WhitespaceFilter.spacePreserveElements)
+        )
+        names = []
+        columns = []
+        for name, selector in columns_to_parse.items():
+            if (
+                "namespace::" in selector.path  # str() isn't its string-value
+                or _calls_xslt_only_function(selector.path)
+                or not _returns_node_set(selector)
+            ):
+                continue
+            column = _COLUMN_TEMPLATE.format(
+                i=len(columns),
+                path=_xml_attribute(selector.path),
+                separator=_XSLT_SEPARATOR,
+            )
+            try:
+                # Compile each column alone, so one bad column can't spoil
+                # the rest
+                etree.XSLT(etree.fromstring(cls._source([column], preserve)))
+            except etree.XSLTParseError:
+                continue
+            names.append(name)
+            columns.append(column)
+        if not names:
+            return None
+        return cls(names, cls._source(columns, preserve))
+
+    @staticmethod
+    def _source(columns: List[str], preserve: str) -> bytes:
+        return _COLUMN_STYLESHEET.format(
+            namespaces="".join(
+                '\n  xmlns:%s="%s"' % item for item in _NAMESPACES.items()
+            ),
+            columns="".join(columns),
+            preserve=preserve,
+            whitespace=_XSLT_WHITESPACE,
+        ).encode("utf-8")
+
+    def copy(self) -> "ColumnStylesheet":
+        """
+        Return a copy for another thread. (lxml XSLT objects aren't shared.)
+        """
+        return ColumnStylesheet(self.names, self.source)
+
+    def select(self, tree: etree._Element) -> Optional[Dict[str, List[str]]]:
+        """
+        Return {name: list of str}, as select() would for each column.
+
+        Return None if we can't tell the values apart (because the document
+        contains _XSLT_SEPARATOR) or libxslt fails: the caller should call
+        select() instead, which will raise the proper error, if any.
+        """
+        try:
+            output = str(
+                self.transform(tree.getroottree(), context=_context_path(tree))
+            )
+        except etree.XSLTApplyError:
+            return None
+        pieces = output.split(_XSLT_SEPARATOR)
+        values = {}
+        position = 0
+        try:
+            for name in self.names:
+                count = int(pieces[position])
+                items = pieces[position + 1 : position + 1 + count]
+                if len(items) != count:
+                    return None
+                values[name] = [
+                    item[1:].strip() if item[:1] == "e" else item[1:] for item in items
+                ]
+                position += 1 + count
+        except ValueError:
+            return None
+        if position != len(pieces) - 1:  # split() leaves a trailing ""
+            return None
+        return values
+
+
+# Fragment batching: when inputs are many tiny HTML fragments (e.g., one
+# product card per row), per-row overhead dominates: one XPath invocation per
+# selector per row, plus one DataFrame per row. We graft many parsed fragments
+# under one synthetic root, evaluate each selector once per batch and split
+# the results back into rows.
+BATCH_MAX_DOCUMENT_LENGTH = 4096  # chars; larger documents are parsed alone
+BATCH_SIZE = 500  # documents per batch
+
+# The synthetic root is in a namespace no selector can name, so no batchable
+# selector can match it.
+_BATCH_ROOT_TAG = "{urn:x-xpathextractor:batch}batch"
+
+# A batchable selector gives the same results on a batch as on each of its
+# documents, in the same order. We only allow a conservative subset of XPath:
+# absolute `//` name steps with simple attribute predicates, optionally ending
+# in an attribute or text(). That rules out:
+#
+# * `*` and `node()`, which could match the synthetic root;
+# * positional predicates, which count siblings (and documents' roots are
+#   siblings in a batch);
+# * axes and `..`, which could cross from one document into another;
+# * functions that return numbers, strings or booleans.
+_BATCHABLE_NAME = r"(?:[A-Za-z_][-\w.]*:)?[A-Za-z_][-\w.]*"
+_BATCHABLE_LITERAL = r"""(?:'[^']*'|"[^"]*")"""
+_BATCHABLE_PREDICATE = (
+    r"\[\s*(?:"
+    rf"@{_BATCHABLE_NAME}(?:\s*!?=\s*{_BATCHABLE_LITERAL})?"
+    rf"|(?:contains|starts-with)\(\s*@{_BATCHABLE_NAME}\s*,\s*{_BATCHABLE_LITERAL}\s*\)"
+    r")\s*\]"
+)
+_BATCHABLE_XPATH = re.compile(
+    rf"//{_BATCHABLE_NAME}(?:{_BATCHABLE_PREDICATE})*"
+    rf"(?:/{{1,2}}{_BATCHABLE_NAME}(?:{_BATCHABLE_PREDICATE})*)*"
+    rf"(?:/@{_BATCHABLE_NAME}|/{{1,2}}text\(\))?"
+)
+
+
+def is_batchable_xpath(s: str) -> bool:
+    """
+    Return True if `s` gives the same results on a batch of documents.
+
+    See `extract_dataframe_by_zip_batch()`.
+    """
+    return _BATCHABLE_XPATH.fullmatch(s.strip()) is not None
+
+
+def _batch_xpath(selector: etree.XPath) -> etree.XPath:
+    """
+    Recompile `selector` to return "smart strings", for _batch_row_root().
+
+    Smart strings reference their document, so don't let them escape
+    select_batch(): _item_to_string() copies them to plain str.
+    """
+    return etree.XPath(
+        selector.path,
+        smart_strings=True,
+        namespaces=_NAMESPACES,
+    )
+
+
+def _batch_row_root(node, batch_root):
+    """
+    Find the document (child of `batch_root`) that contains `node`.
+    """
+    if not isinstance(node, etree._Element):
+        # Attribute or text "smart string": find its element
+        node = node.getparent()
+    for ancestor in node.iterancestors():
+        if ancestor is batch_root:
+            return node
+        node = ancestor
+    raise RuntimeError("node is not in batch")  # impossible
+
+
+def select_batch(
+    htmls: List[Union[str, bytes, memoryview]],
+    columns_to_parse: Dict[str, etree.XPath],
+    encoding: Optional[str] = None,
+    *,
+    batch_selectors: Optional[Dict[str, etree.XPath]] = None,
+    max_nodes: Optional[int] = None,
+) -> List[Optional[Dict[str, List[str]]]]:
+    """
+    Call select() with each selector on each document in `htmls`, efficiently.
+
+    All selectors must pass is_batchable_xpath(). We parse each document on
+    its own (so no document's markup can affect another's), graft the parsed
+    trees under one synthetic root and evaluate each selector once.
+
+    Return one {name: list of str} per document. `encoding` and `max_nodes`
+    are as in parse_document(), except a document with more than `max_nodes`
+    nodes gets None: the caller should extract it on its own. (A short
+    document can still have many nodes: html5lib clones formatting elements.)
+    `batch_selectors`, if set, is {name: _batch_xpath()} of
+    `columns_to_parse`, compiled ahead of time by a caller with many batches.
+
+    Raise ColumnExtractionError on error.
+    """
+    batch_root = etree.Element(_BATCH_ROOT_TAG)
+    row_roots = {}  # root element => position in htmls
+    for position, html in enumerate(htmls):
+        try:
+            tree = parse_document(html, True, encoding, max_nodes=max_nodes)
+        except DocumentTooLargeError:
+            continue
+        root = tree.getroottree().getroot()
+        batch_root.append(root)
+        row_roots[root] = position
+
+    if batch_selectors is None:
+        batch_selectors = {
+            name: _batch_xpath(selector) for name, selector in columns_to_parse.items()
+        }
+
+    results = [{name: [] for name in columns_to_parse.keys()} for _ in htmls]
+    for name in columns_to_parse.keys():
         try:
-            data[name] = pd.Series(select(tree, selector), dtype=str)
+            selected = batch_selectors[name](batch_root)
         except etree.XPathEvalError as err:
             raise ColumnExtractionError(name, str(err))
+        for item in selected:
+            position = row_roots[_batch_row_root(item, batch_root)]
+            results[position][name].append(_item_to_string(item))
+    if len(row_roots) < len(htmls):
+        parsed = set(row_roots.values())
+        results = [
+            values if position in parsed else None
+            for position, values in enumerate(results)
+        ]
+    return results
 
-    # Pad all column lists to the same length
-    # DataFrame constructor will automatically do this if given Series
-    table = pd.DataFrame(data)
 
-    # If they're not all the same length, this may mean extraction failed.
-    # Let the user see the data, and give them a warning
-    #
-    # We detect by checking if any value in the last row is null.
-    should_warn = len(table) and table.iloc[-1].isnull().any()
+def extract_dataframe_by_zip_batch(
+    htmls: List[str], columns_to_parse: Dict[str, etree.XPath]
+) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    Call extract_dataframe_by_zip() on each document in `htmls`, efficiently.
+
+    See select_batch().
+
+    Return (dataframe, warn_position): dataframe is all documents' tables
+    concatenated; warn_position is the position in `htmls` of the first
+    document whose columns have different lengths, or None.
+    """
+    accumulator = ColumnUnionAccumulator(list(columns_to_parse.keys()))
+    warn_position = None
+    for position, values in enumerate(select_batch(htmls, columns_to_parse)):
+        columns, n_rows, should_warn = _zip_pad(values)
+        accumulator.append_columns(columns, n_rows)
+        if should_warn and warn_position is None:
+            warn_position = position
+    return accumulator.to_frame(), warn_position
+
+
+# Tokens of an XPath 1.0 expression, for required_tag_names()
+_XPATH_TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<literal>'[^']*'|"[^"]*")
+    |(?P<number>\d+(?:\.\d*)?|\.\d+)
+    |(?P<punct>//|/|::|\.\.|\.|\[|\]|\(|\)|@|,|\|)
+    |(?P<name>(?:[^\W\d][\w.-]*:)?(?:[^\W\d][\w.-]*|\*)|\*)
+    |(?P<other>!=|<=|>=|[=<>+\-$])
+    )""",
+    re.VERBOSE,
+)
+_XPATH_NODE_TYPES = {"node", "text", "comment", "processing-instruction"}
+_XPATH_NON_ELEMENT_AXES = {"attribute", "namespace"}
+# html5lib creates these elements when they aren't in the source. (And
+# _html_fromstring() returns a fragment's elements wrapped in a `<div>`, or in a
+# `<span>` if it has text outside of elements.)
+_ALWAYS_PRESENT_TAGS = {"html", "head", "body", "div", "span"}
+# ... and creates these when it sees other tags. (`</p>` and `</br>` create
+# `<p>` and `<br>`: we look for end tags, too.)
+_IMPLIED_BY_TAGS = {
+    "tbody": {"tr", "td", "th"},
+    "tr": {"td", "th"},
+    "colgroup": {"col"},
+    "img": {"image"},
+    "form": {"isindex"},
+    "hr": {"isindex"},
+    "label": {"isindex"},
+    "input": {"isindex"},
+}
+
+
+def _tokenize_xpath(s: str) -> Optional[List[Tuple[str, str]]]:
+    tokens = []
+    pos = 0
+    s = s.rstrip()
+    while pos < len(s):
+        match = _XPATH_TOKEN.match(s, pos)
+        if match is None:
+            return None
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+# Names that are operators, unless they're name tests (see _is_operator())
+_XPATH_OPERATOR_NAMES = {"and", "or", "div", "mod", "*"}
+# Tokens after which an operand starts
+_XPATH_OPERAND_STARTS = {("punct", p) for p in ("@", "::", "(", "[", ",")}
+
+
+def _is_operator(tokens: List[Tuple[str, str]], i: int) -> bool:
+    kind, value = tokens[i]
+    if kind == "other":
+        return value != "$"  # `$` starts a variable reference
+    if kind == "punct":
+        return value in ("/", "//", "|")
+    if kind == "name" and value in _XPATH_OPERATOR_NAMES:
+        # XPath 1.0, section 3.7: it's an operator if a token precedes it,
+        # and that token isn't `@`, `::`, `(`, `[`, `,` or an operator
+        return (
+            i > 0
+            and tokens[i - 1] not in _XPATH_OPERAND_STARTS
+            and not _is_operator(tokens, i - 1)
+        )
+    return False
 
-    return (table, should_warn)
 
+def searches_whole_page(s: str) -> bool:
+    """
+    Return True if XPath `s` has an absolute location path outside predicates.
 
-# Extract with one xpath selector per column
-def extract_xpath(table, params):
-    # load params
-    # dict of { name: str -> etree.XPath } -- ordered as the input is ordered.
-    columns_to_parse = {}
-    for c in params["colselectors"]:
+    Such a path (e.g., `//h1` in `string(//h1)` or in `.//a | //h1`) gives
+    the same result for every context node. Absolute paths in predicates
+    (`a[count(//li) > 1]`) only filter what a relative path selects.
+
+    If we can't tokenize `s`, we only check whether it starts with "/".
+    """
+    tokens = _tokenize_xpath(s)
+    if tokens is None:
+        return s.lstrip("( \t\r\n").startswith("/")
+    depth = 0  # of [predicates]
+    for i, (kind, value) in enumerate(tokens):
+        if kind != "punct":
+            continue
+        if value == "[":
+            depth += 1
+        elif value == "]":
+            depth -= 1
+        elif (
+            value in ("/", "//")
+            and depth == 0
+            # At the start of an operand, "/" starts an absolute path.
+            # Elsewhere (after a step, `)` or `]`), it separates steps.
+            and (
+                i == 0
+                or tokens[i - 1] in _XPATH_OPERAND_STARTS
+                or _is_operator(tokens, i - 1)
+            )
+        ):
+            return True
+    return False
+
+
+def required_tag_names(s: str) -> FrozenSet[str]:
+    """
+    Find tag names a document must contain for XPath `s` to select anything.
+
+    This is conservative. We only understand plain location paths such as
+    `//table//td` or `//div[@class="x"]/a/@href` (ignoring what's inside
+    predicates). For anything else -- function calls, unions, `//*` -- we
+    return an empty set: any document might match.
+    """
+    tokens = _tokenize_xpath(s)
+    if not tokens:
+        return frozenset()
+
+    names = set()
+    pos = 0
+    expect_step = True  # False after a step, when only `/`, `//`, `[` may come
+    if tokens[0] == ("punct", "/") and len(tokens) == 1:
+        return frozenset()  # the root node
+    if tokens[0] in (("punct", "/"), ("punct", "//")):
+        pos = 1
+
+    while pos < len(tokens):
+        kind, value = tokens[pos]
+        if expect_step:
+            axis = "child"
+            if (kind, value) == ("punct", "@"):
+                axis = "attribute"
+                pos += 1
+            elif (
+                kind == "name"
+                and pos + 1 < len(tokens)
+                and tokens[pos + 1] == ("punct", "::")
+            ):
+                axis = value
+                pos += 2
+            elif kind == "punct" and value in (".", ".."):
+                pos += 1
+                expect_step = False
+                continue
+            if pos >= len(tokens) or tokens[pos][0] != "name":
+                return frozenset()
+            value = tokens[pos][1]
+            if pos + 1 < len(tokens) and tokens[pos + 1] == ("punct", "("):
+                if value not in _XPATH_NODE_TYPES:
+                    return frozenset()  # a function call
+                # Skip node type test, e.g., `text()`
+                while pos < len(tokens) and tokens[pos] != ("punct", ")"):
+                    pos += 1
+            elif axis not in _XPATH_NON_ELEMENT_AXES and not value.endswith("*"):
+                prefix, _, local_name = value.rpartition(":")
+                if prefix in ("", "svg"):
+                    names.add(local_name.lower())
+            pos += 1
+            expect_step = False
+        elif (kind, value) in (("punct", "/"), ("punct", "//")):
+            pos += 1
+            expect_step = True
+        elif (kind, value) == ("punct", "["):
+            # Skip predicate: it can only filter the step further
+            depth = 0
+            while pos < len(tokens):
+                if tokens[pos] in (("punct", "["), ("punct", "(")):
+                    depth += 1
+                elif tokens[pos] in (("punct", "]"), ("punct", ")")):
+                    depth -= 1
+                    if depth == 0:
+                        break
+                pos += 1
+            pos += 1
+        else:
+            return frozenset()  # an operator: not a plain location path
+    if expect_step:
+        return frozenset()  # path ends in `/`: invalid
+    return frozenset(names - _ALWAYS_PRESENT_TAGS)
+
+
+class TagPrefilter:
+    """
+    Skip documents that can't match, without parsing them.
+
+    `requirements` is a list of tag-name sets: one per selector. A document
+    may match if, for any selector, it contains all that selector's tags.
+    We look for start and end tags in the raw text, so comments and scripts
+    can only make us parse documents we might have skipped -- never the
+    reverse.
+    """
+
+    def __init__(self, requirements: List[FrozenSet[str]]):
+        self.requirements = requirements
+        alternatives = {
+            name: {name} | _IMPLIED_BY_TAGS.get(name, set())
+            for requirement in requirements
+            for name in requirement
+        }
+        self.alternatives = alternatives
+        pattern = r"</?(%s)(?=[\s/>]|$)" % "|".join(
+            sorted(
+                set(re.escape(tag) for tags in alternatives.values() for tag in tags)
+            )
+        )
+        self._str_regex = re.compile(pattern, re.IGNORECASE)
+        self._bytes_regex = re.compile(pattern.encode("utf-8"), re.IGNORECASE)
+
+    @classmethod
+    def for_selectors(cls, paths: List[str]) -> Optional["TagPrefilter"]:
+        """
+        Build a TagPrefilter for XPath `paths`, or None if it'd never skip.
+        """
+        requirements = [required_tag_names(path) for path in paths]
+        if not requirements or not all(requirements):
+            return None
+        return cls(requirements)
+
+    def may_match(self, html: Union[str, bytes, memoryview]) -> bool:
+        if isinstance(html, str):
+            regex = self._str_regex
+        elif re.search(b"\x00", html):
+            # UTF-16, probably: "<td" isn't ASCII
+            return True
+        else:
+            regex = self._bytes_regex
+
+        found = set()
+        for match in regex.finditer(html):
+            tag = match.group(1)
+            if not isinstance(tag, str):
+                tag = tag.decode("utf-8")
+            found.add(tag.lower())
+        return any(
+            all(found & self.alternatives[name] for name in requirement)
+            for requirement in self.requirements
+        )
+
+
+def parse_colselectors(colselectors, compile_selector=xpath) -> Tuple[Dict, list]:
+    """
+    Compile user-supplied selectors, or return errors.
+
+    Return (columns, errors). `columns` is an ordered dict of
+    { colname: str -> compiled selector }; it is None if there are errors.
+
+    `compile_selector` must raise etree.XPathSyntaxError on invalid input.
+    """
+    columns = {}
+    for c in colselectors:
         colname = c["colname"]
         colxpath = c["colxpath"]
         if not colname:
             return None, [i18n.trans("badParam.colname.missing", "Missing column name")]
-        if colname in columns_to_parse:
+        if colname in columns:
             return None, [
                 i18n.trans(
                     "badParam.colname.duplicate",
@@ -195,7 +1359,7 @@ def extract_xpath(table, params):
                 i18n.trans("badParam.colxpath.missing", "Missing column selector")
             ]
         try:
-            selector = xpath(c["colxpath"])
+            selector = compile_selector(colxpath)
         except etree.XPathSyntaxError as err:
             return None, [
                 i18n.trans(
@@ -204,48 +1368,768 @@ def extract_xpath(table, params):
                     {"column_name": colname, "error": str(err)},
                 )
             ]
-        columns_to_parse[colname] = selector
+        columns[colname] = selector
+    return columns, []
 
-    if not columns_to_parse:
-        # User hasn't input anything. Return input, as is our convention.
-        return table, []
 
-    # Loop over rows of input html column, each of which is a complete html document
-    # Concatenate rows extracted from each document.
-    result_tables = []
-    input_row_with_warning = None
-    for index, html in table["html"].iteritems():
-        if html is None:
-            continue
-        try:
-            one_result, warn = extract_dataframe_by_zip(html, columns_to_parse)
-        except ColumnExtractionError as err:
-            return None, [err.i18n_message]
-        result_tables.append(one_result)
-        # track the first row where the extracted columns are not all the same
-        # length
-        if warn and input_row_with_warning is None:
-            input_row_with_warning = index
-
-    if result_tables:
-        outtable = pd.concat(result_tables, ignore_index=True)
-    else:
-        # Empty table
-        outtable = pd.DataFrame(
-            {colname: [] for colname in columns_to_parse.keys()}, dtype=str
-        )
+class ExtractedRows:
+    """
+    Output rows extracted from one input document.
 
-    warnings = []
-    if input_row_with_warning is not None:
-        warnings.append(
-            i18n.trans(
-                "warning.extractedDifferentLengths",
-                "Extracted columns of differing lengths from HTML on row {row}",
-                {"row": input_row_with_warning + 1},
-            )
-        )
+    `columns` is {name: list of `n_rows` values}. `warnings` are i18n
+    messages.
 
-    return outtable, warnings
+    An extractor's ExtractedRows don't depend on where the document is in
+    the input: in `warnings`, arguments that name the document's row are
+    _DOCUMENT. Extractor.bind() fills them in. That lets us cache results by
+    document content.
+    """
+
+    __slots__ = ("columns", "n_rows", "warnings")
+
+    def __init__(self, columns: Dict[str, list], n_rows: int, warnings: list = None):
+        self.columns = columns
+        self.n_rows = n_rows
+        self.warnings = warnings or []
+
+
+# Placeholder i18n argument for an input row, until Extractor.bind() sets it
+_DOCUMENT = "\x00document\x00"
+
+
+DEFAULT_MAX_BYTES_PER_DOCUMENT = 20 * 1024 * 1024
+DEFAULT_MAX_NODES_PER_DOCUMENT = 1000000
+
+
+# With an executor, chunks queued or running at once
+MAX_PENDING_CHUNKS = 2 * (os.cpu_count() or 1)
+
+
+class ExtractionStats:
+    """
+    Counts of non-null documents an extraction visited.
+
+    `n_skipped_documents` were not parsed, because TagPrefilter found they
+    can't match; `n_cached_documents` were not parsed, because they were in
+    the ResultCache.
+    """
+
+    __slots__ = ("n_documents", "n_skipped_documents", "n_cached_documents")
+
+    def __init__(self):
+        self.n_documents = 0
+        self.n_skipped_documents = 0
+        self.n_cached_documents = 0
+
+
+def _is_larger_than(html: Union[str, bytes, memoryview], max_bytes: int) -> bool:
+    """
+    Return True if `html` is more than `max_bytes` bytes (UTF-8, for str).
+
+    Most str documents are far from the limit: we only encode the rest.
+    """
+    if isinstance(html, str):
+        if len(html) > max_bytes:
+            return True  # every character is at least one byte
+        if len(html) * 4 <= max_bytes:
+            return False  # ... and at most four
+        return len(html.encode("utf-8", "surrogatepass")) > max_bytes
+    return memoryview(html).nbytes > max_bytes
+
+
+class Extractor(abc.ABC):
+    """
+    Turns HTML documents into ExtractedRows, and ExtractedRows into a table.
+
+    Subclasses implement cache_fingerprint and extract_document() (and may
+    override extract_documents(), to process several documents at once) and
+    set `output_columns`: the columns every output has, even with no input.
+    Subclasses with `keeps_null_documents` implement null_document().
+    """
+
+    output_columns = []
+
+    # If True, a null document still produces null_document()'s rows
+    keeps_null_documents = False
+
+    # TagPrefilter, or None to extract every document
+    prefilter = None
+
+    # Skip documents larger than this (in bytes: UTF-8 bytes, for str)
+    max_bytes = DEFAULT_MAX_BYTES_PER_DOCUMENT
+
+    # Stop parsing documents after building this many nodes
+    max_nodes = DEFAULT_MAX_NODES_PER_DOCUMENT
+
+    # Charset of bytes (and memoryview) documents, or None to detect it
+    encoding = None
+
+    def __init__(self, has_url):
+        if (
+            self.keeps_null_documents
+            and type(self).null_document is Extractor.null_document
+        ):
+            raise TypeError(
+                "%s keeps null documents but does not implement null_document()"
+                % type(self).__name__
+            )
+        self.has_url = has_url  # True if input has a "url" column
+        self._threads = threading.local()  # for _for_this_thread()
+
+    @property
+    @abc.abstractmethod
+    def cache_fingerprint(self) -> str:
+        """
+        A str that identifies what this extractor outputs for a document.
+
+        Two extractors with the same fingerprint produce the same
+        ExtractedRows for the same HTML.
+        """
+
+    @abc.abstractmethod
+    def extract_document(self, html) -> ExtractedRows:
+        """
+        Extract rows from one non-null document.
+
+        Raise ExtractionError on error.
+        """
+
+    def extract_documents(self, htmls) -> List[ExtractedRows]:
+        """
+        Extract rows from several consecutive non-null documents.
+        """
+        return [self.extract_document(html) for html in htmls]
+
+    def null_document(self) -> ExtractedRows:
+        """
+        Rows for a null document, if `keeps_null_documents`.
+        """
+        raise NotImplementedError  # __init__() checks subclasses override it
+
+    def skipped_document(self) -> ExtractedRows:
+        """
+        Rows for a document that `prefilter` says can't match.
+        """
+        return ExtractedRows({}, 0)
+
+    def too_large_document(self, html) -> ExtractedRows:
+        """
+        Rows for a document larger than `max_bytes`: none, and a warning.
+        """
+        rows = self.skipped_document()
+        return ExtractedRows(
+            rows.columns,
+            rows.n_rows,
+            [
+                i18n.trans(
+                    "warning.documentTooLarge",
+                    "Skipped {rowname}: its HTML is larger than the limit of "
+                    "{max_bytes} bytes",
+                    {"rowname": _DOCUMENT, "max_bytes": self.max_bytes},
+                )
+            ],
+        )
+
+    def parse(self, html) -> Tuple[etree._Element, list]:
+        """
+        Parse `html`; return (tree, warnings).
+
+        If the document has more than `max_nodes` nodes, stop parsing and
+        return the tree built so far, with a warning.
+        """
+        try:
+            return (
+                parse_document(html, True, self.encoding, max_nodes=self.max_nodes),
+                [],
+            )
+        except DocumentTooLargeError as err:
+            return err.tree, [
+                i18n.trans(
+                    "warning.documentTruncated",
+                    "Stopped parsing {rowname} after {max_nodes} HTML elements. "
+                    "Results from it may be incomplete.",
+                    {"rowname": _DOCUMENT, "max_nodes": self.max_nodes},
+                )
+            ]
+
+    def copy_for_thread(self) -> "Extractor":
+        """
+        Return a copy of this extractor, with its own compiled selectors.
+
+        lxml lets only one thread at a time evaluate each compiled XPath, so
+        each thread of a thread pool needs its own.
+        """
+        return copy.copy(self)
+
+    def _for_this_thread(self) -> "Extractor":
+        try:
+            return self._threads.extractor
+        except AttributeError:
+            self._threads.extractor = self.copy_for_thread()
+            return self._threads.extractor
+
+    def extract(
+        self,
+        documents,
+        *,
+        cache=None,
+        stats=None,
+        executor=None,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Yield ExtractedRows for (index, html, url) `documents`, in order.
+
+        We hand extract_documents() up to `batch_size` (default BATCH_SIZE)
+        consecutive small documents at a time, and each large document on its own. (We read
+        a whole chunk from `documents` before extracting any of it: a caller
+        that must stop between documents passes `batch_size=1`.) We skip
+        documents `self.prefilter` rejects. If `cache` is a ResultCache, we
+        only extract documents it doesn't have yet. If `stats` is an
+        ExtractionStats, we count documents in it.
+
+        If `executor` is a concurrent.futures.Executor that runs threads, we
+        extract several chunks of documents at once on it. lxml releases the
+        GIL while it evaluates XPath, so threads can use several CPUs.
+
+        Raise ExtractionError on error.
+        """
+        if batch_size is None:
+            batch_size = BATCH_SIZE
+        if executor is None:
+            for chunk in self._chunks(documents, batch_size):
+                yield from self._bind_chunk(
+                    chunk, *self._extract_chunk(chunk, cache), stats
+                )
+            return
+
+        # Keep a few chunks in flight per thread; yield results in order
+        pending = collections.deque()  # [(chunk, future)]
+        try:
+            for chunk in self._chunks(documents, batch_size):
+                pending.append(
+                    (
+                        chunk,
+                        executor.submit(self._extract_chunk_in_thread, chunk, cache),
+                    )
+                )
+                if len(pending) > MAX_PENDING_CHUNKS:
+                    chunk, future = pending.popleft()
+                    yield from self._bind_chunk(chunk, *future.result(), stats)
+            while pending:
+                chunk, future = pending.popleft()
+                yield from self._bind_chunk(chunk, *future.result(), stats)
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def _chunks(self, documents, batch_size: int):
+        """
+        Yield lists of consecutive (index, html, url) `documents`.
+
+        A chunk holds at most `batch_size` small documents (and null ones), or
+        one large document.
+        """
+        chunk = []
+        for document in documents:
+            html = document[1]
+            if html is None:
+                if self.keeps_null_documents:
+                    chunk.append(document)
+            elif len(html) <= BATCH_MAX_DOCUMENT_LENGTH:
+                chunk.append(document)
+            else:
+                if chunk:
+                    yield chunk
+                    chunk = []
+                yield [document]
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _extract_chunk_in_thread(self, chunk, cache):
+        return self._for_this_thread()._extract_chunk(chunk, cache)
+
+    def _extract_chunk(self, chunk, cache) -> Tuple[List[ExtractedRows], tuple]:
+        """
+        Extract rows from each document in `chunk`.
+
+        Return (results, counts): counts is (n_documents, n_skipped_documents,
+        n_cached_documents), for ExtractionStats.
+        """
+        results = [None] * len(chunk)
+        n_null = 0
+        n_skipped = 0
+        for position, (_, html, _) in enumerate(chunk):
+            if html is None:
+                results[position] = self.null_document()
+                n_null += 1
+            elif self.max_bytes is not None and _is_larger_than(html, self.max_bytes):
+                results[position] = self.too_large_document(html)
+            elif self.prefilter is not None and not self.prefilter.may_match(html):
+                results[position] = self.skipped_document()
+                n_skipped += 1
+        n_not_extracted = len(chunk) - results.count(None)
+        if cache is not None:
+            # max_nodes can truncate trees, so it changes results too
+            fingerprint = json.dumps(
+                [self.cache_fingerprint, self.max_nodes, self.encoding]
+            )
+            keys = [
+                None if rows is not None else cache.key(fingerprint, html)
+                for (_, html, _), rows in zip(chunk, results)
+            ]
+            results = [
+                cache.get(key) if rows is None else rows
+                for key, rows in zip(keys, results)
+            ]
+        missing = [position for position, rows in enumerate(results) if rows is None]
+        if missing:
+            htmls = [chunk[position][1] for position in missing]
+            for position, rows in zip(missing, self.extract_documents(htmls)):
+                results[position] = rows
+                if cache is not None:
+                    cache.put(keys[position], rows)
+        n_documents = len(chunk) - n_null
+        n_cached = len(chunk) - n_not_extracted - len(missing)
+        return results, (n_documents, n_skipped, n_cached)
+
+    def _bind_chunk(self, chunk, results, counts, stats):
+        if stats is not None:
+            n_documents, n_skipped, n_cached = counts
+            stats.n_documents += n_documents
+            stats.n_skipped_documents += n_skipped
+            stats.n_cached_documents += n_cached
+        for (index, _, url), rows in zip(chunk, results):
+            yield self.bind(rows, index, url)
+
+    def bind(self, rows: ExtractedRows, index, url) -> ExtractedRows:
+        """
+        Fill in the parts of `rows` that depend on where the document is.
+        """
+        if not rows.warnings:
+            return rows
+
+        # Use url for "name" of row if available, for error messages
+        if self.has_url:
+            rowname = url
+        else:
+            rowname = "input html row " + str(index + 1)
+
+        row_arguments = {"row": index + 1, "rowname": rowname}
+        return ExtractedRows(
+            rows.columns,
+            rows.n_rows,
+            [
+                i18n.I18nMessage(
+                    warning.id,
+                    {
+                        key: row_arguments[key] if value == _DOCUMENT else value
+                        for key, value in warning.arguments.items()
+                    },
+                    warning.source,
+                )
+                for warning in rows.warnings
+            ],
+        )
+
+    def to_table(self, accumulator, *, partial: bool = False) -> pd.DataFrame:
+        return accumulator.to_frame()
+
+
+class XPathZipExtractor(Extractor):
+    """
+    Extract with one xpath selector per column; zip the columns together.
+    """
+
+    def __init__(self, columns_to_parse: Dict[str, etree.XPath], has_url):
+        super().__init__(has_url)
+        self.columns_to_parse = columns_to_parse
+        self.output_columns = list(columns_to_parse.keys())
+        self.batchable = all(
+            is_batchable_xpath(selector.path) for selector in columns_to_parse.values()
+        )
+        self.batch_selectors = self._batch_selectors() if self.batchable else None
+        self.prefilter = TagPrefilter.for_selectors(
+            [selector.path for selector in columns_to_parse.values()]
+        )
+        # Answer simple selectors from an ElementIndex, if there are enough
+        simple_selectors = {
+            name: SimpleSelector.parse(selector.path)
+            for name, selector in columns_to_parse.items()
+        }
+        simple_selectors = {k: v for k, v in simple_selectors.items() if v is not None}
+        if any(selector.is_slow_in_xpath for selector in simple_selectors.values()):
+            self.simple_selectors = simple_selectors
+        else:
+            self.simple_selectors = {}
+        # Compute the rest in one XSLT pass
+        self.stylesheet = ColumnStylesheet.for_selectors(
+            {
+                name: selector
+                for name, selector in columns_to_parse.items()
+                if name not in self.simple_selectors
+            }
+        )
+
+    @property
+    def cache_fingerprint(self) -> str:
+        return json.dumps(
+            [
+                "xpath",
+                [
+                    (name, selector.path)
+                    for name, selector in self.columns_to_parse.items()
+                ],
+            ]
+        )
+
+    def copy_for_thread(self) -> "XPathZipExtractor":
+        extractor = super().copy_for_thread()
+        extractor.columns_to_parse = {
+            name: xpath(selector.path)
+            for name, selector in self.columns_to_parse.items()
+        }
+        if self.batch_selectors is not None:
+            extractor.batch_selectors = extractor._batch_selectors()
+        if self.stylesheet is not None:
+            extractor.stylesheet = self.stylesheet.copy()
+        return extractor
+
+    def _batch_selectors(self) -> Dict[str, etree.XPath]:
+        return {
+            name: _batch_xpath(selector)
+            for name, selector in self.columns_to_parse.items()
+        }
+
+    def _rows(self, values: Dict[str, list]) -> ExtractedRows:
+        columns, n_rows, should_warn = _zip_pad(values)
+        # If they're not all the same length, this may mean extraction failed.
+        # Let the user see the data, and give them a warning
+        if should_warn:
+            warnings = [
+                i18n.trans(
+                    "warning.extractedDifferentLengths",
+                    "Extracted columns of differing lengths from HTML on row {row}",
+                    {"row": _DOCUMENT},
+                )
+            ]
+        else:
+            warnings = []
+        return ExtractedRows(columns, n_rows, warnings)
+
+    def extract_document(self, html) -> ExtractedRows:
+        tree, warnings = self.parse(html)
+        rows = self._rows(
+            select_columns(
+                tree, self.columns_to_parse, self.simple_selectors, self.stylesheet
+            )
+        )
+        rows.warnings = warnings + rows.warnings
+        return rows
+
+    def extract_documents(self, htmls) -> List[ExtractedRows]:
+        if self.batchable and len(htmls) > 1:
+            return [
+                # A truncated document gets its warning from extract_document()
+                self.extract_document(html) if values is None else self._rows(values)
+                for html, values in zip(
+                    htmls,
+                    select_batch(
+                        htmls,
+                        self.columns_to_parse,
+                        self.encoding,
+                        batch_selectors=self.batch_selectors,
+                        max_nodes=self.max_nodes,
+                    ),
+                )
+            ]
+        else:
+            return super().extract_documents(htmls)
+
+
+def _first_match_column(values: list) -> pd.Series:
+    """
+    Build a column from select_first() results.
+
+    If every non-null value is a number (e.g., from `count(//a)`), return a
+    number column. Otherwise, return a str column.
+    """
+    if any(isinstance(v, float) for v in values):
+        if all(v is None or isinstance(v, float) for v in values):
+            return pd.Series(values, dtype=float)
+        values = [str(v) if isinstance(v, float) else v for v in values]
+    return pd.Series(values, dtype=object)
+
+
+class XPathPerDocumentExtractor(Extractor):
+    """
+    Extract one value per column from each document: its first match.
+
+    Output has one row per input row -- even if the input is null -- so each
+    output row lines up with its input row. If the input has a "url" column,
+    the output starts with it.
+    """
+
+    keeps_null_documents = True
+
+    def __init__(self, columns_to_parse: Dict[str, FirstMatchSelector], has_url):
+        super().__init__(has_url)
+        self.columns_to_parse = columns_to_parse
+        self.output_columns = (["url"] if has_url else []) + list(
+            columns_to_parse.keys()
+        )
+        self.prefilter = TagPrefilter.for_selectors(
+            [selector.path for selector in columns_to_parse.values()]
+        )
+
+    @property
+    def cache_fingerprint(self) -> str:
+        return json.dumps(
+            [
+                "xpath_per_document",
+                [
+                    (name, selector.path)
+                    for name, selector in self.columns_to_parse.items()
+                ],
+            ]
+        )
+
+    def copy_for_thread(self) -> "XPathPerDocumentExtractor":
+        extractor = super().copy_for_thread()
+        extractor.columns_to_parse = {
+            name: FirstMatchSelector(selector.path)
+            for name, selector in self.columns_to_parse.items()
+        }
+        return extractor
+
+    def extract_values(self, tree) -> list:
+        values = []
+        for name, selector in self.columns_to_parse.items():
+            try:
+                values.append(select_first(tree, selector))
+            except etree.XPathEvalError as err:
+                raise ColumnExtractionError(name, str(err))
+        return values
+
+    def extract_document(self, html) -> ExtractedRows:
+        tree, warnings = self.parse(html)
+        values = self.extract_values(tree)
+        return ExtractedRows(
+            {name: [value] for name, value in zip(self.columns_to_parse, values)},
+            1,
+            warnings,
+        )
+
+    def null_document(self) -> ExtractedRows:
+        return ExtractedRows({name: [None] for name in self.columns_to_parse}, 1)
+
+    def skipped_document(self) -> ExtractedRows:
+        return self.null_document()
+
+    def bind(self, rows: ExtractedRows, index, url) -> ExtractedRows:
+        rows = super().bind(rows, index, url)
+        if self.has_url:
+            rows = ExtractedRows(
+                {"url": [url] * rows.n_rows, **rows.columns}, rows.n_rows, rows.warnings
+            )
+        return rows
+
+    def to_table(self, accumulator, *, partial: bool = False) -> pd.DataFrame:
+        table = accumulator.to_frame()
+        for name in self.columns_to_parse.keys():
+            table[name] = _first_match_column(table[name].tolist())
+        return table
+
+
+def select_records(tree: etree._Element, selector: etree.XPath) -> list:
+    """
+    Run an xpath expression on `tree` and return the elements it selects.
+
+    Non-element results (attributes, text) are ignored: they can't contain
+    columns.
+
+    Raise XPathEvalError on error, including when `selector` does not return
+    a node-set.
+    """
+    result = selector(tree)
+    if not isinstance(result, list):
+        raise etree.XPathEvalError("Expression does not select elements")
+    return [item for item in result if isinstance(item, etree._Element)]
+
+
+class RecordExtractionError(ExtractionError):
+    def __init__(self, error):
+        self.error = error
+
+    @property
+    def i18n_message(self):
+        return i18n.trans(
+            "error.recordxpath.eval",
+            "XPath error for record selector: {error}",
+            {"error": self.error},
+        )
+
+
+class XPathRecordsExtractor(XPathPerDocumentExtractor):
+    """
+    Extract one row per record element, one value per column within each.
+
+    Column selectors run relative to each record: they only visit the
+    record's subtree, and a missing field is a null in its own row -- no
+    padding, no misaligned rows.
+    """
+
+    keeps_null_documents = False
+
+    def __init__(
+        self,
+        record_selector: etree.XPath,
+        columns_to_parse: Dict[str, FirstMatchSelector],
+        has_url,
+    ):
+        super().__init__(columns_to_parse, has_url)
+        self.record_selector = record_selector
+        # No record, no rows -- whatever the column selectors say
+        self.prefilter = TagPrefilter.for_selectors([record_selector.path])
+
+    @property
+    def cache_fingerprint(self) -> str:
+        return json.dumps(
+            [
+                "xpath_records",
+                self.record_selector.path,
+                [
+                    (name, selector.path)
+                    for name, selector in self.columns_to_parse.items()
+                ],
+            ]
+        )
+
+    def copy_for_thread(self) -> "XPathRecordsExtractor":
+        extractor = super().copy_for_thread()
+        extractor.record_selector = xpath(self.record_selector.path)
+        return extractor
+
+    def skipped_document(self) -> ExtractedRows:
+        return ExtractedRows({}, 0)
+
+    def extract_document(self, html) -> ExtractedRows:
+        tree, warnings = self.parse(html)
+        try:
+            records = select_records(tree, self.record_selector)
+        except etree.XPathEvalError as err:
+            raise RecordExtractionError(str(err))
+
+        data = {name: [] for name in self.columns_to_parse}
+        for record in records:
+            for name, value in zip(self.columns_to_parse, self.extract_values(record)):
+                data[name].append(value)
+        return ExtractedRows(data, len(records), warnings)
+
+
+def _check_url_colname(table, columns_to_parse) -> list:
+    """
+    Return errors if we'd copy input "url" into output that already has one.
+    """
+    if "url" in table.columns and "url" in columns_to_parse:
+        return [
+            i18n.trans(
+                "badParam.colname.duplicate",
+                'Duplicate column name "{column_name}"',
+                {"column_name": "url"},
+            )
+        ]
+    else:
+        return []
+
+
+def _xpath_zip_extractor(table, params):
+    # load params
+    # dict of { name: str -> etree.XPath } -- ordered as the input is ordered.
+    columns_to_parse, errors = parse_colselectors(params["colselectors"])
+    if errors:
+        return None, errors
+    if not columns_to_parse:
+        return None, []
+    return XPathZipExtractor(columns_to_parse, "url" in table.columns), []
+
+
+def _xpath_per_document_extractor(table, params):
+    columns_to_parse, errors = parse_colselectors(
+        params["colselectors"], FirstMatchSelector
+    )
+    if errors:
+        return None, errors
+    if not columns_to_parse:
+        return None, []
+    errors = _check_url_colname(table, columns_to_parse)
+    if errors:
+        return None, errors
+    return XPathPerDocumentExtractor(columns_to_parse, "url" in table.columns), []
+
+
+def _xpath_records_extractor(table, params):
+    recordxpath = params["recordxpath"]
+    if not recordxpath:
+        return None, [
+            i18n.trans("badParam.recordxpath.missing", "Missing record selector")
+        ]
+    try:
+        record_selector = xpath(recordxpath)
+    except etree.XPathSyntaxError as err:
+        return None, [
+            i18n.trans(
+                "badParam.recordxpath.invalid",
+                "Invalid XPath syntax for record selector: {error}",
+                {"error": str(err)},
+            )
+        ]
+
+    columns_to_parse, errors = parse_colselectors(
+        params["colselectors"], FirstMatchSelector
+    )
+    if errors:
+        return None, errors
+    if not columns_to_parse:
+        return None, []
+    for selector in columns_to_parse.values():
+        # `//h1` would search the whole page, giving every record the same
+        # value: that's never what the user wants
+        if searches_whole_page(selector.path):
+            return None, [
+                i18n.trans(
+                    "badParam.colxpath.absolute",
+                    'Column selector "{xpath}" searches the whole page, not each record. Start it with "." (for instance, ".//h1") to search within each record.',
+                    {"xpath": selector.path},
+                )
+            ]
+    errors = _check_url_colname(table, columns_to_parse)
+    if errors:
+        return None, errors
+    return (
+        XPathRecordsExtractor(
+            record_selector, columns_to_parse, "url" in table.columns
+        ),
+        [],
+    )
+
+
+# Extract with one xpath selector per column
+def extract_xpath(table, params):
+    return _extract_all(table, *_xpath_zip_extractor(table, params))
+
+
+# Extract one value per column from each document
+def extract_xpath_per_document(table, params):
+    return _extract_all(table, *_xpath_per_document_extractor(table, params))
+
+
+# Extract one row per record element, one value per column within each record
+def extract_xpath_records(table, params):
+    return _extract_all(table, *_xpath_records_extractor(table, params))
 
 
 def autocast_series_dtype(series: pd.Series):
@@ -291,6 +2175,8 @@ def merge_colspan_headers_in_place(table, *, settings) -> List[tuple]:
 
     Alter the table in place, no return value.
     """
+    from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
+
     newcols = []
     for c in table.columns:
         if isinstance(c, tuple):
@@ -320,13 +2206,100 @@ def merge_colspan_headers_in_place(table, *, settings) -> List[tuple]:
 
 # ---- Tables ----
 
+
+class ColumnUnionAccumulator:
+    """
+    Collect per-page tables into one table, without pd.concat().
+
+    pd.concat(..., sort=False) reindexes and upcasts every input frame when
+    column sets differ. Over thousands of pages, that's slow and it holds
+    several copies of the data in memory. Instead, we track the union of
+    column names in first-seen order and append each page's values to one
+    growing list per column. Columns a page doesn't have are padded with None.
+
+    Call `to_frame()` once, at the end, to build the output table.
+    """
+
+    __slots__ = ("_columns", "_n_rows")
+
+    def __init__(self, column_names: Optional[List[str]] = None):
+        if column_names is None:
+            column_names = []
+        # {name: list of values}, in first-seen order. Each list has _n_rows
+        # values.
+        self._columns: Dict[str, list] = {name: [] for name in column_names}
+        self._n_rows = 0
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self._columns.keys())
+
+    @property
+    def columns(self) -> Dict[str, list]:
+        """
+        {name: list of values}. Don't modify it.
+        """
+        return self._columns
+
+    def append_columns(self, columns: Dict[str, list], n_rows: int) -> None:
+        """
+        Append `n_rows` rows, given as {name: list of `n_rows` values}.
+        """
+        for name, values in columns.items():
+            try:
+                buffer = self._columns[name]
+            except KeyError:
+                # New column: pad with None for all the rows we've already seen
+                buffer = self._columns[name] = [None] * self._n_rows
+            buffer.extend(values)
+        self._n_rows += n_rows
+        for buffer in self._columns.values():
+            if len(buffer) < self._n_rows:
+                # This page didn't have this column
+                buffer.extend([None] * (self._n_rows - len(buffer)))
+
+    def append_frame(self, table: pd.DataFrame) -> None:
+        """
+        Append all rows of `table`. Its column names must be unique.
+        """
+        self.append_columns(
+            {name: column.tolist() for name, column in table.items()}, len(table)
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                name: pd.Series(values, dtype=object)
+                for name, values in self._columns.items()
+            }
+        )
+
+
 # This is applied to each row of our input
-def extract_table_from_one_page(html, tablenum, rowname, *, settings):
-    error_no_table = i18n.trans(
+def _error_no_table(rowname):
+    return i18n.trans(
         "error.noTable",
         "Did not find any <table> tags in {rowname}",
         {"rowname": rowname},
     )
+
+
+def read_tables(html, rowname, encoding=None) -> Tuple[Optional[list], list]:
+    """
+    Parse every <table> in `html`; return (list of DataFrames, errors).
+
+    `encoding` is the charset of bytes or memoryview `html`, or None to detect
+    it.
+
+    On error (including when there are no tables), the list is None. Either
+    way, we cache what we learned for table_inventory().
+    """
+    error_no_table = _error_no_table(rowname)
+    if isinstance(html, memoryview):
+        html = bytes(html)  # pandas doesn't read memoryview
     try:
         # pandas.read_html() does automatic type conversion, but we prefer
         # our own. Delve into its innards so we can pass all the conversion
@@ -337,7 +2310,7 @@ def extract_table_from_one_page(html, tablenum, rowname, *, settings):
             io=html,
             match=".+",
             attrs=None,
-            encoding=None,  # html string is already decoded
+            encoding=encoding,  # None for str: it's already decoded
             displayed_only=False,  # avoid dud feature: it ignores CSS
             # Required kwargs that pd.read_html() would set by default:
             header=None,
@@ -351,6 +2324,7 @@ def extract_table_from_one_page(html, tablenum, rowname, *, settings):
             dtype=str,  # do not autoconvert
         )
     except ValueError:
+        _table_inventories.put(_document_hash(html), [], True)
         return None, [error_no_table]
     except IndexError:
         # pandas.read_html() gives this unhelpful error message....
@@ -362,17 +2336,42 @@ def extract_table_from_one_page(html, tablenum, rowname, *, settings):
             )
         ]
 
+    # Remember the tables' shapes, for table_inventory()
+    _table_inventories.put(
+        _document_hash(html),
+        [TableSummary.from_frame(table) for table in tables],
+        True,
+    )
+
     if not tables:
         return None, [error_no_table]
 
+    return tables, []
+
+
+def _error_table_num_too_big(n_tables, rowname):
+    return i18n.trans(
+        "badParam.tableNum.tooBig",
+        "The maximum table number is {len_tables} for {rowname}",
+        {"n_tables": n_tables, "rowname": rowname},
+    )
+
+
+def extract_table_from_one_page(html, tablenum, rowname, *, settings, encoding=None):
+    # If we've seen this document before, we may know it's missing the table
+    summaries, exact = _table_inventories.get(_document_hash(html)) or ([], False)
+    if exact:
+        if not summaries:
+            return None, [_error_no_table(rowname)]
+        if tablenum >= len(summaries):
+            return None, [_error_table_num_too_big(len(summaries), rowname)]
+
+    tables, errors = read_tables(html, rowname, encoding)
+    if tables is None:
+        return None, errors
+
     if tablenum >= len(tables):
-        return None, [
-            i18n.trans(
-                "badParam.tableNum.tooBig",
-                "The maximum table number is {len_tables} for {rowname}",
-                {"n_tables": len(tables), "rowname": rowname},
-            )
-        ]
+        return None, [_error_table_num_too_big(len(tables), rowname)]
 
     table = tables[tablenum]
 
@@ -384,8 +2383,66 @@ def extract_table_from_one_page(html, tablenum, rowname, *, settings):
     return table, warnings
 
 
-# Extract contents of <table> tag
-def extract_table(table, params, *, settings):
+class TableExtractor(Extractor):
+    """
+    Extract the contents of the nth <table> tag of each document.
+
+    pandas parses the documents, so `max_nodes` doesn't apply.
+    """
+
+    output_columns = []  # unknown until we see a table
+
+    def __init__(self, tablenum: int, has_url, *, settings):
+        super().__init__(has_url)
+        self.tablenum = tablenum
+        self.settings = settings
+        self.prefilter = TagPrefilter([frozenset(["table"])])
+
+    @property
+    def cache_fingerprint(self) -> str:
+        return json.dumps(
+            ["table", self.tablenum, self.settings.MAX_BYTES_PER_COLUMN_NAME]
+        )
+
+    def skipped_document(self) -> ExtractedRows:
+        return ExtractedRows({}, 0, [_error_no_table(_DOCUMENT)])
+
+    def extract_document(self, html) -> ExtractedRows:
+        """
+        A document without the table yields zero rows and a warning.
+        """
+        one_result, one_page_warnings = extract_table_from_one_page(
+            html,
+            self.tablenum,
+            _DOCUMENT,
+            settings=self.settings,
+            encoding=self.encoding,
+        )
+        if one_result is None:
+            return ExtractedRows({}, 0, one_page_warnings)
+        else:
+            return ExtractedRows(
+                {name: column.tolist() for name, column in one_result.items()},
+                len(one_result),
+                one_page_warnings,
+            )
+
+    def to_table(self, accumulator, *, partial: bool = False) -> pd.DataFrame:
+        """
+        Build the output table, or None if no document had a table.
+
+        We cast columns to numbers where possible -- unless `partial`, because
+        casting needs to see the whole column.
+        """
+        if not accumulator.column_names:
+            return None if not partial else accumulator.to_frame()
+        result = accumulator.to_frame()
+        if not partial:
+            autocast_dtypes_in_place(result)
+        return result
+
+
+def _table_extractor(table, params, *, settings):
     # We delve into pd.read_html()'s innards, above. Part of that means some
     # first-use initialization.
     pd.io.html._importers()
@@ -397,75 +2454,1474 @@ def extract_table(table, params, *, settings):
             i18n.trans("badParam.tablenum.negative", "Table number must be at least 1")
         ]
 
-    # Loop over rows of input html column, each of which is a complete html document
-    # Concatenate rows extracted from each document.
-    result_tables = []
-    warnings = []
-    for index, html in table["html"].iteritems():
-        if html is None:
-            continue
+    return TableExtractor(tablenum, "url" in table.columns, settings=settings), []
 
-        # Use url for "name" of row if available, for error messages
-        if "url" in table.columns:
-            rowname = table["url"].iloc[index]
-        else:
-            rowname = "input html row " + str(index + 1)
 
-        one_result, one_page_warnings = extract_table_from_one_page(
-            html, tablenum, rowname, settings=settings
+# Extract contents of <table> tag
+def extract_table(table, params, *, settings):
+    return _extract_all(table, *_table_extractor(table, params, settings=settings))
+
+
+class AllTablesExtractor(Extractor):
+    """
+    Extract the contents of every <table> tag of each document, in one parse.
+
+    Output is in long format: one row per table row, starting with the
+    document's "url" (or, without a "url" column, its 1-based input "row")
+    and the table's 1-based number on its page. Then come the union of all
+    tables' columns; a table's row has None in columns it doesn't have.
+
+    pandas parses the documents, so `max_nodes` doesn't apply.
+    """
+
+    def __init__(self, has_url, *, settings):
+        super().__init__(has_url)
+        self.settings = settings
+        self.output_columns = ["url" if has_url else "row", "table"]
+        self.prefilter = TagPrefilter([frozenset(["table"])])
+
+    @property
+    def cache_fingerprint(self) -> str:
+        return json.dumps(
+            ["all_tables", self.has_url, self.settings.MAX_BYTES_PER_COLUMN_NAME]
+        )
+
+    def skipped_document(self) -> ExtractedRows:
+        return ExtractedRows({}, 0, [_error_no_table(_DOCUMENT)])
+
+    def extract_document(self, html) -> ExtractedRows:
+        """
+        A document without tables yields zero rows and a warning.
+        """
+        from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
+
+        tables, warnings = read_tables(html, _DOCUMENT, self.encoding)
+        if tables is None:
+            return ExtractedRows({}, 0, warnings)
+
+        accumulator = ColumnUnionAccumulator(self.output_columns[1:])
+        for tablenum, table in enumerate(tables):
+            warnings.extend(
+                merge_colspan_headers_in_place(table, settings=self.settings)
+            )
+            # Our own columns come first; rename table columns that clash
+            names, rename_warnings = gen_unique_clean_colnames_and_warn(
+                self.output_columns + list(table.columns), settings=self.settings
+            )
+            table.columns = names[len(self.output_columns) :]
+            warnings.extend(rename_warnings)
+            accumulator.append_columns(
+                {
+                    "table": [tablenum + 1] * len(table),
+                    **{name: column.tolist() for name, column in table.items()},
+                },
+                len(table),
+            )
+        return ExtractedRows(accumulator.columns, len(accumulator), warnings)
+
+    def bind(self, rows: ExtractedRows, index, url) -> ExtractedRows:
+        rows = super().bind(rows, index, url)
+        if not rows.n_rows:
+            return rows
+        source = url if self.has_url else index + 1
+        return ExtractedRows(
+            {self.output_columns[0]: [source] * rows.n_rows, **rows.columns},
+            rows.n_rows,
+            rows.warnings,
         )
-        if one_result is not None:
-            result_tables.append(one_result)
-        if not warnings and one_page_warnings:  # only report _first_ page of warnings
-            warnings = one_page_warnings
 
-    if result_tables:
-        result = pd.concat(result_tables, ignore_index=True, sort=False)
-        autocast_dtypes_in_place(result)
+    def to_table(self, accumulator, *, partial: bool = False) -> pd.DataFrame:
+        """
+        Build the output table.
+
+        We cast columns to numbers where possible -- unless `partial`, because
+        casting needs to see the whole column.
+        """
+        result = accumulator.to_frame()
+        if not partial:
+            autocast_dtypes_in_place(result)
+        return result
+
+
+def _all_tables_extractor(table, params, *, settings):
+    pd.io.html._importers()  # see _table_extractor()
+    return AllTablesExtractor("url" in table.columns, settings=settings), []
+
+
+# Extract contents of all <table> tags
+def extract_all_tables(table, params, *, settings):
+    return _extract_all(table, *_all_tables_extractor(table, params, settings=settings))
+
+
+# ---- Table inventory ----
+
+
+# Documents whose table inventories we remember
+TABLE_INVENTORY_CACHE_SIZE = 10000
+
+# pd.read_html() ignores tables whose text doesn't match this. (We pass
+# match=".+".)
+_TABLE_TEXT = re.compile(".+")
+
+
+def _document_hash(html: Union[str, bytes, memoryview]) -> bytes:
+    """
+    Identify the contents of `html`.
+
+    str and bytes input parse differently (we detect the encoding of bytes),
+    so their hashes differ.
+    """
+    if isinstance(html, str):
+        return hashlib.sha256(b"s" + html.encode("utf-8", "surrogatepass")).digest()
     else:
-        result = None
+        return hashlib.sha256(b"b" + bytes(html)).digest()
 
-    return result, warnings
 
+class TableSummary:
+    """
+    The shape and header of one table, without its contents.
+    """
+
+    __slots__ = ("n_rows", "n_columns", "header")
+
+    def __init__(self, n_rows: int, n_columns: int, header: List[str]):
+        self.n_rows = n_rows  # not counting the header
+        self.n_columns = n_columns
+        self.header = header  # column names; "" where a column has none
+
+    def __eq__(self, other):
+        return isinstance(other, TableSummary) and (
+            self.n_rows,
+            self.n_columns,
+            self.header,
+        ) == (other.n_rows, other.n_columns, other.header)
+
+    def __repr__(self):
+        return "TableSummary(%r, %r, %r)" % (self.n_rows, self.n_columns, self.header)
+
+    @classmethod
+    def from_frame(cls, table: pd.DataFrame) -> "TableSummary":
+        """
+        Summarize a table read_tables() returned.
+        """
+        header = []
+        for name in table.columns:
+            if isinstance(name, tuple):
+                header.append(" - ".join(name))
+            elif isinstance(name, int):
+                header.append("")  # no header row
+            else:
+                header.append(name)
+        return cls(len(table), len(table.columns), header)
+
+
+def _cell_text(element: etree._Element) -> str:
+    return " ".join("".join(element.itertext()).split())
+
+
+def summarize_tables(tree: etree._Element) -> Tuple[List[TableSummary], bool]:
+    """
+    Summarize each table of `tree` that read_tables() would return.
+
+    Return (summaries, exact). This walks the tree once and builds no
+    DataFrames. Like pandas, we skip tables without text and tables that
+    duplicate an earlier one. pandas also skips tables whose cells are all
+    blank -- sometimes -- and it may call tables that differ only in
+    attribute values' whitespace duplicates. When we can't tell, `exact` is
+    False: the number of tables might be too high.
+
+    The first row is the header if it's in a <thead> or all its cells are
+    <th>. pandas may infer headers differently (e.g., from several <th> rows).
+    """
+    summaries = []
+    exact = True
+    seen = set()  # serialized tables: pandas reads identical tables once
+    seen_shapes = set()  # (text, number of nodes) of those tables
+    for table in tree.iter("table"):
+        text = "".join(table.itertext())
+        if not _TABLE_TEXT.search(text):
+            continue
+        # C14N sorts attributes: pandas (bs4) compares them as dicts
+        serialized = etree.tostring(table, method="c14n", with_tail=False)
+        if serialized in seen:
+            continue
+        shape = (text, table.xpath("count(.//node())"))
+        if shape in seen_shapes:
+            # pandas may call these the same (e.g., class="a b" and
+            # class="a  b"), or not
+            exact = False
+        seen.add(serialized)
+        seen_shapes.add(shape)
+        rows = [
+            row
+            for row in table.iter("tr")
+            # Skip rows of nested tables: pandas reads those separately
+            if next(row.iterancestors("table")) is table
+        ]
+        n_columns = 0
+        is_blank = True
+        for row in rows:
+            n_cells = 0
+            for cell in row.iterchildren("td", "th"):
+                try:
+                    n_cells += max(int(cell.get("colspan", 1)), 1)
+                except ValueError:
+                    n_cells += 1
+                if is_blank and _cell_text(cell):
+                    is_blank = False
+            n_columns = max(n_columns, n_cells)
+        if is_blank:
+            exact = False
+        header = []
+        if rows:
+            cells = list(rows[0].iterchildren("td", "th"))
+            if rows[0].getparent().tag == "thead" or (
+                cells and all(cell.tag == "th" for cell in cells)
+            ):
+                header = [_cell_text(cell) for cell in cells]
+                rows = rows[1:]
+        summaries.append(TableSummary(len(rows), n_columns, header))
+    return summaries, exact
+
+
+class _TableInventoryCache:
+    """
+    Recently-seen documents' (summaries, exact), by document hash.
+
+    `exact` means the number of summaries is the number of tables
+    read_tables() returns.
+
+    Re-rendering with a new "tablenum" would otherwise parse every document
+    again just to report that it doesn't have that many tables.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key: bytes) -> Optional[Tuple[List[TableSummary], bool]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: bytes, summaries: List[TableSummary], exact: bool) -> None:
+        with self._lock:
+            self._entries[key] = (summaries, exact)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_table_inventories = _TableInventoryCache(TABLE_INVENTORY_CACHE_SIZE)
+
+
+def table_inventory(html: Union[str, bytes, memoryview]) -> List[TableSummary]:
+    """
+    Summarize each <table> in `html` that the "table" method can extract.
+
+    Table i of the result is `tablenum` i+1. Results are cached by document
+    hash, so asking again -- or rendering with a `tablenum` that's too big --
+    doesn't parse the document again. If the "table" method has read the
+    document already, the summaries come from its tables.
+    """
+    key = _document_hash(html)
+    entry = _table_inventories.get(key)
+    if entry is None:
+        entry = summarize_tables(parse_document(html, True))
+        _table_inventories.put(key, *entry)
+    return entry[0]
+
+
+# ---- Result cache ----
+
+
+# Bump this when ExtractedRows change for the same extractor and HTML
+CACHE_FORMAT_VERSION = 1
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
 
-def render(table, params, *, settings):
+
+def _encode_rows(rows: ExtractedRows) -> bytes:
+    return zlib.compress(
+        json.dumps(
+            [
+                rows.n_rows,
+                rows.columns,
+                [
+                    [warning.id, warning.arguments, warning.source]
+                    for warning in rows.warnings
+                ],
+            ],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+    )
+
+
+def _decode_rows(value: bytes) -> ExtractedRows:
+    n_rows, columns, warnings = json.loads(zlib.decompress(value).decode("utf-8"))
+    return ExtractedRows(
+        columns,
+        n_rows,
+        [i18n.I18nMessage(id, arguments, source) for id, arguments, source in warnings],
+    )
+
+
+class ResultCache:
+    """
+    ExtractedRows on disk, keyed by extractor and document content.
+
+    Re-rendering input we've seen before (e.g., after a re-scrape that only
+    changed a few pages, or after toggling between two sets of params) skips
+    parsing the documents whose results we already have.
+
+    `path` is a SQLite database file. Several processes (and threads) may
+    share it: each process opens its own connection, and SQLite locks the
+    file. When entries total more than `max_bytes`, we delete the
+    least-recently-used ones.
+    """
+
+    def __init__(self, path, *, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None  # process that opened self._connection
+
+    @staticmethod
+    def key(fingerprint: str, html: Union[str, bytes, memoryview]) -> bytes:
+        """
+        Identify the ExtractedRows for `html`, from an extractor's fingerprint.
+        """
+        extractor_hash = hashlib.sha256(
+            ("%d:%s" % (CACHE_FORMAT_VERSION, fingerprint)).encode("utf-8")
+        )
+        return extractor_hash.digest() + _document_hash(html)
+
+    def _connect(self) -> sqlite3.Connection:
+        import sqlite3
+
+        # A forked child mustn't use its parent's connection
+        if self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results"
+                " (key BLOB PRIMARY KEY, value BLOB NOT NULL,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS stats (n_bytes INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "INSERT INTO stats (n_bytes)"
+                " SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM stats)"
+            )
+            connection.execute("COMMIT")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key: bytes) -> Optional[ExtractedRows]:
+        """
+        Return the ExtractedRows stored at `key`, or None.
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return _decode_rows(row[0])
+
+    def put(self, key: bytes, rows: ExtractedRows) -> None:
+        """
+        Store `rows` at `key`; evict old entries if the cache is too big.
+        """
+        value = _encode_rows(rows)
+        size = len(key) + len(value)
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                old = connection.execute(
+                    "SELECT size FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, last_used)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, value, size, time.time()),
+                )
+                connection.execute(
+                    "UPDATE stats SET n_bytes = n_bytes + ?",
+                    (size - (old[0] if old else 0),),
+                )
+                self._evict(connection)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _evict(self, connection) -> None:
+        (n_bytes,) = connection.execute("SELECT n_bytes FROM stats").fetchone()
+        if n_bytes <= self.max_bytes:
+            return
+        keys = []
+        n_evicted_bytes = 0
+        cursor = connection.execute("SELECT key, size FROM results ORDER BY last_used")
+        for key, size in cursor:
+            keys.append((key,))
+            n_evicted_bytes += size
+            if n_bytes - n_evicted_bytes <= self.max_bytes:
+                break
+        cursor.close()
+        connection.executemany("DELETE FROM results WHERE key = ?", keys)
+        connection.execute("UPDATE stats SET n_bytes = n_bytes - ?", (n_evicted_bytes,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = None
+
+
+# ---- Rendering ----
+
+
+def _iter_documents(table):
+    """
+    Yield (index, html, url) for each row of `table`.
+
+    Loop over rows of input html column, each of which is a complete html
+    document. `url` is None if there is no "url" column.
+    """
+    if "url" in table.columns:
+        urls = table["url"]
+    else:
+        urls = itertools.repeat(None)
+    for (index, html), url in zip(table["html"].items(), urls):
+        yield index, html, url
+
+
+def _extract_all(table, extractor, errors, *, cache=None, stats=None, executor=None):
+    """
+    Run `extractor` over all documents in `table`; return (table, warnings).
+
+    If `errors`, return them. If `extractor` is None, return the input table:
+    the user hasn't input anything, and that is our convention. `cache`,
+    `stats` and `executor` are as in render().
+    """
+    if errors:
+        return None, errors
+    if extractor is None:
+        return table, []
+    return _extract_documents(
+        extractor,
+        _iter_documents(table),
+        cache=cache,
+        stats=stats,
+        executor=executor,
+    )
+
+
+def _extract_documents(extractor, documents, *, cache, stats, executor):
+    """
+    Run `extractor` over (index, html, url) `documents`; return (table, warnings).
+    """
+    # Concatenate rows extracted from each document.
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    warnings = []
+    try:
+        for rows in extractor.extract(
+            documents, cache=cache, stats=stats, executor=executor
+        ):
+            accumulator.append_columns(rows.columns, rows.n_rows)
+            if not warnings and rows.warnings:  # only report _first_ warnings
+                warnings = rows.warnings
+    except ExtractionError as err:
+        return None, [err.i18n_message]
+
+    return extractor.to_table(accumulator), warnings
+
+
+def _no_html_column_error():
     # Suggest quickfix of adding Scrape HTML if 'html' col not found
-    inputcol = "html"
-    if inputcol not in table.columns:
-        return None, [
+    return {
+        "message": i18n.trans(
+            "error.noHtml.error",
+            "No 'html' column found. Do you need to scrape?",
+        ),
+        "quickFixes": [
             {
-                "message": i18n.trans(
-                    "error.noHtml.error",
-                    "No 'html' column found. Do you need to scrape?",
-                ),
-                "quickFixes": [
-                    {
-                        "text": i18n.trans(
-                            "error.noHtml.quick_fix.text", "Add HTML scraper"
-                        ),
-                        "action": "prependModule",
-                        "args": ["urlscraper", {}],
-                    }
-                ],
+                "text": i18n.trans("error.noHtml.quick_fix.text", "Add HTML scraper"),
+                "action": "prependModule",
+                "args": ["urlscraper", {}],
             }
-        ]
+        ],
+    }
+
+
+def _make_extractor(table, params, *, settings):
+    """
+    Return (extractor, errors) for `params`.
+
+    If extractor and errors are both empty, the user hasn't input anything.
+
+    `settings` may set MAX_BYTES_PER_HTML_DOCUMENT and
+    MAX_NODES_PER_HTML_DOCUMENT, to override the default limits.
+    """
+    if "html" not in table.columns:
+        return None, [_no_html_column_error()]
 
     method = params["method"]
     if method == "xpath":
-        return extract_xpath(table, params)
+        extractor, errors = _xpath_zip_extractor(table, params)
+    elif method == "xpath_per_document":
+        extractor, errors = _xpath_per_document_extractor(table, params)
+    elif method == "xpath_records":
+        extractor, errors = _xpath_records_extractor(table, params)
+    elif method == "all_tables":
+        extractor, errors = _all_tables_extractor(table, params, settings=settings)
     else:
-        return extract_table(table, params, settings=settings)
+        extractor, errors = _table_extractor(table, params, settings=settings)
+
+    if extractor is not None:
+        extractor.max_bytes = getattr(
+            settings, "MAX_BYTES_PER_HTML_DOCUMENT", DEFAULT_MAX_BYTES_PER_DOCUMENT
+        )
+        extractor.max_nodes = getattr(
+            settings, "MAX_NODES_PER_HTML_DOCUMENT", DEFAULT_MAX_NODES_PER_DOCUMENT
+        )
+    return extractor, errors
+
+
+def render_batches(
+    table,
+    params,
+    *,
+    settings,
+    batch_size: int = 10000,
+    cache=None,
+    stats=None,
+    executor=None,
+):
+    """
+    Like render(), but yield (table, warnings) batches as documents finish.
+
+    Each table has at most `batch_size` rows. Warnings are yielded as soon as
+    they occur, with the rows extracted so far. Memory is bounded by
+    `batch_size` (plus one document's results) rather than by input size.
+
+    Batches all have the same columns -- except with methods "table" and
+    "all_tables", where a batch only has columns from tables seen so far, and
+    values are not cast to numbers (because casting needs the whole column).
+
+    On error, yield (None, errors) and stop; discard any batches yielded
+    before it. If the user hasn't input anything, yield the input table.
+
+    `cache`, `stats` and `executor` are as in render().
+    """
+    extractor, errors = _make_extractor(table, params, settings=settings)
+    if errors:
+        yield None, errors
+        return
+    if extractor is None:
+        yield table, []
+        return
+
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    pending_warnings = []  # to yield with the next batch
+    has_warnings = False  # only report _first_ warnings
+    n_yielded_rows = 0
+    try:
+        for rows in extractor.extract(
+            _iter_documents(table), cache=cache, stats=stats, executor=executor
+        ):
+            accumulator.append_columns(rows.columns, rows.n_rows)
+            if not has_warnings and rows.warnings:
+                pending_warnings = rows.warnings
+                has_warnings = True
+            if len(accumulator) >= batch_size or pending_warnings:
+                batch = extractor.to_table(accumulator, partial=True)
+                for start in range(0, max(len(batch), 1), batch_size):
+                    yield (
+                        batch.iloc[start : start + batch_size].reset_index(drop=True),
+                        pending_warnings,
+                    )
+                    pending_warnings = []
+                n_yielded_rows += len(batch)
+                accumulator = ColumnUnionAccumulator(accumulator.column_names)
+    except ExtractionError as err:
+        yield None, [err.i18n_message]
+        return
+
+    if len(accumulator) or not n_yielded_rows:
+        batch = extractor.to_table(accumulator, partial=n_yielded_rows > 0)
+        yield batch, []
+
+
+class _PreviewDocuments:
+    """
+    Iterate over documents until a document count or time budget runs out.
+    """
+
+    def __init__(self, documents, max_documents, deadline):
+        self.documents = documents
+        self.max_documents = max_documents
+        self.deadline = deadline
+        self.n_documents = 0  # non-null documents we've handed out
+        self.n_rows = 0  # input rows we've handed out
+
+    def __iter__(self):
+        for document in self.documents:
+            if document[1] is not None:
+                if (
+                    self.max_documents is not None
+                    and self.n_documents >= self.max_documents
+                ) or (self.deadline is not None and time.monotonic() >= self.deadline):
+                    return
+                self.n_documents += 1
+            self.n_rows += 1
+            yield document
+
+
+def render_preview(
+    table,
+    params,
+    *,
+    settings,
+    max_documents: Optional[int] = 10,
+    max_seconds: Optional[float] = None,
+    cache=None,
+    stats=None,
+):
+    """
+    Like render(), but only extract from the first few documents.
+
+    This is for interactive use: while the user edits params, show output
+    quickly and run the full render() once the user is done.
+
+    Stop before the `max_documents`+1th non-null document, or before the first
+    document that starts `max_seconds` after we began. If we stopped early,
+    the first warning says the output is a preview and estimates how many
+    rows render() would output.
+
+    `cache` and `stats` are as in render().
+    """
+    extractor, errors = _make_extractor(table, params, settings=settings)
+    if errors:
+        return None, errors
+    if extractor is None:
+        # User hasn't input anything. Return input, as is our convention.
+        return table, []
+
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    documents = _PreviewDocuments(_iter_documents(table), max_documents, deadline)
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    warnings = []
+    try:
+        for rows in extractor.extract(
+            documents,
+            cache=cache,
+            stats=stats,
+            # Extract each document as soon as we read it: reading a whole
+            # batch first would overshoot the deadline by that many documents
+            batch_size=None if deadline is None else 1,
+        ):
+            accumulator.append_columns(rows.columns, rows.n_rows)
+            if not warnings and rows.warnings:  # only report _first_ warnings
+                warnings = rows.warnings
+    except ExtractionError as err:
+        return None, [err.i18n_message]
+    result = extractor.to_table(accumulator)
+
+    if documents.n_rows < len(table):
+        n_total_documents = documents.n_documents + int(
+            table["html"].iloc[documents.n_rows :].notnull().sum()
+        )
+        n_rows = len(accumulator)
+        n_estimated_rows = round(
+            n_rows * n_total_documents / max(documents.n_documents, 1)
+        )
+        warnings = [
+            i18n.trans(
+                "preview.partial",
+                "Preview: extracted {n_rows} rows from the first {n_documents} "
+                "of {n_total_documents} HTML documents. All documents would "
+                "give about {n_estimated_rows} rows.",
+                {
+                    "n_rows": n_rows,
+                    "n_documents": documents.n_documents,
+                    "n_total_documents": n_total_documents,
+                    "n_estimated_rows": n_estimated_rows,
+                },
+            )
+        ] + warnings
+    return result, warnings
+
+
+def _extract_list(
+    extractor, documents, cache, stats, cancelled: threading.Event
+) -> List[ExtractedRows]:
+    result = []
+    for rows in extractor.extract(documents, cache=cache, stats=stats):
+        if cancelled.is_set():
+            break  # render_async() won't read our result
+        result.append(rows)
+    return result
+
+
+async def render_async(
+    table,
+    params,
+    *,
+    settings,
+    executor=None,
+    documents_per_step: Optional[int] = None,
+    cache=None,
+    stats=None,
+):
+    """
+    Like render(), but parse and select on `executor`, not the event loop.
+
+    `executor` is a concurrent.futures.Executor that runs threads (compiled
+    selectors can't be pickled for a process pool). If None, we use the event
+    loop's default executor.
+
+    We hand the executor `documents_per_step` (default BATCH_SIZE) documents
+    at a time, so small documents can be parsed in batches. If the caller
+    cancels us, we raise CancelledError and schedule no further work. The
+    step in progress stops after the document it's on (or, for small
+    documents, the batch it's on).
+
+    `cache` and `stats` are as in render().
+    """
+    extractor, errors = _make_extractor(table, params, settings=settings)
+    if errors:
+        return None, errors
+    if extractor is None:
+        # User hasn't input anything. Return input, as is our convention.
+        return table, []
+
+    import asyncio
+
+    if documents_per_step is None:
+        documents_per_step = BATCH_SIZE
+    loop = asyncio.get_running_loop()
+    documents = _iter_documents(table)
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    warnings = []
+    cancelled = threading.Event()
+    try:
+        while True:
+            step = list(itertools.islice(documents, documents_per_step))
+            if not step:
+                break
+            for rows in await loop.run_in_executor(
+                executor, _extract_list, extractor, step, cache, stats, cancelled
+            ):
+                accumulator.append_columns(rows.columns, rows.n_rows)
+                if not warnings and rows.warnings:  # only report _first_ warnings
+                    warnings = rows.warnings
+    except ExtractionError as err:
+        return None, [err.i18n_message]
+    except asyncio.CancelledError:
+        cancelled.set()  # stop the step in progress, in its thread
+        raise
+
+    result = await loop.run_in_executor(executor, extractor.to_table, accumulator)
+    return result, warnings
+
+
+def render(table, params, *, settings, cache=None, stats=None, executor=None):
+    """
+    Extract a table from the "html" column of `table`; return (table, warnings).
+
+    `cache` is an optional ResultCache: with it, we only parse documents we
+    haven't extracted (with the same params) before. `stats` is an optional
+    ExtractionStats: we add to its counts -- e.g., of documents we skipped
+    because they can't match. `executor` is an optional thread pool
+    (concurrent.futures.ThreadPoolExecutor): with it, we extract several
+    chunks of documents at once. Output is the same either way.
+    """
+    return _extract_all(
+        table,
+        *_make_extractor(table, params, settings=settings),
+        cache=cache,
+        stats=stats,
+        executor=executor,
+    )
+
+
+def _arrow_views(array) -> Iterator[Optional[memoryview]]:
+    """
+    Yield each value of a string or binary Arrow array as a memoryview, or None.
+
+    The views point into the array's own data buffer: no copies.
+    """
+    validity, offsets, data = array.buffers()[:3]
+    is_large = pa.types.is_large_string(array.type) or pa.types.is_large_binary(
+        array.type
+    )
+    offsets = memoryview(offsets).cast("q" if is_large else "i")
+    data = memoryview(data if data is not None else b"").cast("B")
+    bits = memoryview(validity) if array.null_count else None
+    for i in range(array.offset, array.offset + len(array)):
+        if bits is not None and not (bits[i >> 3] >> (i & 7)) & 1:
+            yield None
+        else:
+            yield data[offsets[i] : offsets[i + 1]]
+
+
+def _iter_arrow_documents(reader, has_url):
+    """
+    Yield (index, html, url) for each row of an Arrow IPC file `reader`.
+
+    We read one record batch at a time. Each html is a memoryview of the
+    (memory-mapped) file; only urls become Python objects.
+    """
+    index = 0
+    for batch_index in range(reader.num_record_batches):
+        batch = reader.get_batch(batch_index)
+        htmls = batch.column(batch.schema.get_field_index("html"))
+        if not (
+            pa.types.is_string(htmls.type)
+            or pa.types.is_large_string(htmls.type)
+            or pa.types.is_binary(htmls.type)
+            or pa.types.is_large_binary(htmls.type)
+        ):
+            htmls = htmls.cast(pa.large_string())  # e.g., dictionary: copies
+        if has_url:
+            urls = batch.column(batch.schema.get_field_index("url")).to_pylist()
+        else:
+            urls = itertools.repeat(None)
+        for html, url in zip(_arrow_views(htmls), urls):
+            yield index, html, url
+            index += 1
+
+
+def render_arrow_file(path, params, *, settings, cache=None, stats=None, executor=None):
+    """
+    Like render(), but read input from the Arrow IPC (Feather v2) file `path`.
+
+    We memory-map the file and hand each "html" value to the parser as a
+    view of the file, so the "html" column never becomes Python str objects.
+    A string column is UTF-8, whatever its documents' `<meta charset>` says;
+    a binary column's charset is detected, as with bytes in render(). (A
+    compressed file's batches are decompressed into memory, one at a time.)
+
+    `cache`, `stats` and `executor` are as in render().
+    """
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        schema = reader.schema
+        # Our factories only look at column names
+        extractor, errors = _make_extractor(
+            schema.empty_table().to_pandas(), params, settings=settings
+        )
+        if errors:
+            return None, errors
+        if extractor is None:
+            return reader.read_all().to_pandas(), []
+        html_type = schema.field("html").type
+        if not (pa.types.is_binary(html_type) or pa.types.is_large_binary(html_type)):
+            extractor.encoding = "utf-8"
+        return _extract_documents(
+            extractor,
+            _iter_arrow_documents(reader, extractor.has_url),
+            cache=cache,
+            stats=stats,
+            executor=executor,
+        )
+
+
+# ---- Sharding ----
+
+
+# Bump this when ShardResult's fields change
+SHARD_FORMAT_VERSION = 2
+
+
+class ShardResult:
+    """
+    What render_shard() extracted from rows [start, stop) of an input table.
+
+    It describes itself -- params, input columns and row range -- so
+    merge_shards() can check that shards belong together, and so shards can
+    be computed by different processes (or machines) and sent back as
+    to_bytes(): zlib-compressed JSON, as in ResultCache. from_bytes() raises
+    ValueError on data it can't read, including other format versions.
+    """
+
+    __slots__ = (
+        "params",
+        "input_columns",  # column names of the whole input table
+        "n_input_rows",  # number of rows in the whole input table
+        "start",
+        "stop",
+        "columns",  # {name: list of values}, in first-seen order
+        "n_rows",
+        "warnings",  # the shard's first document warnings
+        "first_warning_row",  # input row position those came from, or None
+        "errors",  # ExtractionError messages (we stop at the first)
+        "input",  # the input rows, if the user hasn't input any params
+    )
+
+    def __init__(self, params, input_columns, n_input_rows, start, stop):
+        self.params = params
+        self.input_columns = input_columns
+        self.n_input_rows = n_input_rows
+        self.start = start
+        self.stop = stop
+        self.columns = {}
+        self.n_rows = 0
+        self.warnings = []
+        self.first_warning_row = None
+        self.errors = []
+        self.input = None
+
+    def to_bytes(self) -> bytes:
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values["warnings"] = _i18n_to_json(self.warnings)
+        values["errors"] = _i18n_to_json(self.errors)
+        if self.input is not None:
+            # pandas' Table Schema JSON keeps the index and dtypes
+            values["input"] = json.loads(self.input.to_json(orient="table"))
+        return zlib.compress(
+            json.dumps(
+                {"version": SHARD_FORMAT_VERSION, **values},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode("utf-8")
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ShardResult":
+        try:
+            values = json.loads(zlib.decompress(data).decode("utf-8"))
+        except (zlib.error, UnicodeDecodeError, ValueError):
+            raise ValueError("Data is not a shard") from None
+        version = values.pop("version", None) if isinstance(values, dict) else None
+        if version != SHARD_FORMAT_VERSION:
+            raise ValueError(
+                "Shard format %r is not %d" % (version, SHARD_FORMAT_VERSION)
+            )
+        if values.keys() != set(cls.__slots__):
+            raise ValueError("Shard fields are not %r" % (cls.__slots__,))
+        values["warnings"] = _i18n_from_json(values["warnings"])
+        values["errors"] = _i18n_from_json(values["errors"])
+        if values["input"] is not None:
+            values["input"] = pd.read_json(
+                io.StringIO(json.dumps(values["input"])), orient="table"
+            )
+        shard = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(shard, name, values[name])
+        return shard
+
+
+def render_shard(
+    table,
+    params,
+    *,
+    settings,
+    start: int,
+    stop: int,
+    cache=None,
+    stats=None,
+    executor=None,
+) -> ShardResult:
+    """
+    Extract from rows [start, stop) (positions, not labels) of `table`.
+
+    Every shard gets the whole input `table` (rather than a slice), so each
+    shard records the input's shape for merge_shards(). That combines shards
+    that cover all rows into exactly what render() would return.
+
+    `cache`, `stats` and `executor` are as in render().
+    """
+    shard = ShardResult(params, list(table.columns), len(table), start, stop)
+    extractor, errors = _make_extractor(table, params, settings=settings)
+    if errors:
+        return shard  # merge_shards() finds them again
+    if extractor is None:
+        shard.input = table.iloc[start:stop]
+        return shard
+
+    # extract() yields nothing for null documents, unless it keeps them
+    positions = (
+        position
+        for position, html in zip(
+            itertools.count(start), table["html"].iloc[start:stop]
+        )
+        if html is not None or extractor.keeps_null_documents
+    )
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    try:
+        for position, rows in zip(
+            positions,
+            extractor.extract(
+                _iter_documents(table.iloc[start:stop]),
+                cache=cache,
+                stats=stats,
+                executor=executor,
+            ),
+        ):
+            accumulator.append_columns(rows.columns, rows.n_rows)
+            if shard.first_warning_row is None and rows.warnings:
+                shard.warnings = rows.warnings
+                shard.first_warning_row = position
+    except ExtractionError as err:
+        shard.errors = [err.i18n_message]
+        return shard
+
+    shard.columns = accumulator.columns
+    shard.n_rows = len(accumulator)
+    return shard
+
+
+def merge_shards(shards: List[ShardResult], *, settings):
+    """
+    Combine render_shard() results; return (table, warnings), as render().
+
+    Shards may come in any order, but together they must cover every input
+    row exactly once, with the same params. Raise ValueError otherwise.
+    """
+    shards = sorted(shards, key=lambda shard: (shard.start, shard.stop))
+    if not shards:
+        raise ValueError("There are no shards to merge")
+    first = shards[0]
+    position = 0
+    for shard in shards:
+        if (
+            shard.params != first.params
+            or shard.input_columns != first.input_columns
+            or shard.n_input_rows != first.n_input_rows
+        ):
+            raise ValueError("Shards come from different renders")
+        if shard.start != position:
+            raise ValueError(
+                "Shards skip or repeat rows, at row %d" % min(shard.start, position)
+            )
+        position = shard.stop
+    if position != first.n_input_rows:
+        raise ValueError("Shards stop at row %d of %d" % (position, first.n_input_rows))
+
+    # Column names are all our factories look at
+    extractor, errors = _make_extractor(
+        pd.DataFrame(columns=first.input_columns), first.params, settings=settings
+    )
+    if errors:
+        return None, errors
+    if extractor is None:
+        return pd.concat([shard.input for shard in shards]), []
+
+    # Like one render(): stop at the first error, and report the first
+    # document warnings.
+    accumulator = ColumnUnionAccumulator(extractor.output_columns)
+    warnings = []
+    for shard in shards:
+        if shard.errors:
+            return None, shard.errors
+        accumulator.append_columns(shard.columns, shard.n_rows)
+        if not warnings:
+            warnings = shard.warnings
+    return extractor.to_table(accumulator), warnings
 
 
 def _migrate_v0_to_v1(params):
     return {**params, "method": "xpath", "tablenum": 1}  # v0 had only xpath method
 
 
+def _migrate_v1_to_v2(params):
+    return {**params, "recordxpath": ""}  # v2 added xpath_records method
+
+
 def migrate_params(params):
     if "method" not in params:
         params = _migrate_v0_to_v1(params)
+    if "recordxpath" not in params:
+        params = _migrate_v1_to_v2(params)
     params.pop(
         "first_row_is_header", None
     )  # remove defunct key from a few early test wf
 
     return params
+
+
+# ---- Server ----
+#
+# A render() in a fresh interpreter spends most of its time before the first
+# page: importing pandas, html5lib, lxml and pyarrow, and compiling selectors.
+# serve() pays that once. It warms up, then forks workers that inherit its
+# imported modules; each worker keeps its compiled extractors (and table
+# inventories, and the optional ResultCache) warm across jobs.
+#
+# One job per connection. Both ways, a message is a header -- magic, then the
+# byte lengths of a JSON part and an Arrow IPC stream part -- then the parts:
+#
+# * request: {"params": ...} and the input table
+# * response: {"warnings": ...} and the output table (no bytes if None), or
+#   {"error": "..."} if the server couldn't render the job at all
+
+
+SERVER_MAGIC = b"XPE1"  # bump the digit when messages change
+_SERVER_HEADER = struct.Struct("!4sIQ")
+DEFAULT_SERVER_MAX_PENDING = 64  # connections waiting for a free worker
+DEFAULT_SERVER_MAX_REQUEST_BYTES = 1024 * 1024 * 1024
+DEFAULT_SERVER_REQUEST_TIMEOUT = 60.0  # seconds a worker waits on a client
+SERVER_EXTRACTOR_CACHE_SIZE = 100  # per worker
+
+
+class RenderServerError(Exception):
+    """
+    The server couldn't render a job: e.g., its request was malformed.
+
+    Extraction problems aren't server errors: they're render() warnings.
+    """
+
+
+def _i18n_to_json(value):
+    """
+    Make render() warnings JSON-serializable: I18nMessage => {"i18n": [...]}.
+    """
+    if isinstance(value, i18n.I18nMessage):
+        return {"i18n": list(value)}
+    elif isinstance(value, dict):
+        return {key: _i18n_to_json(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_i18n_to_json(item) for item in value]
+    else:
+        return value
+
+
+def _i18n_from_json(value):
+    """
+    Undo _i18n_to_json().
+    """
+    if isinstance(value, dict):
+        if value.keys() == {"i18n"}:
+            return i18n.I18nMessage(*value["i18n"])
+        return {key: _i18n_from_json(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_i18n_from_json(item) for item in value]
+    else:
+        return value
+
+
+def _table_to_arrow(table):
+    """
+    Serialize a pd.DataFrame (or None) as an Arrow IPC stream.
+    """
+    if table is None:
+        return b""
+    arrow_table = pa.Table.from_pandas(table)  # keeps the index, too
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    return sink.getvalue()
+
+
+def _table_from_arrow(data):
+    """
+    Undo _table_to_arrow().
+    """
+    if not len(data):
+        return None
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def _recv_exactly(connection, n: int) -> bytearray:
+    data = bytearray(n)
+    view = memoryview(data)
+    position = 0
+    while position < n:
+        n_read = connection.recv_into(view[position:])
+        if n_read == 0:
+            raise ConnectionError("Connection closed mid-message")
+        position += n_read
+    return data
+
+
+def _send_message(connection, header, body) -> None:
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    connection.sendall(_SERVER_HEADER.pack(SERVER_MAGIC, len(header_bytes), len(body)))
+    connection.sendall(header_bytes)
+    if len(body):
+        connection.sendall(body)
+
+
+def _recv_message(connection, max_bytes: Optional[int] = None):
+    """
+    Return (header, body); raise RenderServerError if it's malformed.
+    """
+    magic, header_length, body_length = _SERVER_HEADER.unpack(
+        _recv_exactly(connection, _SERVER_HEADER.size)
+    )
+    if magic != SERVER_MAGIC:
+        raise RenderServerError("Message does not start with %r" % SERVER_MAGIC)
+    if max_bytes is not None and header_length + body_length > max_bytes:
+        raise RenderServerError(
+            "Message is %d bytes; the limit is %d"
+            % (header_length + body_length, max_bytes)
+        )
+    header = json.loads(_recv_exactly(connection, header_length).decode("utf-8"))
+    return header, _recv_exactly(connection, body_length)
+
+
+class _RenderWorker:
+    """
+    What one forked worker keeps warm between jobs.
+    """
+
+    def __init__(self, *, settings, cache):
+        self.settings = settings
+        self.cache = cache
+        # LRU of _make_extractor() results. Extractors don't change after
+        # construction, and they only depend on params and input columns.
+        self.extractors = collections.OrderedDict()
+
+    def _make_extractor(self, table, params):
+        key = json.dumps([params, [str(name) for name in table.columns]])
+        try:
+            self.extractors.move_to_end(key)
+            return self.extractors[key]
+        except KeyError:
+            result = _make_extractor(table, params, settings=self.settings)
+            self.extractors[key] = result
+            if len(self.extractors) > SERVER_EXTRACTOR_CACHE_SIZE:
+                self.extractors.popitem(last=False)
+            return result
+
+    def render(self, table, params):
+        return _extract_all(
+            table, *self._make_extractor(table, params), cache=self.cache
+        )
+
+    def handle(self, connection, *, max_request_bytes: int) -> None:
+        """
+        Read one job from `connection`, and write its result.
+        """
+        import socket
+
+        try:
+            header, body = _recv_message(connection, max_request_bytes)
+            table = _table_from_arrow(body)
+            if table is None:
+                raise RenderServerError("Request has no input table")
+            result, warnings = self.render(table, header["params"])
+            response = {"warnings": _i18n_to_json(warnings)}, _table_to_arrow(result)
+        except (ConnectionError, socket.timeout):
+            return  # the client left (or stalled): there's nobody to tell
+        except Exception as err:
+            # This worker outlives the job: report, and move on
+            response = {"error": "%s: %s" % (type(err).__name__, err)}, b""
+        try:
+            _send_message(connection, *response)
+        except (ConnectionError, socket.timeout):
+            pass
+
+
+def _warm_up(settings) -> None:
+    """
+    Import (and initialize) what render() needs, so forked workers share it.
+    """
+    table = pd.DataFrame(
+        {"html": ["<table><tr><th>A</th></tr><tr><td>1</td></tr></table><p>x</p>"]}
+    )
+    for params in [
+        {
+            "method": "xpath",
+            "tablenum": 1,
+            "recordxpath": "",
+            "colselectors": [{"colxpath": "//p", "colname": "P"}],
+        },
+        {"method": "table", "tablenum": 1, "recordxpath": "", "colselectors": []},
+    ]:
+        result, _ = render(table, params, settings=settings)
+        _table_from_arrow(_table_to_arrow(result))
+
+
+def _serve_jobs(
+    listener, worker, *, max_request_bytes, max_jobs, request_timeout
+) -> None:
+    n_jobs = 0
+    while max_jobs is None or n_jobs < max_jobs:
+        connection, _ = listener.accept()
+        with connection:
+            connection.settimeout(request_timeout)
+            worker.handle(connection, max_request_bytes=max_request_bytes)
+        n_jobs += 1
+
+
+def serve(
+    path,
+    *,
+    settings,
+    n_workers: Optional[int] = None,
+    max_pending: int = DEFAULT_SERVER_MAX_PENDING,
+    max_request_bytes: int = DEFAULT_SERVER_MAX_REQUEST_BYTES,
+    max_jobs_per_worker: Optional[int] = None,
+    request_timeout: Optional[float] = DEFAULT_SERVER_REQUEST_TIMEOUT,
+    cache=None,
+) -> None:
+    """
+    Serve render() jobs on Unix socket `path`, until SIGTERM or SIGINT.
+
+    Clients connect with RenderClient. `path` appears once the server is warm
+    and listening. We fork `n_workers` (default: one per CPU) workers that
+    each take one job at a time from the socket. That's our back-pressure:
+    at most `n_workers` jobs run at once, `max_pending` more clients wait to
+    be accepted, and any more wait in connect(). Larger requests than
+    `max_request_bytes` get an error. A worker gives up on a client that
+    leaves it waiting `request_timeout` seconds (None: forever) for a read or
+    write, so idle clients can't hold every worker. A worker that has served
+    `max_jobs_per_worker` jobs exits, and we fork a fresh one, to cap the
+    memory a long-lived worker can hoard. `cache` is an optional ResultCache
+    (which the workers share) and `settings` are as in render().
+    """
+    import signal
+    import socket
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    temporary_path = "%s.%d" % (path, os.getpid())
+    listener.bind(temporary_path)
+    listener.listen(max_pending)
+    workers = set()
+    stop_signals = {signal.SIGTERM, signal.SIGINT}
+    forking = False
+    stop_requested = False
+
+    def stop(signum, frame):
+        nonlocal stop_requested
+        if forking:
+            stop_requested = True  # fork_worker() stops once it has the pid
+        else:
+            raise SystemExit(0)
+
+    previous_handlers = {signum: signal.signal(signum, stop) for signum in stop_signals}
+    try:
+        _warm_up(settings)
+        os.rename(temporary_path, path)  # clients may connect now
+        temporary_path = None
+
+        def fork_worker():
+            # Hold off stop signals until `workers` has the new pid: a signal
+            # between fork() and add() would make us stop without killing it.
+            # The mask covers the child until it resets its handlers. It only
+            # covers our calling thread, though, and other threads (e.g.,
+            # pyarrow's) may take the signal: hence `forking`.
+            nonlocal forking
+            forking = True
+            signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    try:
+                        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                        signal.signal(signal.SIGINT, signal.SIG_DFL)
+                        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+                        _serve_jobs(
+                            listener,
+                            _RenderWorker(settings=settings, cache=cache),
+                            max_request_bytes=max_request_bytes,
+                            max_jobs=max_jobs_per_worker,
+                            request_timeout=request_timeout,
+                        )
+                        status = 0
+                    except Exception:
+                        import traceback
+
+                        traceback.print_exc()
+                    finally:
+                        os._exit(status)  # never run the parent's cleanup
+                workers.add(pid)
+            finally:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+                forking = False
+            if stop_requested:
+                raise SystemExit(0)
+
+        for _ in range(n_workers):
+            fork_worker()
+        while True:
+            pid, status = os.wait()
+            workers.discard(pid)
+            if status != 0:
+                time.sleep(1)  # don't spin if workers die on startup
+            fork_worker()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            os.waitpid(pid, 0)
+        listener.close()
+        if temporary_path is None:
+            temporary_path = path
+        try:
+            os.unlink(temporary_path)
+        except FileNotFoundError:
+            pass
+
+
+class RenderClient:
+    """
+    Send render() jobs to a serve() process.
+
+    Each render() opens its own connection, so threads may share a client.
+    """
+
+    def __init__(self, path, *, timeout: Optional[float] = None):
+        self.path = path
+        self.timeout = timeout  # seconds, including the wait for a worker
+
+    def render(self, table, params):
+        """
+        Like render(), with the server's settings; return (table, warnings).
+
+        Raise RenderServerError if the server can't render the job, and
+        OSError if we can't talk to the server.
+        """
+        import socket
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(str(self.path))
+            try:
+                _send_message(connection, {"params": params}, _table_to_arrow(table))
+            except BrokenPipeError:
+                pass  # the server rejected our request: read why
+            header, body = _recv_message(connection)
+        if "error" in header:
+            raise RenderServerError(header["error"])
+        return _table_from_arrow(body), _i18n_from_json(header["warnings"])